@@ -4,6 +4,8 @@ from qgis.PyQt.QtWidgets import QAction, QToolBar
 from qgis.PyQt.QtGui import QIcon
 from .gui.package_dialog import PackageDialog
 from .gui.loader_dialog import LayerLoaderDialog
+from .core.layer_roles import unload_layer_roles
+from .core.style_cache import unwatch_project_styles, watch_project_styles
 from qgis.core import QgsProject
 
 class AuQCBMS:
@@ -28,6 +30,9 @@ class AuQCBMS:
         self.iface.addPluginToMenu("&GMD Plugins", self.action)
         self.iface.addPluginToMenu("&GMD Plugins", self.validator_action)
 
+        # Drop the style fingerprints of layers whose style is edited by hand
+        watch_project_styles(QgsProject.instance())
+
     def unload(self):
         # Remove the actions from the toolbar and the menu
         if self.toolbar:
@@ -37,6 +42,10 @@ class AuQCBMS:
         self.iface.removePluginMenu("&GMD Plugins", self.action)
         self.iface.removePluginMenu("&GMD Plugins", self.validator_action)
 
+        # Stop tracking the project's layers
+        unload_layer_roles()
+        unwatch_project_styles()
+
     def run(self):
         if not self.dialog:
             self.dialog = PackageDialog(self.iface, QgsProject.instance(), False)
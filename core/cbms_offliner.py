@@ -0,0 +1,408 @@
+"""
+    Offliner copying the CBMS layers with one filtered OGR translation each.
+
+    ``QgisCoreOffliner`` and ``PythonMiniOffliner`` copy the offline layers
+    feature by feature through QGIS providers, so packaging a dense barangay
+    is bound by Python and provider overhead. The offliner below hands each
+    OGR layer to ``gdal.VectorTranslate`` instead: the layer's subset string
+    (the geocode predicate set by the package dialog) becomes the OGR
+    ``WHERE`` clause, the area of interest becomes the spatial filter, rows
+    are written in large transactions and the spatial indexes are built once
+    every table has been filled. Layers of other providers fall back to the
+    feature by feature copy of ``PythonMiniOffliner``.
+
+    When the package folder already holds the offline database of a
+    previous export, only the tables whose fingerprint (source files,
+    subset string, area of interest) changed are rewritten, see
+    core/package_fingerprints.py.
+
+    Only the fields the layer's form and style use are copied, see
+    core/column_projection.py and ``projected_fields``.
+"""
+
+import hashlib
+import os
+import xml.etree.ElementTree as ET
+from typing import Dict, List, NamedTuple, Optional, Set
+
+from libqfieldsync.offliners import (
+    PROJECT_ENTRY_KEY_OFFLINE_DB_PATH,
+    PROJECT_ENTRY_SCOPE_OFFLINE,
+    BaseOffliner,
+    OfflinerType,
+    PythonMiniOffliner,
+    QgisCoreOffliner,
+)
+from osgeo import gdal, ogr
+from qgis.core import (
+    QgsCoordinateTransform,
+    QgsFileUtils,
+    QgsMapLayer,
+    QgsOfflineEditing,
+    QgsProject,
+    QgsProviderRegistry,
+    QgsRectangle,
+    QgsVectorLayer,
+)
+from qgis.PyQt.QtXml import QDomDocument
+
+from .column_projection import AllFields, expression_fields, referenced_fields
+from .gpkg_compaction import remove_database
+from .gpkg_export import sql_string
+from .layer_roles import configured_roles, suffix_role
+from .package_fingerprints import (
+    changed_keys,
+    database_fingerprint,
+    dataset_files,
+    file_state,
+    fingerprint,
+    read_fingerprints,
+    write_fingerprints,
+)
+from .qml_config import KEEP_ALL_FIELDS, qml_config
+
+CBMS_OFFLINER = "cbms"
+# Offliners selectable with the `offliner` preference, see core/preferences.py
+OFFLINER_TYPES = (CBMS_OFFLINER, OfflinerType.QGISCORE.value, OfflinerType.PYTHONMINI.value)
+OFFLINER_LABELS = {
+    CBMS_OFFLINER: "CBMS (re-exports changed tables, only the fields forms use)",
+    OfflinerType.QGISCORE.value: "QGIS core",
+    OfflinerType.PYTHONMINI.value: "Python mini",
+}
+
+# Rows per transaction, large enough for a barangay to be written in a single one
+TRANSACTION_SIZE = 100000
+GEOMETRY_COLUMN = "geom"
+
+# SQLite settings used while the package is written, a failed export is redone from scratch anyway
+WRITE_CONFIG_OPTIONS = {
+    "OGR_SQLITE_SYNCHRONOUS": "OFF",
+    "OGR_SQLITE_CACHE": "512",
+}
+
+
+class OgrSource(NamedTuple):
+    path: str
+    layer_name: str
+
+
+def ogr_source(layer: QgsVectorLayer) -> Optional[OgrSource]:
+    """Return the dataset and layer an OGR backed layer reads from, None for other providers."""
+    if layer.providerType() != "ogr":
+        return None
+
+    parts = QgsProviderRegistry.instance().decodeUri("ogr", layer.source())
+    path = parts.get("path")
+    if not path:
+        return None
+
+    layer_name = parts.get("layerName")
+    if not layer_name:
+        dataset = ogr.Open(path)
+        if dataset is None:
+            return None
+        layer_index = parts.get("layerId") or 0
+        source_layer = dataset.GetLayer(int(layer_index))
+        if source_layer is None:
+            return None
+        layer_name = source_layer.GetName()
+    return OgrSource(path, layer_name)
+
+
+def ogr_field_names(source: OgrSource) -> Set[str]:
+    dataset = ogr.Open(source.path)
+    source_layer = dataset.GetLayerByName(source.layer_name) if dataset is not None else None
+    if source_layer is None:
+        return set()
+    definition = source_layer.GetLayerDefn()
+    return {definition.GetFieldDefn(index).GetName() for index in range(definition.GetFieldCount())}
+
+
+def offline_table_name(layer: QgsVectorLayer) -> str:
+    # Layers reading the same table with the same filter share one offline table
+    key = layer.dataProvider().dataSourceUri() + "\n" + layer.subsetString()
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _related_fields(layer: QgsVectorLayer) -> Set[str]:
+    """Return the fields of the layer other layers rely on: keys, relations, joins and value relations."""
+    project = QgsProject.instance()
+    fields = layer.fields()
+    related = {fields.at(index).name() for index in layer.primaryKeyAttributes()}
+    related |= {join.targetFieldName() for join in layer.vectorJoins()}
+
+    relation_manager = project.relationManager()
+    for relation in relation_manager.referencingRelations(layer):
+        related |= {fields.at(index).name() for index in relation.referencingFields()}
+    for relation in relation_manager.referencedRelations(layer):
+        related |= {fields.at(index).name() for index in relation.referencedFields()}
+
+    field_names = [field.name() for field in fields]
+    for other_layer in project.mapLayers().values():
+        if other_layer.type() != QgsMapLayer.VectorLayer:
+            continue
+        for join in other_layer.vectorJoins():
+            if join.joinLayerId() != layer.id():
+                continue
+            related.add(join.joinFieldName())
+            # No subset, the join takes every field of the layer
+            subset = join.joinFieldNamesSubset()
+            related |= set(field_names) if subset is None else set(subset)
+        for index in range(other_layer.fields().count()):
+            widget_setup = other_layer.editorWidgetSetup(index)
+            config = widget_setup.config()
+            if widget_setup.type() != "ValueRelation" or layer.id() not in (config.get("Layer"), config.get("LayerName")):
+                continue
+            related |= {config.get("Key"), config.get("Value")}
+            try:
+                related |= expression_fields(config.get("FilterExpression") or "", field_names)
+            except AllFields:
+                related |= set(field_names)
+    return related
+
+
+def projected_fields(layer: QgsVectorLayer) -> Optional[List[str]]:
+    """Return the source fields to copy into the package, None to copy them all.
+
+    Those are the fields the layer's form, style and subset string use,
+    the fields other layers rely on and the ones listed for its role under ``keep_fields``
+    in qml_config.json, where ``"*"`` keeps every field.
+    """
+    keep_fields = qml_config().keep_fields(suffix_role(layer.name(), configured_roles()))
+    if keep_fields == KEEP_ALL_FIELDS:
+        return None
+
+    document = QDomDocument()
+    layer.exportNamedStyle(document)
+    field_names = [field.name() for field in layer.dataProvider().fields()]
+    referenced = referenced_fields(ET.fromstring(document.toString()), field_names)
+    if referenced is None:
+        return None
+
+    referenced |= set(keep_fields) | _related_fields(layer)
+    # The subset string is set again on the offline table
+    referenced |= expression_fields(layer.subsetString(), field_names)
+    return [name for name in field_names if name in referenced]
+
+
+def merge_fields(fields: Optional[List[str]], other_fields: Optional[List[str]]) -> Optional[List[str]]:
+    """Return the fields needed by two layers sharing a table."""
+    if fields is None or other_fields is None:
+        return None
+    return fields + [name for name in other_fields if name not in fields]
+
+
+def fid_column(layer: QgsVectorLayer) -> str:
+    fid = "fid"
+    counter = 1
+    while layer.dataProvider().fields().lookupField(fid) >= 0:
+        fid = f"fid_{counter}"
+        counter += 1
+    return fid
+
+
+class CbmsOffliner(PythonMiniOffliner):
+    def convert_to_offline(
+        self,
+        offline_db_filename: str,
+        layers: List[QgsMapLayer],
+        bbox: Optional[QgsRectangle],
+    ) -> bool:
+        project = QgsProject.instance()
+        offline_db_filename = str(offline_db_filename)
+        layers = [
+            layer for layer in layers
+            if layer.type() == QgsMapLayer.VectorLayer and layer.isValid()
+        ]
+
+        previous_options = {key: gdal.GetConfigOption(key) for key in WRITE_CONFIG_OPTIONS}
+        for key, value in WRITE_CONFIG_OPTIONS.items():
+            gdal.SetConfigOption(key, value)
+        try:
+            sources = self._translate_layers(offline_db_filename, layers, bbox)
+        finally:
+            for key, value in previous_options.items():
+                gdal.SetConfigOption(key, value)
+
+        for layer in layers:
+            subset_string = layer.subsetString()
+            self.update_data_provider(layer, sources[layer.id()])
+            layer.setSubsetString(subset_string)
+
+        project.writeEntry(
+            PROJECT_ENTRY_SCOPE_OFFLINE,
+            PROJECT_ENTRY_KEY_OFFLINE_DB_PATH,
+            project.writePath(offline_db_filename),
+        )
+        return True
+
+    def _translate_layers(
+        self,
+        offline_db_filename: str,
+        layers: List[QgsVectorLayer],
+        bbox: Optional[QgsRectangle],
+    ) -> Dict[str, str]:
+        """Copy the layers into the package and return the new source of each layer id.
+
+        Tables left by the previous export of the package whose fingerprint
+        did not change are kept as they are.
+        """
+        self.progressModeSet.emit(QgsOfflineEditing.CopyFeatures, 100)
+
+        package_folder = os.path.dirname(offline_db_filename)
+        fingerprints = read_fingerprints(package_folder)
+        if os.path.exists(offline_db_filename) and fingerprints.get("database") == database_fingerprint(offline_db_filename):
+            previous_tables = fingerprints.get("tables", {})
+        else:
+            # Unknown or modified since it was written, start from scratch
+            remove_database(offline_db_filename)
+            previous_tables = {}
+
+        sources: Dict[str, str] = {}
+        tables: Dict[str, str] = {}
+        table_fingerprints: Dict[str, str] = {}
+        # Source fields copied into each table, None for all of them
+        table_fields: Dict[str, Optional[List[str]]] = {}
+        translations: List[tuple] = []
+        fallback_layers: List[QgsVectorLayer] = []
+
+        for layer in layers:
+            table_name = offline_table_name(layer)
+            if table_name in tables:
+                sources[layer.id()] = tables[table_name]
+                table_fields[table_name] = merge_fields(table_fields[table_name], projected_fields(layer))
+                continue
+
+            source = ogr_source(layer)
+            if source is None:
+                fallback_layers.append(layer)
+                continue
+
+            tables[table_name] = f"{offline_db_filename}|layername={table_name}"
+            sources[layer.id()] = tables[table_name]
+            table_fields[table_name] = projected_fields(layer)
+            translations.append((layer, source, table_name))
+
+        for layer, source, table_name in translations:
+            if table_fields[table_name] is not None:
+                # QGIS lists the GeoPackage FID column among the fields, OGR does not
+                source_fields = ogr_field_names(source)
+                table_fields[table_name] = [name for name in table_fields[table_name] if name in source_fields]
+            table_fingerprints[table_name] = self._table_fingerprint(layer, source, bbox, table_fields[table_name])
+
+        existing_tables = self._remove_stale_tables(offline_db_filename, previous_tables, table_fingerprints)
+        dataset_created = os.path.exists(offline_db_filename)
+        spatial_tables: List[str] = []
+
+        for index, (layer, source, table_name) in enumerate(translations):
+            self.layerProgressUpdated.emit(index + 1, len(translations))
+            if table_name in existing_tables:
+                continue
+
+            options = gdal.VectorTranslateOptions(
+                format="GPKG",
+                accessMode="update" if dataset_created else None,
+                layers=[source.layer_name],
+                layerName=table_name,
+                selectFields=table_fields[table_name],
+                where=layer.subsetString() or None,
+                spatFilter=self._spatial_filter(layer, bbox),
+                transactionSize=TRANSACTION_SIZE,
+                layerCreationOptions=[
+                    f"FID={fid_column(layer)}",
+                    f"GEOMETRY_NAME={GEOMETRY_COLUMN}",
+                    # Built once at the end instead of being updated row by row
+                    "SPATIAL_INDEX=NO",
+                    f"IDENTIFIER={table_name}",
+                    f"DESCRIPTION={layer.dataComment()}",
+                ],
+                callback=self._on_translate_progress,
+            )
+            if gdal.VectorTranslate(offline_db_filename, source.path, options=options) is None:
+                raise RuntimeError(f"Failed to copy {layer.name()} into {offline_db_filename}: {gdal.GetLastErrorMsg()}")
+            dataset_created = True
+
+            if layer.isSpatial():
+                spatial_tables.append(table_name)
+
+        print(f"Kept {len(existing_tables)} unchanged offline tables, rewrote {len(translations) - len(existing_tables)}")
+
+        data_source = ogr.Open(offline_db_filename, 1) if dataset_created else ogr.GetDriverByName("GPKG").CreateDataSource(offline_db_filename)
+        try:
+            for table_name in spatial_tables:
+                result = data_source.ExecuteSQL(f"SELECT CreateSpatialIndex({sql_string(table_name)}, {sql_string(GEOMETRY_COLUMN)})")
+                data_source.ReleaseResultSet(result)
+
+            # Layers of other providers (memory, delimited text, ...) are copied feature by feature
+            for layer in fallback_layers:
+                self.create_layer(layer, data_source, offline_db_filename)
+                sources[layer.id()] = self.convert_to_offline_layer(layer, data_source, offline_db_filename)
+        finally:
+            data_source = None
+
+        fingerprints["tables"] = table_fingerprints
+        fingerprints["database"] = database_fingerprint(offline_db_filename)
+        write_fingerprints(package_folder, fingerprints)
+        return sources
+
+    @staticmethod
+    def _remove_stale_tables(
+        offline_db_filename: str,
+        previous_tables: Dict[str, str],
+        table_fingerprints: Dict[str, str],
+    ) -> Set[str]:
+        """Drop the tables of the previous export that changed or are gone, return the ones kept."""
+        if not previous_tables:
+            return set()
+
+        data_source = ogr.Open(offline_db_filename, 1)
+        if data_source is None:
+            return set()
+        try:
+            layer_names = {data_source.GetLayer(index).GetName() for index in range(data_source.GetLayerCount())}
+            kept = (set(table_fingerprints) - set(changed_keys(previous_tables, table_fingerprints))) & layer_names
+            for table_name in sorted((set(previous_tables) & layer_names) - kept):
+                data_source.DeleteLayer(table_name)
+        finally:
+            data_source = None
+        return kept
+
+    def _table_fingerprint(
+        self,
+        layer: QgsVectorLayer,
+        source: OgrSource,
+        bbox: Optional[QgsRectangle],
+        fields: Optional[List[str]],
+    ) -> str:
+        # Shapefiles keep their attributes in sidecar files, GeoPackages may have changes in their WAL
+        source_files = set(dataset_files(source.path)) | set(QgsFileUtils.sidecarFilesForPath(source.path))
+        return fingerprint(
+            file_state(source_files),
+            source.layer_name,
+            layer.subsetString(),
+            self._spatial_filter(layer, bbox),
+            fid_column(layer),
+            layer.dataComment(),
+            fields,
+        )
+
+    def _on_translate_progress(self, complete, _message, _data):
+        self.progressUpdated.emit(int(complete * 100))
+        return 1
+
+    @staticmethod
+    def _spatial_filter(layer: QgsVectorLayer, bbox: Optional[QgsRectangle]):
+        if not bbox or not bbox.isFinite() or not layer.isSpatial():
+            return None
+        project = QgsProject.instance()
+        layer_bbox = QgsCoordinateTransform(project.crs(), layer.crs(), project).transformBoundingBox(bbox)
+        return (layer_bbox.xMinimum(), layer_bbox.yMinimum(), layer_bbox.xMaximum(), layer_bbox.yMaximum())
+
+
+def create_offliner(offliner_type: Optional[str], offline_editing=None) -> BaseOffliner:
+    """Return a new offliner of the given type, the QGIS core offliner for unknown types."""
+    if offliner_type == CBMS_OFFLINER:
+        return CbmsOffliner()
+    if offliner_type == OfflinerType.PYTHONMINI.value:
+        return PythonMiniOffliner()
+    return QgisCoreOffliner(offline_editing=offline_editing)
@@ -0,0 +1,111 @@
+"""
+    Fields of a layer that its style and form actually use.
+
+    The master layers carry working columns enumerators never see: Form 2
+    has over 200 fields and only some of them are in its form layout. The
+    offline copies only need the fields referenced by the drag and drop
+    form (fields, container visibility and collapse expressions), default
+    values, constraints, labels, renderers, conditional styles, widget
+    configurations, actions, the display expression and the map tip. The
+    functions below find them in the QML of a layer; everything else can
+    be left out of the package.
+
+    References are matched generously: any identifier, quoted name or
+    string literal equal to a field name counts, so a field is only dropped
+    when nothing could refer to it. Forms generated from the fields or
+    loaded from a ``.ui`` file show every field, as do expressions using
+    ``attributes()``, and keep the whole layer.
+"""
+
+import re
+import xml.etree.ElementTree as ET
+from typing import Iterable, Optional, Set
+
+# Form layouts that show every field of the layer
+FULL_FORM_LAYOUTS = ("generatedlayout", "uifilelayout")
+# Attributes holding an expression or a field name, wherever they appear in the QML
+EXPRESSION_ATTRIBUTES = (
+    "exp", "expression", "filter", "attr", "fieldName", "visibilityExpression",
+    "collapsedExpression", "action", "rule", "sizeFieldName", "rotationField",
+    # QML, HTML and text widgets of the form
+    "qmlCode", "htmlCode", "text",
+)
+# Names of the <Option> values holding an expression or a field name
+EXPRESSION_OPTIONS = ("expression", "field", "FilterExpression", "Key", "Value", "Description", "DisplayExpression")
+# Sections listing every field of the layer, they do not say a field is used
+FIELD_LISTS = ("fieldConfiguration", "aliases", "constraints", "editable", "labelOnTop", "reuseLastValue", "attributetableconfig")
+
+QUOTED_NAME = re.compile(r'"((?:[^"]|"")*)"')
+STRING_LITERAL = re.compile(r"'((?:[^']|'')*)'")
+IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+ALL_ATTRIBUTES = re.compile(r"\battributes\s*\(", re.IGNORECASE)
+
+
+class AllFields(Exception):
+    """An expression may read any field of the layer."""
+
+
+def expression_fields(expression: str, field_names: Iterable[str]) -> Set[str]:
+    """Return the fields an expression may refer to."""
+    if not expression:
+        return set()
+    if ALL_ATTRIBUTES.search(expression):
+        raise AllFields(expression)
+
+    by_name = {name.lower(): name for name in field_names}
+    # A bare field name, as in labeling settings
+    tokens = [expression.strip()]
+    tokens += [name.replace('""', '"') for name in QUOTED_NAME.findall(expression)]
+    tokens += [value.replace("''", "'") for value in STRING_LITERAL.findall(expression)]
+    tokens += IDENTIFIER.findall(expression)
+    return {by_name[token.lower()] for token in tokens if token.lower() in by_name}
+
+
+def _section_fields(element: ET.Element, field_names: Iterable[str]) -> Set[str]:
+    fields = set()
+    for child in element.iter():
+        for attribute in EXPRESSION_ATTRIBUTES:
+            fields |= expression_fields(child.get(attribute, ""), field_names)
+        if child.tag == "Option" and child.get("name") in EXPRESSION_OPTIONS:
+            fields |= expression_fields(child.get("value", ""), field_names)
+    return fields
+
+
+def referenced_fields(style: ET.Element, field_names: Iterable[str]) -> Optional[Set[str]]:
+    """Return the fields used by the style of a layer, None when it may use all of them.
+
+    ``style`` is the root of a QML document or the ``maplayer`` element
+    of a project.
+    """
+    field_names = list(field_names)
+    if (style.findtext("editorlayout") or "generatedlayout").strip() in FULL_FORM_LAYOUTS:
+        return None
+
+    fields = set()
+    try:
+        form = style.find("attributeEditorForm")
+        if form is not None:
+            fields |= {element.get("name") for element in form.iter("attributeEditorField")}
+            fields |= _section_fields(form, field_names)
+
+        for default in style.iterfind("defaults/default"):
+            if default.get("expression"):
+                fields |= {default.get("field")} | expression_fields(default.get("expression"), field_names)
+        for constraint in style.iterfind("constraintExpressions/constraint"):
+            if constraint.get("exp"):
+                fields |= {constraint.get("field")} | expression_fields(constraint.get("exp"), field_names)
+
+        # Widget configurations (value relation filters, ...) are the one part of the field lists that refers to fields
+        for widget in style.iterfind("fieldConfiguration/field/editWidget"):
+            fields |= _section_fields(widget, field_names)
+
+        for section in style:
+            if section.tag not in FIELD_LISTS and section.tag not in ("attributeEditorForm", "defaults", "constraintExpressions"):
+                fields |= _section_fields(section, field_names)
+
+        for tag in ("previewExpression", "mapTip"):
+            fields |= expression_fields(style.findtext(tag) or "", field_names)
+    except AllFields:
+        return None
+
+    return {field for field in fields if field in field_names}
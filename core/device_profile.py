@@ -0,0 +1,191 @@
+"""
+    Device performance profiles for packaged projects.
+
+    QField runs on low-end Android phones, while the CBMS styles are tuned
+    for desktop QGIS: no scale-dependent visibility, no geometry
+    simplification and no label limits, so every building point and road
+    label is drawn at every zoom level. A device profile rewrites the
+    exported ``.qgs`` after packaging with scale ranges, simplification,
+    label limits and cache friendly refresh settings per CBMS layer. The
+    source QML files and the desktop project are left untouched.
+
+    The profile is chosen with the ``deviceProfile`` preference, see
+    ``core/preferences.py``.
+"""
+
+import os
+import tempfile
+import xml.etree.ElementTree as ET
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from .style_compiler import DOCTYPE
+
+DEFAULT_DEVICE_PROFILE = "low_end"
+
+
+class LayerLimits(NamedTuple):
+    # Scale denominators, the layer and its labels are hidden when zoomed out beyond them
+    max_denominator: Optional[float] = None
+    label_max_denominator: Optional[float] = None
+    max_labels: Optional[int] = None
+    # Whether labels of other layers avoid this layer's features
+    label_obstacle: Optional[bool] = None
+
+
+class DeviceProfile(NamedTuple):
+    name: str
+    # Simplification tolerance in pixels for line and polygon layers, None to keep the style's
+    simplify_tolerance: Optional[float]
+    # Limits by layer role, matched as the ``_<role>`` suffix of the layer name
+    layers: Dict[str, LayerLimits]
+
+
+DEVICE_PROFILES = {
+    "full": DeviceProfile("full", None, {}),
+    "standard": DeviceProfile("standard", 1.0, {
+        "bldg_point": LayerLimits(10000, 2500, 1000),
+        "SF": LayerLimits(10000, 2500, 1000),
+        "GP": LayerLimits(10000, 2500, 1000),
+        "landmark": LayerLimits(25000, 10000, 300),
+        "block": LayerLimits(50000, 10000, 500),
+        "block2024": LayerLimits(50000, 10000, 500),
+        "road": LayerLimits(50000, 10000, 500),
+        "river": LayerLimits(100000, 25000, 200),
+        "ea": LayerLimits(None, 50000, 200),
+        "ea2024": LayerLimits(None, 50000, 200),
+        "bgy": LayerLimits(None, 100000, 100),
+    }),
+    "low_end": DeviceProfile("low_end", 2.0, {
+        "bldg_point": LayerLimits(5000, 1500, 300, label_obstacle=False),
+        "SF": LayerLimits(5000, 1500, 300, label_obstacle=False),
+        "GP": LayerLimits(5000, 1500, 300, label_obstacle=False),
+        "landmark": LayerLimits(10000, 5000, 100),
+        "block": LayerLimits(25000, 5000, 200),
+        "block2024": LayerLimits(25000, 5000, 200),
+        "road": LayerLimits(25000, 5000, 200),
+        "river": LayerLimits(50000, 10000, 100),
+        "ea": LayerLimits(None, 25000, 100),
+        "ea2024": LayerLimits(None, 25000, 100),
+        "bgy": LayerLimits(None, 50000, 50),
+    }),
+}
+
+
+def device_profile(name: Optional[str]) -> DeviceProfile:
+    """Return a profile by name, falling back to the default for unknown names."""
+    return DEVICE_PROFILES.get(name or "", DEVICE_PROFILES[DEFAULT_DEVICE_PROFILE])
+
+
+def layer_role(layer_name: str, roles) -> Optional[str]:
+    """Return the role whose ``_<role>`` suffix ends the layer name, preferring the longest."""
+    for role in sorted(roles, key=len, reverse=True):
+        if layer_name.endswith(f"_{role}"):
+            return role
+    return None
+
+
+def _tightened(current: Optional[str], limit: float) -> str:
+    # Scale denominators where 0 means no limit
+    current = float(current or 0)
+    return "{:g}".format(limit if current <= 0 else min(current, limit))
+
+
+def _limit_layer_scale(maplayer: ET.Element, denominator: float):
+    # QGIS calls the zoomed out limit minScale
+    if maplayer.get("hasScaleBasedVisibilityFlag") == "1":
+        maplayer.set("minScale", _tightened(maplayer.get("minScale"), denominator))
+    else:
+        maplayer.set("hasScaleBasedVisibilityFlag", "1")
+        maplayer.set("minScale", "{:g}".format(denominator))
+        maplayer.set("maxScale", "0")
+
+
+def _limit_labels(maplayer: ET.Element, limits: LayerLimits):
+    labeling = maplayer.find("labeling")
+    if labeling is None:
+        return
+
+    for rendering in labeling.iter("rendering"):
+        if limits.label_max_denominator is not None:
+            # Label settings store the zoomed out limit as scaleMax
+            if rendering.get("scaleVisibility") == "1":
+                rendering.set("scaleMax", _tightened(rendering.get("scaleMax"), limits.label_max_denominator))
+            else:
+                rendering.set("scaleVisibility", "1")
+                rendering.set("scaleMax", "{:g}".format(limits.label_max_denominator))
+                rendering.set("scaleMin", "0")
+
+        if limits.max_labels is not None:
+            current = int(rendering.get("maxNumLabels") or 0) if rendering.get("limitNumLabels") == "1" else 0
+            rendering.set("limitNumLabels", "1")
+            rendering.set("maxNumLabels", str(min(current, limits.max_labels) if current > 0 else limits.max_labels))
+
+        if limits.label_obstacle is not None:
+            rendering.set("obstacle", "1" if limits.label_obstacle else "0")
+
+
+def _simplify(maplayer: ET.Element, tolerance: float):
+    # Points have nothing to simplify
+    if maplayer.get("geometry") not in ("Line", "Polygon"):
+        return
+    maplayer.set("simplifyDrawingHints", "1")
+    maplayer.set("simplifyAlgorithm", "0")
+    maplayer.set("simplifyDrawingTol", "{:g}".format(tolerance))
+    maplayer.set("simplifyLocal", "1")
+    maplayer.set("simplifyMaxScale", "1")
+
+
+def _keep_render_cache(maplayer: ET.Element):
+    # Timed and notification refreshes invalidate the layer's cached render image
+    for attribute in ("autoRefreshEnabled", "refreshOnNotifyEnabled"):
+        if maplayer.get(attribute) == "1":
+            maplayer.set(attribute, "0")
+    if maplayer.get("autoRefreshMode") not in (None, "Disabled"):
+        maplayer.set("autoRefreshMode", "Disabled")
+
+
+def apply_profile_to_maplayer(maplayer: ET.Element, profile: DeviceProfile) -> bool:
+    """Patch the profile into a ``<maplayer>`` element. Returns False when no limits apply to it."""
+    role = layer_role(maplayer.findtext("layername", ""), profile.layers)
+    if maplayer.get("type") != "vector" or role is None:
+        return False
+
+    limits = profile.layers[role]
+    if limits.max_denominator is not None:
+        _limit_layer_scale(maplayer, limits.max_denominator)
+    _limit_labels(maplayer, limits)
+    if profile.simplify_tolerance is not None:
+        _simplify(maplayer, profile.simplify_tolerance)
+    _keep_render_cache(maplayer)
+    return True
+
+
+def apply_profile_xml(xml_bytes: bytes, profile: DeviceProfile) -> Tuple[Optional[bytes], List[str]]:
+    """Apply a device profile to project XML. Returns the new XML (None when nothing applies) and the patched layer names."""
+    root = ET.fromstring(xml_bytes)
+    patched = [
+        maplayer.findtext("layername", "")
+        for maplayer in root.iter("maplayer")
+        if apply_profile_to_maplayer(maplayer, profile)
+    ]
+    if not patched:
+        return None, patched
+    return (DOCTYPE + "\n").encode("utf-8") + ET.tostring(root, encoding="utf-8", xml_declaration=False), patched
+
+
+def apply_device_profile(project_path: str, profile: DeviceProfile) -> List[str]:
+    """Apply a device profile to an exported .qgs project in place and return the patched layer names."""
+    with open(project_path, "rb") as f:
+        xml_bytes, patched = apply_profile_xml(f.read(), profile)
+    if xml_bytes is None:
+        return patched
+
+    handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(project_path), suffix=".tmp")
+    try:
+        with os.fdopen(handle, "wb") as f:
+            f.write(xml_bytes)
+        os.replace(temp_path, project_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return patched
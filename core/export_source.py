@@ -0,0 +1,56 @@
+"""
+    Read access to a CBMS field export.
+
+    An export is either a folder extracted by hand or the zip archive the
+    field teams deliver. Archives are read in place through GDAL's
+    ``/vsizip/`` virtual filesystem, so only the writable layers that the
+    loader creates have to be materialized on disk.
+"""
+
+import os
+import zipfile
+from typing import Dict, List
+
+
+class ExportSource:
+    """A CBMS export folder or zip archive."""
+
+    def __init__(self, path: str):
+        self.path = os.path.normpath(path)
+        self.is_archive = os.path.isfile(self.path) and zipfile.is_zipfile(self.path)
+
+        # Maps a file name to its location inside the export. Archives are often
+        # zipped with a top-level folder, so members are looked up by base name.
+        self._members: Dict[str, str] = {}
+        if self.is_archive:
+            with zipfile.ZipFile(self.path) as archive:
+                for member in archive.namelist():
+                    if not member.endswith("/"):
+                        self._members.setdefault(os.path.basename(member), member)
+        else:
+            folder = self.path if os.path.isdir(self.path) else os.path.dirname(self.path)
+            self.path = folder
+            for file in os.listdir(folder):
+                if os.path.isfile(os.path.join(folder, file)):
+                    self._members[file] = file
+
+    @property
+    def output_folder(self) -> str:
+        """Folder that receives the writable layers and the project file."""
+        if self.is_archive:
+            return os.path.splitext(self.path)[0]
+        return self.path
+
+    def list_files(self) -> List[str]:
+        """Return the names of all files in the export."""
+        return sorted(self._members)
+
+    def has_file(self, name: str) -> bool:
+        return name in self._members
+
+    def dataset_path(self, name: str) -> str:
+        """Return a path GDAL/OGR and the QGIS providers can open for ``name``."""
+        member = self._members[name]
+        if self.is_archive:
+            return "/vsizip/{}/{}".format(self.path.replace("\\", "/"), member)
+        return os.path.join(self.path, member)
@@ -0,0 +1,120 @@
+"""
+    Compaction of the GeoPackages of an exported package.
+
+    The offline conversion leaves GeoPackages with free pages (tables
+    dropped or rewritten by an incremental export), the page size they were
+    created with and no statistics for the query planner. Before a package
+    goes to the devices every GeoPackage in it is finalized: R-tree tables
+    left behind by dropped tables are removed, the page size is tuned and
+    the file rebuilt with ``VACUUM`` when that changes anything, ``ANALYZE``
+    collects statistics and ``PRAGMA quick_check`` verifies the result.
+
+    Files hard-linked from the shared store (see core/package_store.py) are
+    left alone, rewriting them would change every package sharing them.
+"""
+
+import os
+import sqlite3
+from contextlib import closing
+from typing import List, NamedTuple
+
+from .package_manifest import package_files
+
+# Fewer B-tree levels for tables of geometry blobs, read page by page from flash on devices
+PAGE_SIZE = 8192
+# Files SQLite may keep next to a database
+SIDECAR_SUFFIXES = ("-wal", "-shm", "-journal")
+
+
+class CompactionResult(NamedTuple):
+    path: str
+    size_before: int
+    size_after: int
+    # "ok", or what PRAGMA quick_check found
+    check: str
+    vacuumed: bool
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.size_before - self.size_after
+
+
+def remove_database(path: str):
+    """Delete a SQLite database together with its sidecar files."""
+    for suffix in ("",) + SIDECAR_SUFFIXES:
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def _database_size(path: str) -> int:
+    return sum(os.path.getsize(path + suffix) for suffix in ("", "-wal", "-journal") if os.path.exists(path + suffix))
+
+
+def orphan_rtree_tables(connection: sqlite3.Connection) -> List[str]:
+    """Return the ``rtree_<table>_<column>`` tables whose feature table is gone."""
+    try:
+        spatial_indexes = {
+            f"rtree_{table_name}_{column_name}"
+            for table_name, column_name in connection.execute(
+                "SELECT table_name, column_name FROM gpkg_geometry_columns"
+                " WHERE table_name IN (SELECT name FROM sqlite_master WHERE type = 'table')"
+            )
+        }
+    except sqlite3.OperationalError:
+        # Not a GeoPackage
+        return []
+    return [
+        name for (name,) in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND sql LIKE 'CREATE VIRTUAL TABLE%USING rtree%' ORDER BY name"
+        )
+        if name.startswith("rtree_") and name not in spatial_indexes
+    ]
+
+
+def compact_gpkg(path: str, page_size: int = PAGE_SIZE) -> CompactionResult:
+    size_before = _database_size(path)
+    with closing(sqlite3.connect(path, isolation_level=None)) as connection:
+        # The page size cannot change while in WAL mode, this also checkpoints the WAL into the file
+        connection.execute("PRAGMA journal_mode = DELETE")
+
+        orphans = orphan_rtree_tables(connection)
+        for table in orphans:
+            try:
+                connection.execute('DROP TABLE "{}"'.format(table.replace('"', '""')))
+            except sqlite3.OperationalError as e:
+                # SQLite built without the R-tree module, the table stays
+                print(f"Could not drop {table} from {path}: {e}")
+
+        (current_page_size,) = connection.execute("PRAGMA page_size").fetchone()
+        (free_pages,) = connection.execute("PRAGMA freelist_count").fetchone()
+        vacuumed = bool(orphans or free_pages or current_page_size != page_size)
+        if vacuumed:
+            connection.execute(f"PRAGMA page_size = {int(page_size)}")
+            connection.execute("VACUUM")
+
+        connection.execute("ANALYZE")
+        check = "; ".join(row[0] for row in connection.execute("PRAGMA quick_check"))
+
+    return CompactionResult(path, size_before, _database_size(path), check, vacuumed)
+
+
+def compact_package(folder: str, page_size: int = PAGE_SIZE) -> List[CompactionResult]:
+    """Compact every GeoPackage of the package in ``folder`` that is not shared with other packages."""
+    results = []
+    for relative_path in package_files(folder):
+        path = os.path.join(folder, relative_path)
+        if not relative_path.lower().endswith(".gpkg") or os.stat(path).st_nlink > 1:
+            continue
+        results.append(compact_gpkg(path, page_size))
+    return results
+
+
+def format_compaction(results: List[CompactionResult]) -> str:
+    lines = [
+        "{}: {:,} bytes saved{}".format(
+            result.path, result.bytes_saved, "" if result.check == "ok" else f", quick_check failed: {result.check}",
+        )
+        for result in results
+    ]
+    lines.append("Total: {:,} bytes saved".format(sum(result.bytes_saved for result in results)))
+    return "\n".join(lines)
@@ -0,0 +1,244 @@
+"""
+    Streaming export of layers into a single GeoPackage.
+
+    ``native:package`` with ``SELECTED_FEATURES_ONLY`` materializes every
+    selection and rewrites the GeoPackage once per layer. The exporter below
+    streams the features of each layer (the selected ones when the layer
+    has a selection, otherwise all features passing its subset string)
+    straight into one GeoPackage opened once, inside a single transaction
+    with WAL journaling. R-tree spatial indexes are created after all rows
+    are in, and the styles and layer metadata are saved to the
+    ``layer_styles`` and ``gpkg_metadata`` tables as ``native:package`` did.
+"""
+
+import json
+import os
+import sqlite3
+from contextlib import closing
+from typing import Callable, Iterable, List, NamedTuple, Optional
+
+from osgeo import ogr, osr
+from qgis.core import (
+    QgsCoordinateReferenceSystem,
+    QgsFeatureRequest,
+    QgsField,
+    QgsMapLayerStyle,
+    QgsNotSupportedException,
+    QgsProviderRegistry,
+    QgsVectorLayer,
+)
+from qgis.PyQt.QtCore import QDate, QDateTime, Qt, QTime, QVariant
+
+from .gpkg_compaction import remove_database
+
+GEOMETRY_COLUMN = "geom"
+FID_COLUMN = "fid"
+
+OGR_FIELD_TYPES = {
+    QVariant.Int: ogr.OFTInteger,
+    QVariant.LongLong: ogr.OFTInteger64,
+    QVariant.Double: ogr.OFTReal,
+    QVariant.Date: ogr.OFTDate,
+    QVariant.Time: ogr.OFTTime,
+    QVariant.DateTime: ogr.OFTDateTime,
+    QVariant.Bool: ogr.OFTInteger,
+}
+
+
+class LayerExport(NamedTuple):
+    layer_name: str
+    features: int
+    # Bytes taken by the table and its spatial index in the GeoPackage, None when unknown
+    size: Optional[int]
+
+
+def _ogr_field(field: QgsField) -> ogr.FieldDefn:
+    field_defn = ogr.FieldDefn(field.name(), OGR_FIELD_TYPES.get(field.type(), ogr.OFTString))
+    if field.type() == QVariant.Bool:
+        field_defn.SetSubType(ogr.OFSTBoolean)
+    elif field.type() in (QVariant.List, QVariant.StringList):
+        field_defn.SetSubType(ogr.OFSTJSON)
+    elif field.type() == QVariant.String:
+        field_defn.SetWidth(max(field.length(), 0))
+    return field_defn
+
+
+def _ogr_value(value):
+    if value is None or (isinstance(value, QVariant) and value.isNull()):
+        return None
+    if isinstance(value, (QDate, QDateTime, QTime)):
+        return value.toString(Qt.ISODate)
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (list, dict)):
+        return json.dumps(value)
+    return value
+
+
+def _ogr_srs(crs: QgsCoordinateReferenceSystem) -> Optional[osr.SpatialReference]:
+    if not crs.isValid():
+        return None
+    srs = osr.SpatialReference()
+    if not crs.authid() or srs.SetFromUserInput(crs.authid()) != 0:
+        srs.SetFromUserInput(crs.toWkt(QgsCoordinateReferenceSystem.WKT_PREFERRED_GDAL))
+    srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    return srs
+
+
+def sql_string(value: str) -> str:
+    """Quote a table or column name passed to an SQL function as a string literal."""
+    return "'{}'".format(value.replace("'", "''"))
+
+
+def _execute(data_source: ogr.DataSource, sql: str):
+    result = data_source.ExecuteSQL(sql)
+    if result is not None:
+        data_source.ReleaseResultSet(result)
+
+
+def _write_layer(data_source: ogr.DataSource, layer: QgsVectorLayer) -> int:
+    fields = layer.fields()
+    has_fid_field = fields.lookupField(FID_COLUMN) >= 0
+    options = [
+        f"FID={FID_COLUMN}",
+        # Created once the data is in, see export_layers
+        "SPATIAL_INDEX=NO",
+    ]
+    if layer.isSpatial():
+        options.append(f"GEOMETRY_NAME={GEOMETRY_COLUMN}")
+
+    ogr_layer = data_source.CreateLayer(
+        layer.name(),
+        srs=_ogr_srs(layer.crs()) if layer.isSpatial() else None,
+        geom_type=layer.wkbType() if layer.isSpatial() else ogr.wkbNone,
+        options=options,
+    )
+    if ogr_layer is None:
+        raise RuntimeError(f"Failed to create the table of {layer.name()}")
+
+    # The source FID column (GeoPackage layers expose it as a field) becomes the table's FID
+    written_fields = [index for index, field in enumerate(fields) if not (has_fid_field and field.name() == FID_COLUMN)]
+    for index in written_fields:
+        if ogr_layer.CreateField(_ogr_field(fields.at(index))) != 0:
+            raise RuntimeError(f"Failed to create field {fields.at(index).name()} of {layer.name()}")
+    fid_index = fields.lookupField(FID_COLUMN) if has_fid_field else -1
+
+    request = QgsFeatureRequest()
+    if layer.selectedFeatureCount():
+        request.setFilterFids(layer.selectedFeatureIds())
+
+    definition = ogr_layer.GetLayerDefn()
+    count = 0
+    for feature in layer.getFeatures(request):
+        ogr_feature = ogr.Feature(definition)
+        attributes = feature.attributes()
+        for ogr_index, index in enumerate(written_fields):
+            value = _ogr_value(attributes[index])
+            if value is None:
+                ogr_feature.SetFieldNull(ogr_index)
+            else:
+                ogr_feature.SetField(ogr_index, value)
+        if fid_index >= 0 and _ogr_value(attributes[fid_index]) is not None:
+            ogr_feature.SetFID(int(attributes[fid_index]))
+        if layer.isSpatial() and feature.hasGeometry():
+            ogr_feature.SetGeometryDirectly(ogr.CreateGeometryFromWkb(bytes(feature.geometry().asWkb())))
+        if ogr_layer.CreateFeature(ogr_feature) != 0:
+            raise RuntimeError(f"Failed to write feature {feature.id()} of {layer.name()}")
+        count += 1
+    return count
+
+
+def _save_style(layer: QgsVectorLayer, output_gpkg: str):
+    exported = QgsVectorLayer(f"{output_gpkg}|layername={layer.name()}", layer.name(), "ogr")
+    if not exported.isValid():
+        return
+    style = QgsMapLayerStyle()
+    style.readFromLayer(layer)
+    style.writeToLayer(exported)
+    exported.saveStyleToDatabase(layer.name(), "", True, "")
+
+
+def _save_metadata(layer: QgsVectorLayer, output_gpkg: str):
+    try:
+        saved, error = QgsProviderRegistry.instance().saveLayerMetadata(
+            "ogr", f"{output_gpkg}|layername={layer.name()}", layer.metadata(),
+        )
+    except QgsNotSupportedException as e:
+        saved, error = False, str(e)
+    if not saved:
+        print(f"Could not save the metadata of {layer.name()}: {error}")
+
+
+def table_sizes(gpkg_path: str, table_names: Iterable[str]) -> dict:
+    """Return the bytes taken by each table and its R-tree, empty when SQLite has no dbstat."""
+    sizes = {}
+    with closing(sqlite3.connect(gpkg_path)) as connection:
+        try:
+            for table_name in table_names:
+                (size,) = connection.execute(
+                    "SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name = ? OR name LIKE ?",
+                    (table_name, f"rtree_{table_name}_%"),
+                ).fetchone()
+                sizes[table_name] = size
+        except sqlite3.OperationalError:
+            return {}
+    return sizes
+
+
+def export_layers(
+    layers: List[QgsVectorLayer],
+    output_gpkg: str,
+    save_styles: bool = True,
+    save_metadata: bool = True,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> List[LayerExport]:
+    """Write the layers into a new GeoPackage, replacing any existing file.
+
+    Returns the number of features written and the size of each table.
+    """
+    remove_database(output_gpkg)
+    data_source = ogr.GetDriverByName("GPKG").CreateDataSource(output_gpkg)
+    if data_source is None:
+        raise RuntimeError(f"Failed to create {output_gpkg}")
+
+    counts = {}
+    try:
+        _execute(data_source, "PRAGMA journal_mode = WAL")
+        data_source.StartTransaction()
+        try:
+            for index, layer in enumerate(layers):
+                counts[layer.name()] = _write_layer(data_source, layer)
+                if progress:
+                    progress(index + 1, len(layers))
+        except Exception:
+            data_source.RollbackTransaction()
+            raise
+        data_source.CommitTransaction()
+
+        for layer in layers:
+            if layer.isSpatial():
+                _execute(data_source, f"SELECT CreateSpatialIndex({sql_string(layer.name())}, {sql_string(GEOMETRY_COLUMN)})")
+
+        # Back to a single self-contained file before the package is copied to devices
+        _execute(data_source, "PRAGMA journal_mode = DELETE")
+    finally:
+        data_source = None
+
+    for layer in layers:
+        if save_styles:
+            _save_style(layer, output_gpkg)
+        if save_metadata:
+            _save_metadata(layer, output_gpkg)
+
+    sizes = table_sizes(output_gpkg, counts)
+    return [LayerExport(name, count, sizes.get(name)) for name, count in counts.items()]
+
+
+def format_exports(exports: List[LayerExport]) -> str:
+    return "\n".join(
+        "{}: {:,} features, {}".format(
+            export.layer_name, export.features,
+            "{:,} bytes".format(export.size) if export.size is not None else "size unknown",
+        )
+        for export in exports
+    )
@@ -0,0 +1,144 @@
+"""
+    Index of the project's layers by CBMS role.
+
+    The dialogs used to find the barangay, EA, block, building point, road,
+    river, landmark and Form 8 layers by scanning every project layer name
+    for a suffix or keyword, often several times per click. The registry
+    below classifies each layer once, when it is added or renamed, so every
+    lookup is a dictionary access.
+
+    A layer has a role when its name ends with ``_<role>`` (e.g.
+    ``012345_bgy``). The validator historically matched any name containing
+    the role keyword; those matches are indexed too and returned with
+    ``exact=False``.
+"""
+
+from functools import partial
+from typing import Dict, Iterable, List, Optional
+
+from qgis.core import QgsMapLayer, QgsProject
+from qgis.PyQt.QtCore import QObject
+
+from .qml_config import qml_config
+
+# Layers of the CBMS Form 8 group, not styled through qml_config.json
+FORM_ROLES = ("SF", "GP")
+
+
+def configured_roles() -> List[str]:
+    """Return the roles styled in ``qml_config.json`` plus the Form 8 roles."""
+    roles = qml_config().roles()
+    return roles + [role for role in FORM_ROLES if role not in roles]
+
+
+def suffix_role(name: str, roles: Iterable[str]) -> Optional[str]:
+    """Return the role whose ``_<role>`` suffix ends the layer name, preferring the longest."""
+    for role in sorted(roles, key=len, reverse=True):
+        if name.endswith(f"_{role}"):
+            return role
+    return None
+
+
+def keyword_roles(name: str, roles: Iterable[str]) -> List[str]:
+    """Return every role whose keyword appears in the layer name."""
+    return [role for role in roles if role in name]
+
+
+class LayerRoleRegistry(QObject):
+    """Keeps the layers of a project indexed by role as layers come, go and get renamed."""
+
+    def __init__(self, project: QgsProject, roles: Iterable[str]):
+        super().__init__()
+        self.project = project
+        self.roles = list(roles)
+        self._roles: Dict[str, Optional[str]] = {}
+        # Role to layer ids, in the order the layers were added
+        self._suffix_index: Dict[str, Dict[str, None]] = {role: {} for role in self.roles}
+        self._keyword_index: Dict[str, Dict[str, None]] = {role: {} for role in self.roles}
+        self._watched_layer_ids = set()
+
+        self.project.layersAdded.connect(self._on_layers_added)
+        self.project.layersRemoved.connect(self._on_layers_removed)
+        self.project.cleared.connect(self.rebuild)
+        self.rebuild()
+
+    def rebuild(self):
+        self._roles.clear()
+        for index in (self._suffix_index, self._keyword_index):
+            for layer_ids in index.values():
+                layer_ids.clear()
+        self._on_layers_added(list(self.project.mapLayers().values()))
+
+    def unload(self):
+        self.project.layersAdded.disconnect(self._on_layers_added)
+        self.project.layersRemoved.disconnect(self._on_layers_removed)
+        self.project.cleared.disconnect(self.rebuild)
+
+    def _on_layers_added(self, layers: List[QgsMapLayer]):
+        for layer in layers:
+            self._classify(layer)
+            if layer.id() not in self._watched_layer_ids:
+                self._watched_layer_ids.add(layer.id())
+                layer.nameChanged.connect(partial(self._on_name_changed, layer.id()))
+
+    def _on_layers_removed(self, layer_ids: List[str]):
+        for layer_id in layer_ids:
+            self._unindex(layer_id)
+            self._watched_layer_ids.discard(layer_id)
+
+    def _on_name_changed(self, layer_id: str):
+        layer = self.project.mapLayer(layer_id)
+        if layer is not None:
+            self._classify(layer)
+
+    def _unindex(self, layer_id: str):
+        self._roles.pop(layer_id, None)
+        for index in (self._suffix_index, self._keyword_index):
+            for layer_ids in index.values():
+                layer_ids.pop(layer_id, None)
+
+    def _classify(self, layer: QgsMapLayer):
+        layer_id = layer.id()
+        self._unindex(layer_id)
+
+        role = suffix_role(layer.name(), self.roles)
+        self._roles[layer_id] = role
+        if role is not None:
+            self._suffix_index[role][layer_id] = None
+        for keyword in keyword_roles(layer.name(), self.roles):
+            self._keyword_index[keyword][layer_id] = None
+
+    def role(self, layer: Optional[QgsMapLayer]) -> Optional[str]:
+        """Return the role of a layer, None if its name has no role suffix."""
+        if layer is None:
+            return None
+        return self._roles.get(layer.id())
+
+    def layers(self, role: str, exact: bool = True) -> List[QgsMapLayer]:
+        """Return the layers of a role, or with ``exact=False`` all layers whose name contains it."""
+        index = self._suffix_index if exact else self._keyword_index
+        layers = (self.project.mapLayer(layer_id) for layer_id in index.get(role, ()))
+        return [layer for layer in layers if layer is not None]
+
+    def layer(self, role: str, exact: bool = True) -> Optional[QgsMapLayer]:
+        """Return the most recently added layer of a role."""
+        layers = self.layers(role, exact)
+        return layers[-1] if layers else None
+
+
+_registry: Optional[LayerRoleRegistry] = None
+
+
+def layer_roles() -> LayerRoleRegistry:
+    """Return the role registry of the current project, created on first use."""
+    global _registry
+    if _registry is None:
+        _registry = LayerRoleRegistry(QgsProject.instance(), configured_roles())
+    return _registry
+
+
+def unload_layer_roles():
+    global _registry
+    if _registry is not None:
+        _registry.unload()
+        _registry = None
@@ -0,0 +1,176 @@
+"""
+    Cached layer-definition (QLR) templates of the loaded project layout.
+
+    Every barangay export produces the same tree of groups, layers and
+    styles, only the paths and the geocode prefix change. After a full load
+    the finished tree is exported once as a QLR with those values replaced
+    by tokens; later loads substitute the new values and instantiate the
+    template instead of re-parsing the QML files and renaming layers.
+"""
+
+import hashlib
+import os
+import re
+import xml.etree.ElementTree as ET
+from typing import Iterable, List, Optional, Tuple
+
+from qgis.core import (
+    QgsApplication,
+    QgsLayerDefinition,
+    QgsLayerTreeGroup,
+    QgsProject,
+    QgsReadWriteContext,
+)
+from qgis.PyQt.QtXml import QDomDocument
+
+# Bump when the loader changes the tree it builds, so stale templates are ignored
+TEMPLATE_VERSION = 1
+
+EXPORT_TOKEN = "{AUQCBMS_EXPORT}"
+OUTPUT_TOKEN = "{AUQCBMS_OUTPUT}"
+PREFIX_TOKEN = "{AUQCBMS_PREFIX}"
+
+# Elements and attributes that carry layer names, ids and sources. The geocode
+# prefix is only tokenized there, never in extents or other numeric content.
+PREFIX_ELEMENTS = ("id", "datasource", "layername", "layer-tree-layer", "layer-tree-group")
+PREFIX_ATTRIBUTES = ("id", "name", "source")
+# Widget and relation options that refer to other layers by id, name, source
+# or through an expression, tokenized in their `value` attribute.
+PREFIX_OPTIONS = (
+    "Layer",
+    "LayerName",
+    "LayerSource",
+    "ReferencedLayerId",
+    "ReferencedLayerName",
+    "ReferencedLayerDataSource",
+    "Relation",
+    "FilterExpression",
+    "Expression",
+)
+
+
+def template_key(file_names: Iterable[str], prefix: str, style_files: Iterable[str]) -> str:
+    """Return the cache key of the layout built from an export.
+
+    The key covers the export's file listing (with the geocode prefix removed)
+    and the path and modification time of every style applied while loading.
+    """
+    digest = hashlib.sha1(f"v{TEMPLATE_VERSION}".encode())
+    for name in sorted(file_names):
+        if prefix:
+            name = name.replace(prefix, PREFIX_TOKEN, 1)
+        digest.update(name.encode())
+    for style_file in sorted(style_files):
+        if style_file and os.path.exists(style_file):
+            digest.update(f"{style_file}:{os.stat(style_file).st_mtime_ns}".encode())
+    return digest.hexdigest()
+
+
+def _path_variants(path: str) -> List[str]:
+    variants = {path, path.replace("\\", "/")}
+    return sorted(variants, key=len, reverse=True)
+
+
+def _substitute(root: ET.Element, replacements: List[Tuple[str, str]], prefix_pattern: Optional[re.Pattern], prefix_value: str):
+    def convert(value: str, prefix_allowed: bool) -> str:
+        for old, new in replacements:
+            value = value.replace(old, new)
+        if prefix_allowed and prefix_pattern is not None:
+            value = prefix_pattern.sub(prefix_value, value)
+        return value
+
+    for element in root.iter():
+        in_prefix_element = element.tag in PREFIX_ELEMENTS
+        if element.text:
+            element.text = convert(element.text, in_prefix_element)
+        for name, value in element.attrib.items():
+            if element.tag == "Option" and element.get("name") in PREFIX_OPTIONS:
+                prefix_allowed = name == "value"
+            else:
+                prefix_allowed = in_prefix_element and name in PREFIX_ATTRIBUTES
+            element.set(name, convert(value, prefix_allowed))
+
+
+def tokenize_template(xml_text: str, export_path: str, output_folder: str, prefix: str) -> str:
+    """Replace the export specific paths and prefix of a QLR with tokens."""
+    root = ET.fromstring(xml_text)
+    replacements = [(variant, EXPORT_TOKEN) for variant in _path_variants(export_path)]
+    if output_folder != export_path:
+        replacements += [(variant, OUTPUT_TOKEN) for variant in _path_variants(output_folder)]
+    prefix_pattern = re.compile(r"(?<!\d)" + re.escape(prefix)) if prefix else None
+    _substitute(root, replacements, prefix_pattern, PREFIX_TOKEN)
+    return ET.tostring(root, encoding="unicode")
+
+
+def instantiate_template(xml_text: str, export_path: str, output_folder: str, prefix: str) -> str:
+    """Fill the tokens of a cached QLR with the values of a new export."""
+    root = ET.fromstring(xml_text)
+    replacements = [
+        (EXPORT_TOKEN, export_path.replace("\\", "/")),
+        (OUTPUT_TOKEN, output_folder.replace("\\", "/")),
+        (PREFIX_TOKEN, prefix),
+    ]
+    _substitute(root, replacements, None, "")
+    return ET.tostring(root, encoding="unicode")
+
+
+class LayoutTemplateCache:
+    """Stores and instantiates QLR templates of the loader's layer tree."""
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        self.cache_dir = cache_dir or os.path.join(
+            QgsApplication.qgisSettingsDirPath(), "auqcbms", "layout_templates"
+        )
+
+    def template_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.qlr")
+
+    def has_template(self, key: str) -> bool:
+        return os.path.exists(self.template_path(key))
+
+    def save(self, key: str, groups: List[QgsLayerTreeGroup], export_path: str, output_folder: str, prefix: str) -> bool:
+        """Export the given groups as a tokenized template."""
+        doc = QDomDocument("qgis-layer-definition")
+        success, error_message = QgsLayerDefinition.exportLayerDefinition(doc, groups, QgsReadWriteContext())
+        if not success:
+            print(f"Failed to export the layout template: {error_message}")
+            return False
+
+        xml_text = tokenize_template(doc.toString(), export_path, output_folder, prefix)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(self.template_path(key), "w", encoding="utf-8") as f:
+            f.write(xml_text)
+        return True
+
+    def instantiate(self, key: str, project: QgsProject, export_path: str, output_folder: str, prefix: str) -> bool:
+        """Load a cached template into the project's layer tree root.
+
+        Returns False, leaving the project untouched, when the template is
+        missing or any of its layers fails to load with the new sources.
+        """
+        if not self.has_template(key):
+            return False
+
+        with open(self.template_path(key), encoding="utf-8") as f:
+            xml_text = instantiate_template(f.read(), export_path, output_folder, prefix)
+
+        doc = QDomDocument()
+        if not doc.setContent(xml_text):
+            return False
+
+        root = project.layerTreeRoot()
+        existing_layer_ids = set(project.mapLayers())
+        existing_child_count = len(root.children())
+
+        success, error_message = QgsLayerDefinition.loadLayerDefinition(doc, project, root, QgsReadWriteContext())
+        new_layers = [layer for layer_id, layer in project.mapLayers().items() if layer_id not in existing_layer_ids]
+
+        if success and new_layers and all(layer.isValid() for layer in new_layers):
+            return True
+
+        print(f"Layout template could not be instantiated, falling back to a full load. {error_message}")
+        # The definition's nodes are appended after the existing ones
+        for child in root.children()[existing_child_count:]:
+            root.removeChildNode(child)
+        project.removeMapLayers([layer.id() for layer in new_layers])
+        return False
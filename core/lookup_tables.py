@@ -0,0 +1,139 @@
+"""
+    Value-relation lookup tables stored as indexed GeoPackage tables.
+
+    The lookup CSVs used by the Form 8 value-relation widgets used to be
+    loaded through the delimited text provider, which re-parses the file on
+    every feature request and has no index. They are now imported once into
+    attribute tables of a single GeoPackage, with indexes on the key columns
+    the widgets look values up by.
+"""
+
+import os
+import re
+import xml.etree.ElementTree as ET
+from typing import Dict, Iterable, Set
+
+from osgeo import ogr
+from qgis.core import QgsEditorWidgetSetup, QgsVectorLayer
+
+LOOKUP_GPKG_NAME = "value_relations.gpkg"
+# The CSVs carry their own `fid` column, so the GeoPackage FID gets another name
+LOOKUP_FID_COLUMN = "lookup_fid"
+
+
+def lookup_table_name(csv_path: str) -> str:
+    """Return the GeoPackage table name used for a lookup CSV."""
+    stem = os.path.splitext(os.path.basename(csv_path))[0]
+    return re.sub(r"[^0-9a-z]+", "_", stem.lower()).strip("_")
+
+
+def value_relation_columns(qml_paths: Iterable[str]) -> Dict[str, Set[str]]:
+    """Collect the Key/Value columns each lookup layer is queried by in the given styles.
+
+    Returns a mapping of the referenced layer name to its column names.
+    """
+    columns: Dict[str, Set[str]] = {}
+    for qml_path in qml_paths:
+        if not qml_path or not os.path.exists(qml_path):
+            continue
+
+        for edit_widget in ET.parse(qml_path).iter("editWidget"):
+            if edit_widget.get("type") != "ValueRelation":
+                continue
+
+            options = {
+                option.get("name"): option.get("value")
+                for option in edit_widget.iter("Option")
+                if option.get("name")
+            }
+            layer_name = options.get("LayerName")
+            if layer_name:
+                columns.setdefault(layer_name, set()).update(
+                    column for column in (options.get("Key"), options.get("Value")) if column
+                )
+
+    return columns
+
+
+def import_lookup_table(csv_path: str, gpkg_path: str, index_columns: Iterable[str] = ()) -> str:
+    """Import a CSV into an attribute table of ``gpkg_path`` unless it is up to date.
+
+    ``csv_path`` may be any path OGR can read, including ``/vsizip/`` paths.
+    Columns named ``key*`` (e.g. ``keychild``) and ``index_columns`` are indexed.
+    Returns the table name.
+    """
+    table_name = lookup_table_name(csv_path)
+
+    driver = ogr.GetDriverByName("GPKG")
+    if os.path.exists(gpkg_path):
+        data_source = driver.Open(gpkg_path, 1)
+        is_current = data_source.GetLayerByName(table_name) is not None
+        if is_current and not csv_path.startswith("/vsi"):
+            is_current = os.path.getmtime(csv_path) <= os.path.getmtime(gpkg_path)
+        if is_current:
+            return table_name
+    else:
+        data_source = driver.CreateDataSource(gpkg_path)
+
+    source = ogr.Open(csv_path)
+    if source is None:
+        raise RuntimeError(f"Failed to open lookup table: {csv_path}")
+    source_layer = source.GetLayer(0)
+    source_defn = source_layer.GetLayerDefn()
+    field_names = [source_defn.GetFieldDefn(i).GetName() for i in range(source_defn.GetFieldCount())]
+
+    table = data_source.CreateLayer(
+        table_name,
+        geom_type=ogr.wkbNone,
+        options=["OVERWRITE=YES", f"FID={LOOKUP_FID_COLUMN}", "ASPATIAL_VARIANT=GPKG_ATTRIBUTES"],
+    )
+    for field_name in field_names:
+        table.CreateField(ogr.FieldDefn(field_name, ogr.OFTString))
+
+    # One transaction for the whole table
+    data_source.StartTransaction()
+    table_defn = table.GetLayerDefn()
+    for source_feature in source_layer:
+        feature = ogr.Feature(table_defn)
+        for i, field_name in enumerate(field_names):
+            if source_feature.IsFieldSetAndNotNull(i):
+                feature.SetField(field_name, source_feature.GetFieldAsString(i))
+        table.CreateFeature(feature)
+    data_source.CommitTransaction()
+
+    indexed = {name for name in field_names if name.lower().startswith("key")}
+    indexed.update(name for name in index_columns if name in field_names)
+    for column in sorted(indexed):
+        data_source.ExecuteSQL(
+            f'CREATE INDEX IF NOT EXISTS "idx_{table_name}_{column}" ON "{table_name}" ("{column}")'
+        )
+
+    data_source = None  # close and flush
+    return table_name
+
+
+def repoint_value_relations(layer: QgsVectorLayer, lookup_layers: Dict[str, QgsVectorLayer]) -> int:
+    """Point the layer's value-relation widgets at the given lookup layers.
+
+    ``lookup_layers`` maps the layer name referenced in the widget config to
+    the loaded lookup layer. Returns the number of widgets updated.
+    """
+    updated = 0
+    for index, field in enumerate(layer.fields()):
+        widget_setup = field.editorWidgetSetup()
+        if widget_setup.type() != "ValueRelation":
+            continue
+
+        config = dict(widget_setup.config())
+        lookup_layer = lookup_layers.get(config.get("LayerName"))
+        if lookup_layer is None:
+            continue
+
+        config["Layer"] = lookup_layer.id()
+        config["LayerName"] = lookup_layer.name()
+        config["LayerSource"] = lookup_layer.source()
+        config["LayerProviderName"] = lookup_layer.providerType()
+        layer.setEditorWidgetSetup(index, QgsEditorWidgetSetup("ValueRelation", config))
+        updated += 1
+
+    return updated
@@ -0,0 +1,177 @@
+"""
+    Comparative benchmark of the available offliners.
+
+    Packages the current project (filtered to the selected geocode) with
+    every offliner, each into its own folder, and records the wall time,
+    the peak memory of the process and the size of the written package.
+    Every offliner runs twice: a timed run with nothing else going on, and
+    a second run during which a thread samples the resident set size
+    (through ``psutil`` when installed, ``/proc`` otherwise), so GDAL and
+    QGIS allocations are counted and the sampling does not slow down the
+    timed run. Without either, the process high-water mark from
+    ``resource.getrusage`` is reported, which never goes down between
+    offliners. The fastest engine can then be picked with the ``offliner``
+    preference.
+"""
+
+import os
+import shutil
+import sys
+import threading
+import time
+from typing import Callable, Iterable, List, NamedTuple, Optional
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+from libqfieldsync.offline_converter import OfflineConverter
+from libqfieldsync.offliners import BaseOffliner
+
+from .cbms_offliner import OFFLINER_TYPES, create_offliner
+
+
+# Seconds between two resident set size samples of the memory run
+RSS_SAMPLE_INTERVAL = 0.01
+
+
+class BenchmarkResult(NamedTuple):
+    offliner: str
+    seconds: float
+    # Bytes, None when the platform cannot tell
+    peak_memory: Optional[int]
+    output_size: int
+    error: Optional[str] = None
+
+
+def current_rss() -> Optional[int]:
+    """Return the resident set size of the process in bytes."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def max_rss() -> Optional[int]:
+    """Return the highest resident set size the process has reached, in bytes."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes, except on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class PeakRss:
+    """Sample the resident set size of the process in a thread while the block runs."""
+
+    def __init__(self, interval: float = RSS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while True:
+            rss = current_rss()
+            if rss is None:
+                return
+            self.peak = max(self.peak or 0, rss)
+            if self._stop.wait(self.interval):
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        if self.peak is None:
+            self.peak = max_rss()
+        return False
+
+
+def _run(converter: OfflineConverter) -> Optional[str]:
+    """Run a conversion and return its error, if any."""
+    try:
+        converter.convert()
+    except Exception as e:
+        return str(e) or type(e).__name__
+    return None
+
+
+def _empty_folder(folder: str):
+    if os.path.exists(folder):
+        shutil.rmtree(folder)
+    os.makedirs(folder)
+
+
+def folder_size(folder: str) -> int:
+    size = 0
+    for root, _dirs, files in os.walk(folder):
+        size += sum(os.path.getsize(os.path.join(root, file)) for file in files)
+    return size
+
+
+def benchmark_offliners(
+    make_converter: Callable[[BaseOffliner, str], OfflineConverter],
+    output_folder: str,
+    offliner_types: Iterable[str] = OFFLINER_TYPES,
+) -> List[BenchmarkResult]:
+    """Package with each offliner into ``output_folder/<offliner>`` and measure it.
+
+    ``make_converter`` builds the converter for an offliner and an export
+    folder, with the same settings as a regular export.
+    """
+    results = []
+    for offliner_type in offliner_types:
+        export_folder = os.path.join(output_folder, offliner_type)
+
+        _empty_folder(export_folder)
+        converter = make_converter(create_offliner(offliner_type), export_folder)
+        start = time.perf_counter()
+        error = _run(converter)
+        seconds = time.perf_counter() - start
+        output_size = folder_size(export_folder)
+
+        peak_memory = None
+        if error is None:
+            # A second, untimed run for the memory, the package it writes replaces the first one
+            _empty_folder(export_folder)
+            converter = make_converter(create_offliner(offliner_type), export_folder)
+            with PeakRss() as rss:
+                error = _run(converter)
+            peak_memory = rss.peak
+
+        results.append(BenchmarkResult(offliner_type, seconds, peak_memory, output_size, error))
+    return results
+
+
+def fastest_offliner(results: List[BenchmarkResult]) -> Optional[str]:
+    """Return the offliner that packaged fastest without an error, None when all failed."""
+    succeeded = [result for result in results if result.error is None]
+    return min(succeeded, key=lambda result: result.seconds).offliner if succeeded else None
+
+
+def format_results(results: List[BenchmarkResult]) -> str:
+    """Return one line per offliner, fastest first."""
+    lines = []
+    for result in sorted(results, key=lambda result: (result.error is not None, result.seconds)):
+        if result.error:
+            lines.append("{}: failed after {:.1f} s ({})".format(result.offliner, result.seconds, result.error))
+        else:
+            peak_memory = "unknown" if result.peak_memory is None else "{:.1f} MB".format(result.peak_memory / 2 ** 20)
+            lines.append("{}: {:.1f} s, {} peak memory, {:.1f} MB written".format(
+                result.offliner, result.seconds, peak_memory, result.output_size / 2 ** 20,
+            ))
+    return "\n".join(lines)
@@ -0,0 +1,365 @@
+"""
+    Device-ready zip archive of an exported geocode package.
+
+    Zipping a package by hand after the export reads every byte again on a
+    single core. ``PackageArchive`` is fed the files of the package as the
+    export finalizes them and compresses them in worker threads (zlib
+    releases the GIL) while the export goes on, computing the CRC-32 the
+    zip format needs and a SHA-256 on the same pass; the manifest reuses
+    those checksums. Files are appended to the archive in the order they
+    were added. Files that are already compressed (JPEG,
+    PNG, compressed rasters, ...) are stored as they are: by extension,
+    GeoPackages holding only tiles, files whose first MiB does not deflate
+    and files for which deflating saves less than
+    ``INCOMPRESSIBLE_RATIO``. Stored files are streamed straight from disk
+    with their header patched afterwards, so they are read once too.
+    Packages over 4 GiB get ZIP64 records.
+
+    The archive holds the package with its manifest. The fingerprints of
+    incremental exports only matter to the exporting machine and are left
+    out.
+"""
+
+import hashlib
+import os
+import sqlite3
+import struct
+import tempfile
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from typing import BinaryIO, Callable, Dict, Iterable, List, NamedTuple, Optional
+
+from .package_manifest import MANIFEST_NAME, package_files
+
+CHUNK_SIZE = 1024 * 1024
+# Compressed data kept in memory per file before spilling to a temporary file
+SPOOL_SIZE = 16 * 1024 * 1024
+COMPRESSION_LEVEL = 6
+# Files deflating to more than this fraction of their size are stored instead
+INCOMPRESSIBLE_RATIO = 0.95
+# Leading part of a file deflated to tell whether the whole file is worth deflating
+SAMPLE_SIZE = 1024 * 1024
+# GeoPackage contents whose data is stored as PNG, JPEG, WebP or TIFF tiles
+TILE_DATA_TYPES = frozenset(("tiles", "2d-gridded-coverage"))
+STORED_EXTENSIONS = frozenset((
+    ".jpg", ".jpeg", ".png", ".webp", ".jp2", ".ecw", ".sid",
+    ".zip", ".gz", ".qgz", ".7z", ".mp3", ".mp4", ".m4a",
+))
+
+# Sizes and offsets from which ZIP64 records are needed, the 32 bit fields then hold the marker
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_MARKER = 0xFFFFFFFF
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+# Bit 11: file names are UTF-8
+UTF8_FLAG = 0x800
+VERSION_DEFAULT = 20
+VERSION_ZIP64 = 45
+UNIX_FILE_ATTRIBUTES = (0o100644 & 0xFFFF) << 16
+
+
+class ArchiveEntry(NamedTuple):
+    path: str
+    size: int
+    compressed_size: int
+    sha256: str
+    stored: bool
+
+
+class _Compressed(NamedTuple):
+    size: int
+    crc: int
+    sha256: str
+    # Raw deflate stream, None when the file is better stored
+    data: Optional[BinaryIO]
+
+
+def _dos_date_time(timestamp: float):
+    t = time.localtime(max(timestamp, 315532800))  # 1980-01-01, the earliest zip date
+    return (
+        (t.tm_year - 1980) << 9 | t.tm_mon << 5 | t.tm_mday,
+        t.tm_hour << 11 | t.tm_min << 5 | t.tm_sec // 2,
+    )
+
+
+def archive_files(folder: str) -> List[str]:
+    """Return the files of the package in ``folder`` to archive, relative to it and with forward slashes."""
+    return package_files(folder) + ([MANIFEST_NAME] if os.path.isfile(os.path.join(folder, MANIFEST_NAME)) else [])
+
+
+def _tiles_only(path: str) -> bool:
+    """Check whether a GeoPackage holds nothing but raster tiles."""
+    try:
+        with closing(sqlite3.connect(f"file:{path}?mode=ro", uri=True)) as connection:
+            data_types = {row[0] for row in connection.execute("SELECT DISTINCT data_type FROM gpkg_contents")}
+    except sqlite3.Error:
+        return False
+    return bool(data_types) and data_types <= TILE_DATA_TYPES
+
+
+def _incompressible(path: str, level: int) -> bool:
+    """Tell from its format or its first MiB that a file is not worth deflating."""
+    if path.lower().endswith(".gpkg") and _tiles_only(path):
+        return True
+    with open(path, "rb") as f:
+        sample = f.read(SAMPLE_SIZE)
+    return bool(sample) and len(zlib.compress(sample, level)) >= len(sample) * INCOMPRESSIBLE_RATIO
+
+
+def _compress(path: str, level: int) -> _Compressed:
+    if _incompressible(path, level):
+        return _Compressed(os.path.getsize(path), 0, "", None)
+
+    size = 0
+    crc = 0
+    digest = hashlib.sha256()
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    data = tempfile.SpooledTemporaryFile(SPOOL_SIZE)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            size += len(chunk)
+            crc = zlib.crc32(chunk, crc)
+            digest.update(chunk)
+            data.write(compressor.compress(chunk))
+    data.write(compressor.flush())
+
+    if data.tell() >= size * INCOMPRESSIBLE_RATIO:
+        data.close()
+        data = None
+    else:
+        data.seek(0)
+    return _Compressed(size, crc, digest.hexdigest(), data)
+
+
+class _ZipWriter:
+    """Writes zip entries whose data is produced outside of ``zipfile``."""
+
+    def __init__(self, f: BinaryIO):
+        self.f = f
+        self.central_directory = []
+
+    @staticmethod
+    def _local_header(name: bytes, method: int, date_time, crc: int, compressed_size: int, size: int) -> bytes:
+        extra = b""
+        if size >= ZIP64_LIMIT or compressed_size >= ZIP64_LIMIT:
+            extra = struct.pack("<HHQQ", 0x0001, 16, size, compressed_size)
+            size = compressed_size = ZIP64_MARKER
+        return struct.pack(
+            "<4sHHHHHLLLHH", b"PK\x03\x04",
+            VERSION_ZIP64 if extra else VERSION_DEFAULT, UTF8_FLAG, method, date_time[1], date_time[0],
+            crc, compressed_size, size, len(name), len(extra),
+        ) + name + extra
+
+    def _add_central_record(self, name: bytes, method: int, date_time, crc: int, compressed_size: int, size: int, offset: int):
+        self.central_directory.append((name, method, date_time, crc, compressed_size, size, offset))
+
+    def write_stored(self, arcname: str, path: str) -> _Compressed:
+        """Copy ``path`` into the archive uncompressed, patching its checksum in afterwards."""
+        name = arcname.encode("utf-8")
+        date_time = _dos_date_time(os.path.getmtime(path))
+        size = os.path.getsize(path)
+        offset = self.f.tell()
+        self.f.write(self._local_header(name, ZIP_STORED, date_time, 0, size, size))
+
+        written = 0
+        crc = 0
+        digest = hashlib.sha256()
+        with open(path, "rb") as source:
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                written += len(chunk)
+                crc = zlib.crc32(chunk, crc)
+                digest.update(chunk)
+                self.f.write(chunk)
+        if written != size:
+            raise RuntimeError(f"{path} changed while it was archived")
+
+        end = self.f.tell()
+        self.f.seek(offset)
+        self.f.write(self._local_header(name, ZIP_STORED, date_time, crc, size, size))
+        self.f.seek(end)
+        self._add_central_record(name, ZIP_STORED, date_time, crc, size, size, offset)
+        return _Compressed(size, crc, digest.hexdigest(), None)
+
+    def write_deflated(self, arcname: str, path: str, compressed: _Compressed) -> int:
+        """Append the deflate stream of ``path`` and return its size."""
+        name = arcname.encode("utf-8")
+        date_time = _dos_date_time(os.path.getmtime(path))
+        compressed.data.seek(0, os.SEEK_END)
+        compressed_size = compressed.data.tell()
+        compressed.data.seek(0)
+
+        offset = self.f.tell()
+        self.f.write(self._local_header(name, ZIP_DEFLATED, date_time, compressed.crc, compressed_size, compressed.size))
+        for chunk in iter(lambda: compressed.data.read(CHUNK_SIZE), b""):
+            self.f.write(chunk)
+        self._add_central_record(name, ZIP_DEFLATED, date_time, compressed.crc, compressed_size, compressed.size, offset)
+        return compressed_size
+
+    def close(self):
+        directory_offset = self.f.tell()
+        for name, method, date_time, crc, compressed_size, size, offset in self.central_directory:
+            # ZIP64 fields hold only the values that overflow, in this order
+            zip64_fields = []
+            if size >= ZIP64_LIMIT:
+                zip64_fields.append(size)
+                size = ZIP64_MARKER
+            if compressed_size >= ZIP64_LIMIT:
+                zip64_fields.append(compressed_size)
+                compressed_size = ZIP64_MARKER
+            if offset >= ZIP64_LIMIT:
+                zip64_fields.append(offset)
+                offset = ZIP64_MARKER
+            extra = struct.pack(f"<HH{len(zip64_fields)}Q", 0x0001, 8 * len(zip64_fields), *zip64_fields) if zip64_fields else b""
+            version = VERSION_ZIP64 if extra else VERSION_DEFAULT
+            self.f.write(struct.pack(
+                "<4s4B4HL2L5H2L", b"PK\x01\x02",
+                version, 3, version, 0, UTF8_FLAG, method, date_time[1], date_time[0],
+                crc, compressed_size, size, len(name), len(extra), 0, 0, 0, UNIX_FILE_ATTRIBUTES, offset,
+            ))
+            self.f.write(name + extra)
+
+        directory_end = self.f.tell()
+        directory_size = directory_end - directory_offset
+        count = len(self.central_directory)
+        if count >= 0xFFFF or directory_offset >= ZIP64_LIMIT or directory_size >= ZIP64_LIMIT:
+            self.f.write(struct.pack(
+                "<4sQ2H2L4Q", b"PK\x06\x06", 44, VERSION_ZIP64, VERSION_ZIP64, 0, 0,
+                count, count, directory_size, directory_offset,
+            ))
+            self.f.write(struct.pack("<4sLQL", b"PK\x06\x07", 0, directory_end, 1))
+        self.f.write(struct.pack(
+            "<4s4H2LH", b"PK\x05\x06", 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+            directory_size if directory_size < ZIP64_LIMIT else ZIP64_MARKER,
+            directory_offset if directory_offset < ZIP64_LIMIT else ZIP64_MARKER, 0,
+        ))
+
+
+class PackageArchive:
+    """Zip archive of a package, fed with its files as they are finalized.
+
+    Each added file is compressed in a worker thread while the packaging
+    goes on, and written to the archive in the order the files were added,
+    with at most ``workers * 2`` compressions pending. A file must not
+    change once it is added. ``close`` writes the remaining files and
+    moves the archive in place, ``abort`` drops it.
+    """
+
+    def __init__(
+        self,
+        folder: str,
+        archive_path: str,
+        root_name: Optional[str] = None,
+        workers: Optional[int] = None,
+        progress: Optional[Callable[[int, int], None]] = None,
+    ):
+        self.folder = folder
+        self.archive_path = archive_path
+        # Defaults to the folder name, so that extracting the archive recreates the package folder
+        self.root_name = os.path.basename(os.path.normpath(folder)) if root_name is None else root_name
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.progress = progress
+        self.entries: List[ArchiveEntry] = []
+        # SHA-256 of each written file by path relative to the folder, for the manifest
+        self.checksums: Dict[str, str] = {}
+        self._added = set()
+        self._pending = deque()
+        self._temp_path = archive_path + ".tmp"
+        self._file = open(self._temp_path, "wb")
+        self._writer = _ZipWriter(self._file)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+
+    def add(self, relative_path: str):
+        """Queue a finalized file of the package, given relative to the folder with forward slashes."""
+        if relative_path in self._added:
+            return
+        self._added.add(relative_path)
+        future = None
+        if os.path.splitext(relative_path)[1].lower() not in STORED_EXTENSIONS:
+            future = self._executor.submit(_compress, os.path.join(self.folder, relative_path), COMPRESSION_LEVEL)
+        self._pending.append((relative_path, future))
+        self._write_pending(self.workers * 2)
+
+    def add_files(self, relative_paths: Iterable[str]):
+        for relative_path in relative_paths:
+            self.add(relative_path)
+
+    def _write_pending(self, max_pending: int):
+        """Write out queued files in order, waiting only while more than ``max_pending`` compressions are pending."""
+        while self._pending:
+            relative_path, future = self._pending[0]
+            compressing = sum(1 for _relative_path, pending in self._pending if pending is not None)
+            if future is not None and not future.done() and compressing <= max_pending:
+                return
+            self._pending.popleft()
+            self._write(relative_path, future.result() if future is not None else None)
+
+    def _write(self, relative_path: str, compressed: Optional[_Compressed]):
+        path = os.path.join(self.folder, relative_path)
+        arcname = f"{self.root_name}/{relative_path}" if self.root_name else relative_path
+        if compressed is not None and compressed.data is not None:
+            with compressed.data:
+                compressed_size = self._writer.write_deflated(arcname, path, compressed)
+            entry = ArchiveEntry(arcname, compressed.size, compressed_size, compressed.sha256, False)
+        else:
+            stored = self._writer.write_stored(arcname, path)
+            entry = ArchiveEntry(arcname, stored.size, stored.size, stored.sha256, True)
+        self.entries.append(entry)
+        self.checksums[relative_path] = entry.sha256
+        if self.progress:
+            self.progress(len(self.entries), len(self._added))
+
+    def close(self) -> List[ArchiveEntry]:
+        try:
+            self._write_pending(-1)
+            self._writer.close()
+            self._file.close()
+        except Exception:
+            self.abort()
+            raise
+        self._executor.shutdown()
+        os.replace(self._temp_path, self.archive_path)
+        return self.entries
+
+    def abort(self):
+        for _relative_path, future in self._pending:
+            if future is None or future.cancel():
+                continue
+            try:
+                compressed = future.result()
+            except Exception:
+                continue
+            if compressed.data is not None:
+                compressed.data.close()
+        self._pending.clear()
+        self._executor.shutdown()
+        self._file.close()
+        if os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
+
+
+def write_archive(
+    folder: str,
+    archive_path: str,
+    root_name: Optional[str] = None,
+    workers: Optional[int] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> List[ArchiveEntry]:
+    """Write the files of the finished package in ``folder`` into the zip ``archive_path``, under ``root_name``."""
+    archive = PackageArchive(folder, archive_path, root_name, workers, progress)
+    try:
+        archive.add_files(archive_files(folder))
+    except Exception:
+        archive.abort()
+        raise
+    return archive.close()
+
+
+def format_archive(archive_path: str, entries: List[ArchiveEntry]) -> str:
+    size = sum(entry.size for entry in entries)
+    compressed_size = sum(entry.compressed_size for entry in entries)
+    return "{}: {} files, {:.1f} MB compressed to {:.1f} MB, {} stored".format(
+        archive_path, len(entries), size / 2 ** 20, compressed_size / 2 ** 20, sum(entry.stored for entry in entries),
+    )
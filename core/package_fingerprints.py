@@ -0,0 +1,74 @@
+"""
+    Fingerprints of the sources of an exported geocode package.
+
+    Re-exporting a barangay after correcting one layer used to rewrite the
+    whole package, large unchanged basemaps and reference layers included.
+    Every export now records, next to its ``data.gpkg``, a fingerprint of
+    what produced each offline table and each copied file: the size and
+    modification time of the source files, the subset string and the area
+    of interest. The next export of the same geocode compares them and only
+    redoes the tables and files whose fingerprint changed.
+"""
+
+import hashlib
+import json
+import os
+from typing import Dict, Iterable, List
+
+FINGERPRINTS_NAME = "fingerprints.json"
+FINGERPRINTS_VERSION = 1
+
+# Files SQLite keeps next to a database, changes may sit in the WAL until it is checkpointed
+DATABASE_SIDECAR_SUFFIXES = ("-wal",)
+
+
+def file_state(paths: Iterable[str]) -> List[list]:
+    """Return the name, size and modification time of each existing file, in a stable order."""
+    state = []
+    for path in sorted(set(paths)):
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            state.append([os.path.basename(path), stat.st_size, stat.st_mtime_ns])
+    return state
+
+
+def dataset_files(path: str) -> List[str]:
+    """Return the files a dataset is read from: the file itself and its SQLite sidecars."""
+    return [path] + [path + suffix for suffix in DATABASE_SIDECAR_SUFFIXES]
+
+
+def fingerprint(*parts) -> str:
+    """Hash JSON serializable parts into a fingerprint."""
+    key = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def database_fingerprint(path: str) -> str:
+    return fingerprint(file_state(dataset_files(path)))
+
+
+def read_fingerprints(folder: str) -> dict:
+    """Return the fingerprints recorded by the previous export into ``folder``, empty when there are none."""
+    try:
+        with open(os.path.join(folder, FINGERPRINTS_NAME), "r", encoding="utf-8") as f:
+            fingerprints = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(fingerprints, dict) or fingerprints.get("version") != FINGERPRINTS_VERSION:
+        return {}
+    return fingerprints
+
+
+def write_fingerprints(folder: str, fingerprints: dict) -> str:
+    fingerprints_path = os.path.join(folder, FINGERPRINTS_NAME)
+    temp_path = fingerprints_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(dict(fingerprints, version=FINGERPRINTS_VERSION), f, indent=2, sort_keys=True)
+    os.replace(temp_path, fingerprints_path)
+    return fingerprints_path
+
+
+def changed_keys(previous: Dict[str, str], current: Dict[str, str]) -> List[str]:
+    """Return the keys of ``current`` whose fingerprint differs from, or is missing in, ``previous``."""
+    return sorted(key for key, value in current.items() if previous.get(key) != value)
+
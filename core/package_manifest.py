@@ -0,0 +1,168 @@
+"""
+    Manifest of an exported geocode package.
+
+    Every ``<export>/<geocode>`` folder gets a ``manifest.json`` describing
+    what it holds: each file with its size and SHA-256, the feature count of
+    every GeoPackage table, the area of interest, the version (size and
+    modification time) of the source datasets and how long each packaging
+    phase took. Distribution and verification tools can check a package
+    against its manifest without opening it in QGIS, see ``verify_manifest``.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing, contextmanager
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+
+from .package_fingerprints import FINGERPRINTS_NAME
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _timestamp(seconds: float) -> str:
+    return datetime.fromtimestamp(seconds, timezone.utc).isoformat(timespec="seconds")
+
+
+def package_files(folder: str) -> List[str]:
+    """Return the package files relative to ``folder``, with forward slashes.
+
+    The manifest and the fingerprints of incremental exports, which only
+    the exporting machine reads, are left out.
+    """
+    files = []
+    for root, _dirs, names in os.walk(folder):
+        for name in names:
+            relative_path = os.path.relpath(os.path.join(root, name), folder).replace(os.sep, "/")
+            if relative_path not in (MANIFEST_NAME, FINGERPRINTS_NAME):
+                files.append(relative_path)
+    return sorted(files)
+
+
+def file_entries(folder: str, checksums: Optional[Dict[str, str]] = None) -> List[dict]:
+    """Describe the package files, hashing those without a SHA-256 in ``checksums``."""
+    checksums = checksums or {}
+    return [
+        {
+            "path": relative_path,
+            "size": os.path.getsize(os.path.join(folder, relative_path)),
+            "sha256": checksums.get(relative_path) or sha256_file(os.path.join(folder, relative_path)),
+        }
+        for relative_path in package_files(folder)
+    ]
+
+
+def gpkg_feature_counts(gpkg_path: str) -> Dict[str, int]:
+    """Return the row count of every feature and attribute table of a GeoPackage."""
+    with closing(sqlite3.connect(f"file:{gpkg_path}?mode=ro", uri=True)) as connection:
+        tables = [row[0] for row in connection.execute(
+            "SELECT table_name FROM gpkg_contents WHERE data_type IN ('features', 'attributes') ORDER BY table_name"
+        )]
+        return {
+            table: connection.execute('SELECT COUNT(*) FROM "{}"'.format(table.replace('"', '""'))).fetchone()[0]
+            for table in tables
+        }
+
+
+def source_version(path: str) -> dict:
+    """Describe the version of a source dataset by its size and modification time."""
+    if not os.path.exists(path):
+        return {"path": path, "missing": True}
+    stat = os.stat(path)
+    return {"path": path, "size": stat.st_size, "modified": _timestamp(stat.st_mtime)}
+
+
+class PhaseTimer:
+    """Records the wall time of the named phases of a packaging run."""
+
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = round(self.timings.get(name, 0.0) + time.perf_counter() - start, 3)
+
+
+def build_manifest(
+    folder: str,
+    geocode: str,
+    layer_counts: Optional[Dict[str, int]] = None,
+    area_of_interest: Optional[dict] = None,
+    sources: Iterable[str] = (),
+    timings: Optional[Dict[str, float]] = None,
+    versions: Optional[Dict[str, str]] = None,
+    checksums: Optional[Dict[str, str]] = None,
+) -> dict:
+    """Describe the package in ``folder``.
+
+    Without ``layer_counts``, the tables of every GeoPackage in the package
+    are counted, keyed by ``<file>/<table>``. ``checksums`` gives the
+    SHA-256 of files already hashed, e.g. while archiving them.
+    """
+    files = file_entries(folder, checksums)
+    if layer_counts is None:
+        layer_counts = {}
+        for entry in files:
+            if entry["path"].lower().endswith(".gpkg"):
+                for table, count in gpkg_feature_counts(os.path.join(folder, entry["path"])).items():
+                    layer_counts[f"{entry['path']}/{table}"] = count
+
+    return {
+        "manifest_version": MANIFEST_VERSION,
+        "geocode": geocode,
+        "created": _timestamp(time.time()),
+        "versions": versions or {},
+        "area_of_interest": area_of_interest,
+        "layers": layer_counts,
+        "sources": [source_version(path) for path in sorted(set(sources))],
+        "timings": timings or {},
+        "files": files,
+        "total_size": sum(entry["size"] for entry in files),
+    }
+
+
+def write_manifest(folder: str, manifest: dict) -> str:
+    manifest_path = os.path.join(folder, MANIFEST_NAME)
+    temp_path = manifest_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temp_path, manifest_path)
+    return manifest_path
+
+
+def verify_manifest(folder: str) -> List[str]:
+    """Check a package against its manifest and return the problems found, empty when it matches."""
+    with open(os.path.join(folder, MANIFEST_NAME), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    problems = []
+    listed = {entry["path"]: entry for entry in manifest.get("files", [])}
+    for relative_path, entry in listed.items():
+        path = os.path.join(folder, relative_path)
+        if not os.path.isfile(path):
+            problems.append(f"{relative_path}: missing")
+        elif os.path.getsize(path) != entry["size"]:
+            problems.append(f"{relative_path}: size differs")
+        elif sha256_file(path) != entry["sha256"]:
+            problems.append(f"{relative_path}: checksum differs")
+
+    problems.extend(f"{relative_path}: not in the manifest" for relative_path in package_files(folder) if relative_path not in listed)
+    return problems
@@ -0,0 +1,127 @@
+"""
+    Content-addressed store of the files shared by geocode packages.
+
+    The value-relation tables, the ``_SF``/``_GP`` templates and the
+    municipal basemaps end up byte for byte identical in every
+    ``<export>/<geocode>`` folder. Instead of copying them into each
+    package, their content is kept once under ``<export>/.store``, named
+    by SHA-256, and linked into the packages. Read-only files are
+    hard-linked; files edited on the device are cloned copy-on-write where
+    the file system supports it (Btrfs, XFS) and copied otherwise, so an
+    edit in one package never shows up in the others.
+"""
+
+import json
+import os
+import shutil
+import stat
+import sys
+from typing import Dict
+
+from .package_manifest import sha256_file
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+
+STORE_FOLDER = ".store"
+INDEX_NAME = "index.json"
+# Stored content is shared by every package linking it, nothing may write to it
+STORED_FILE_MODE = 0o444
+# ioctl cloning a whole file on Linux, see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except PermissionError:
+        # Windows does not remove read-only files
+        os.chmod(path, stat.S_IWRITE)
+        os.remove(path)
+
+
+def link_or_copy(source: str, destination: str):
+    """Hard-link ``source`` to ``destination``, copying it when the file system cannot link."""
+    if os.path.lexists(destination):
+        _remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+def reflink_or_copy(source: str, destination: str):
+    """Clone ``source`` to ``destination`` copy-on-write, copying it when the file system cannot clone."""
+    if os.path.lexists(destination):
+        _remove(destination)
+    if fcntl is not None and sys.platform.startswith("linux"):
+        try:
+            with open(source, "rb") as source_file, open(destination, "wb") as destination_file:
+                fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+            shutil.copystat(source, destination)
+            return
+        except OSError:
+            os.remove(destination)
+    shutil.copy2(source, destination)
+
+
+class PackageStore:
+    """Files stored once by content under an export folder."""
+
+    def __init__(self, export_folder: str):
+        self.folder = os.path.join(export_folder, STORE_FOLDER)
+        # Digest of each source file by path, valid while its size and modification time match
+        self.index: Dict[str, dict] = {}
+        try:
+            with open(os.path.join(self.folder, INDEX_NAME), "r", encoding="utf-8") as f:
+                self.index = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def digest(self, path: str) -> str:
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        entry = self.index.get(path)
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return entry["sha256"]
+
+        digest = sha256_file(path)
+        self.index[path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest}
+        return digest
+
+    def add(self, path: str) -> str:
+        """Store the content of ``path`` unless it already is, and return the stored file."""
+        digest = self.digest(path)
+        # The extension is kept for tools guessing the format from the name
+        stored_path = os.path.join(self.folder, digest[:2], digest + os.path.splitext(path)[1].lower())
+        if not os.path.exists(stored_path):
+            os.makedirs(os.path.dirname(stored_path), exist_ok=True)
+            temp_path = stored_path + ".tmp"
+            shutil.copy2(path, temp_path)
+            os.chmod(temp_path, STORED_FILE_MODE)
+            os.replace(temp_path, stored_path)
+        elif stat.S_IMODE(os.stat(stored_path).st_mode) != STORED_FILE_MODE:
+            # Removing a link to it on Windows made it writable
+            os.chmod(stored_path, STORED_FILE_MODE)
+        return stored_path
+
+    def place(self, path: str, destination: str, editable: bool = False) -> str:
+        """Put the content of ``path`` at ``destination`` through the store."""
+        stored_path = self.add(path)
+        if editable:
+            reflink_or_copy(stored_path, destination)
+            os.chmod(destination, STORED_FILE_MODE | stat.S_IWUSR)
+        else:
+            link_or_copy(stored_path, destination)
+        return stored_path
+
+    def save(self):
+        os.makedirs(self.folder, exist_ok=True)
+        index_path = os.path.join(self.folder, INDEX_NAME)
+        temp_path = index_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.index, f, indent=2, sort_keys=True)
+        os.replace(temp_path, index_path)
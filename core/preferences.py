@@ -36,3 +36,9 @@ class Preferences(SettingManager):
             String("cloudDirectory", Scope.Global, str(home.joinpath("QField/cloud")))
         )
         self.add_setting(Bool("firstRun", Scope.Global, True))
+        # Rendering limits written into packaged projects, see core/device_profile.py
+        self.add_setting(String("deviceProfile", Scope.Global, "low_end"))
+        # Engine copying the offline layers: cbms, qgiscore or pythonmini, chosen in the package dialog, see core/cbms_offliner.py
+        self.add_setting(String("offliner", Scope.Global, "qgiscore"))
+        # Also write each package as <export>/<geocode>.zip, see core/package_archive.py
+        self.add_setting(Bool("packageArchive", Scope.Global, False))
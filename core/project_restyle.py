@@ -0,0 +1,302 @@
+"""
+    Batch restyling of exported project files without opening their data.
+
+    Restyling a project through the validator opens it in QGIS, which opens
+    every data provider. The tool below rewrites the style sections of the
+    ``<maplayer>`` elements in the project XML instead, matching layers by
+    the same keywords as the validator, so no GeoPackage is ever touched.
+    ``.qgz`` archives are rewritten member by member into a temporary file
+    that replaces the original once complete, and projects are processed
+    in parallel worker processes.
+
+    Usage, from the plugin folder:
+
+        python -m core.project_restyle path/to/exports [more paths] --workers 8
+"""
+
+import argparse
+import copy
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import xml.etree.ElementTree as ET
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from .qml_config import QmlConfig
+from .style_compiler import DOCTYPE
+
+# Keywords the validator matches layer names with, in matching order
+LAYER_KEYWORDS = ["ea2024", "bgy", "bldg_point", "block", "landmark", "road", "river"]
+
+# Same custom property and fingerprint as the style cache, see core/style_cache.py
+STYLE_FINGERPRINT_PROPERTY = "auqcbms/styleFingerprint"
+
+# Style root attributes that describe the file rather than the layer
+STYLE_FILE_ATTRIBUTES = ("version", "styleCategories")
+
+PROJECT_EXTENSIONS = (".qgs", ".qgz")
+
+# Custom properties that belong to the packaged layer (QField sync and offline editing
+# settings), whatever the style file carries over from the project it was saved in
+LAYER_PROPERTY_PREFIXES = ("QFieldSync/", "isOfflineEditable", "layerNameSuffix", "remoteLayerId", "remoteProvider", "remoteSource")
+
+
+class ProjectStyle(NamedTuple):
+    """A QML prepared for patching into project XML."""
+    attributes: Dict[str, str]
+    sections: List[ET.Element]
+    fingerprint: str
+
+
+class RestyleResult(NamedTuple):
+    path: str
+    restyled: List[str]
+    unchanged: List[str]
+    error: Optional[str] = None
+
+
+def style_fingerprint(qml_path: str) -> str:
+    """Return the fingerprint the style cache stores for a QML."""
+    with open(qml_path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def load_project_styles(qml_folder: str) -> Dict[str, ProjectStyle]:
+    """Read the QMLs configured for each layer keyword in ``qml_config.json``."""
+    config = QmlConfig(os.path.join(qml_folder, "qml_config.json"))
+
+    styles = {}
+    for keyword in LAYER_KEYWORDS:
+        qml_path = config.qml_path(keyword)
+        if not qml_path:
+            print(f"Warning: No QML file available for layer '{keyword}'.")
+            continue
+
+        root = ET.parse(qml_path).getroot()
+        styles[keyword] = ProjectStyle(
+            attributes={k: v for k, v in root.attrib.items() if k not in STYLE_FILE_ATTRIBUTES},
+            sections=list(root),
+            fingerprint=style_fingerprint(qml_path),
+        )
+    return styles
+
+
+def layer_keyword(layer_name: str) -> Optional[str]:
+    for keyword in LAYER_KEYWORDS:
+        if keyword in layer_name:
+            return keyword
+    return None
+
+
+def _custom_property(maplayer: ET.Element, key: str) -> Optional[str]:
+    properties = maplayer.find("customproperties")
+    if properties is None:
+        return None
+    for option in properties.iter("Option"):
+        if option.get("name") == key:
+            return option.get("value")
+    for prop in properties.iter("property"):
+        if prop.get("key") == key:
+            return prop.get("value")
+    return None
+
+
+def _properties_element(maplayer: ET.Element) -> ET.Element:
+    properties = maplayer.find("customproperties")
+    if properties is None:
+        properties = ET.SubElement(maplayer, "customproperties")
+    return properties
+
+
+def _option_map(properties: ET.Element) -> ET.Element:
+    option_map = properties.find("Option")
+    if option_map is None:
+        option_map = ET.SubElement(properties, "Option", type="Map")
+    return option_map
+
+
+def _set_option(option_map: ET.Element, option: ET.Element):
+    for existing in option_map.findall("Option"):
+        if existing.get("name") == option.get("name"):
+            option_map.remove(existing)
+    option_map.append(option)
+
+
+def _set_custom_property(maplayer: ET.Element, key: str, value: str):
+    properties = _properties_element(maplayer)
+
+    # Projects written before QGIS 3.20 store <property> elements instead of an Option map
+    if properties.find("property") is not None:
+        for prop in properties.findall("property"):
+            if prop.get("key") == key:
+                properties.remove(prop)
+        ET.SubElement(properties, "property", key=key, value=value)
+        return
+
+    _set_option(_option_map(properties), ET.Element("Option", name=key, type="QString", value=value))
+
+
+def _merge_custom_properties(maplayer: ET.Element, section: ET.Element):
+    # Keep the layer's own properties, the style's win on conflicts
+    style_options = section.find("Option")
+    properties = _properties_element(maplayer)
+    if style_options is None or properties.find("property") is not None:
+        return
+
+    option_map = _option_map(properties)
+    for option in style_options.findall("Option"):
+        if not option.get("name", "").startswith(LAYER_PROPERTY_PREFIXES):
+            _set_option(option_map, option)
+
+
+def restyle_maplayer(maplayer: ET.Element, style: ProjectStyle) -> bool:
+    """Patch a style into a ``<maplayer>`` element. Returns False if it already carries it."""
+    if _custom_property(maplayer, STYLE_FINGERPRINT_PROPERTY) == style.fingerprint:
+        return False
+
+    for name, value in style.attributes.items():
+        maplayer.set(name, value)
+
+    for section in style.sections:
+        section = copy.deepcopy(section)
+        if section.tag == "customproperties":
+            _merge_custom_properties(maplayer, section)
+            continue
+
+        existing = maplayer.find(section.tag)
+        if existing is None:
+            maplayer.append(section)
+        else:
+            maplayer.insert(list(maplayer).index(existing), section)
+            maplayer.remove(existing)
+
+    _set_custom_property(maplayer, STYLE_FINGERPRINT_PROPERTY, style.fingerprint)
+    return True
+
+
+def restyle_project_xml(xml_bytes: bytes, styles: Dict[str, ProjectStyle]) -> Tuple[Optional[bytes], List[str], List[str]]:
+    """Restyle the matching layers of project XML.
+
+    Returns the new XML (None when nothing changed), the restyled and the
+    unchanged layer names.
+    """
+    root = ET.fromstring(xml_bytes)
+    restyled, unchanged = [], []
+    for maplayer in root.iter("maplayer"):
+        name = maplayer.findtext("layername", "")
+        style = styles.get(layer_keyword(name))
+        if style is None:
+            continue
+        if restyle_maplayer(maplayer, style):
+            restyled.append(name)
+        else:
+            unchanged.append(name)
+
+    if not restyled:
+        return None, restyled, unchanged
+    return (DOCTYPE + "\n").encode("utf-8") + ET.tostring(root, encoding="utf-8", xml_declaration=False), restyled, unchanged
+
+
+def _replace_atomically(path: str, write):
+    handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(handle, "wb") as f:
+            write(f)
+        shutil.copymode(path, temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def restyle_project(path: str, styles: Dict[str, ProjectStyle]) -> RestyleResult:
+    """Restyle a .qgs or .qgz project file in place."""
+    try:
+        if path.lower().endswith(".qgs"):
+            with open(path, "rb") as f:
+                xml_bytes, restyled, unchanged = restyle_project_xml(f.read(), styles)
+            if xml_bytes is not None:
+                _replace_atomically(path, lambda out: out.write(xml_bytes))
+            return RestyleResult(path, restyled, unchanged)
+
+        with zipfile.ZipFile(path) as archive:
+            project_member = next(name for name in archive.namelist() if name.lower().endswith(".qgs"))
+            xml_bytes, restyled, unchanged = restyle_project_xml(archive.read(project_member), styles)
+            if xml_bytes is None:
+                return RestyleResult(path, restyled, unchanged)
+
+            def write(out):
+                with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as new_archive:
+                    for info in archive.infolist():
+                        if info.filename == project_member:
+                            new_archive.writestr(info, xml_bytes)
+                            continue
+                        # Copy the other members (e.g. the auxiliary storage) as streams
+                        with archive.open(info) as source, new_archive.open(info, "w") as target:
+                            shutil.copyfileobj(source, target)
+
+            _replace_atomically(path, write)
+        return RestyleResult(path, restyled, unchanged)
+    except (OSError, ET.ParseError, zipfile.BadZipFile, StopIteration) as e:
+        return RestyleResult(path, [], [], error=str(e) or type(e).__name__)
+
+
+def find_projects(paths: Iterable[str]) -> List[str]:
+    projects = []
+    for path in paths:
+        if os.path.isfile(path):
+            projects.append(path)
+            continue
+        for folder, _dirs, files in os.walk(path):
+            projects.extend(os.path.join(folder, file) for file in files if file.lower().endswith(PROJECT_EXTENSIONS))
+    return sorted(projects)
+
+
+_worker_styles: Dict[str, ProjectStyle] = {}
+
+
+def _init_worker(styles: Dict[str, ProjectStyle]):
+    global _worker_styles
+    _worker_styles = styles
+
+
+def _restyle_in_worker(path: str) -> RestyleResult:
+    return restyle_project(path, _worker_styles)
+
+
+def restyle_projects(paths: Iterable[str], qml_folder: str, max_workers: Optional[int] = None) -> List[RestyleResult]:
+    """Restyle every project found in ``paths`` with the QMLs of ``qml_folder``."""
+    styles = load_project_styles(qml_folder)
+    projects = find_projects(paths)
+    if not projects or not styles:
+        return []
+
+    # The styles are sent to each worker once, not with every project
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(styles,)) as executor:
+        return list(executor.map(_restyle_in_worker, projects, chunksize=4))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Patch the CBMS QML styles into exported project files.")
+    parser.add_argument("paths", nargs="+", help="project files or folders searched for .qgs/.qgz files")
+    parser.add_argument("--qml-dir", default=os.path.join(os.path.dirname(os.path.dirname(__file__)), "qml"))
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes")
+    args = parser.parse_args(argv)
+
+    results = restyle_projects(args.paths, args.qml_dir, args.workers)
+    for result in results:
+        if result.error:
+            print(f"Error: {result.path}: {result.error}")
+        else:
+            print(f"{result.path}: {len(result.restyled)} restyled, {len(result.unchanged)} already up to date")
+
+    print(f"Restyled {sum(1 for r in results if r.restyled)} of {len(results)} projects.")
+    return 1 if any(result.error for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""
+    Per-geocode projects rendered from a cached project template.
+
+    After exporting a geocode, the packager used to call ``setDataSource``
+    on every exported layer and write the live project, which reloaded each
+    provider and left the user's project pointing at the last export. The
+    template below is the project XML written once to a temporary file.
+    Each per-geocode ``.qgz`` is produced from it by rewriting the
+    ``datasource``, ``provider`` and layer tree ``source`` entries of the
+    exported layers, without touching the live project or its providers.
+
+    The template is written with absolute paths, as it lives in a temporary
+    folder. When the project stores relative paths, the file sources of the
+    other layers are made relative to each written project.
+"""
+
+import copy
+import hashlib
+import os
+import shutil
+import xml.etree.ElementTree as ET
+import zipfile
+from typing import Dict, FrozenSet, Optional, Tuple
+
+from libqfieldsync.utils.qgis import make_temp_qgis_file
+from qgis.core import QgsPathResolver, QgsProject, QgsProviderRegistry, QgsVectorLayer
+from qgis.PyQt.QtXml import QDomDocument
+
+from .style_compiler import DOCTYPE
+
+
+def _style_digest(layer) -> str:
+    document = QDomDocument()
+    layer.exportNamedStyle(document)
+    return hashlib.sha1(document.toByteArray()).hexdigest()
+
+
+def project_state(project: QgsProject) -> FrozenSet[Tuple[str, ...]]:
+    """Return what the template depends on: the name, source, subset and style of every layer."""
+    return frozenset(
+        (
+            layer_id,
+            layer.name(),
+            layer.source(),
+            layer.subsetString() if isinstance(layer, QgsVectorLayer) else "",
+            _style_digest(layer),
+        )
+        for layer_id, layer in project.mapLayers().items()
+    )
+
+
+def _relative_source(provider: str, source: str, resolver: QgsPathResolver) -> str:
+    """Make the file path of a layer source relative, like QGIS does when writing a project."""
+    metadata = QgsProviderRegistry.instance().providerMetadata(provider)
+    if metadata is None:
+        return source
+    parts = metadata.decodeUri(source)
+    if not parts.get("path"):
+        return source
+    parts["path"] = resolver.writePath(parts["path"])
+    return metadata.encodeUri(parts)
+
+
+class ProjectTemplate:
+    """The XML of a project, from which copies with repointed layers are written."""
+
+    def __init__(self, root: ET.Element, state: FrozenSet[Tuple[str, ...]], relative_paths: bool):
+        self.root = root
+        # Layers of the project when the template was built, see is_current
+        self.state = state
+        # Whether the written projects store relative paths, the template itself has absolute ones
+        self.relative_paths = relative_paths
+
+    @classmethod
+    def build(cls, project: QgsProject) -> "ProjectTemplate":
+        """Write the project, including unsaved changes, to a temporary file and keep its XML."""
+        was_dirty = project.isDirty()
+        absolute_paths, _ok = project.readBoolEntry("Paths", "/Absolute", False)
+        # Paths relative to the temporary folder would not resolve from the written projects
+        project.writeEntry("Paths", "/Absolute", True)
+        try:
+            template_path = make_temp_qgis_file(project)
+        finally:
+            project.writeEntry("Paths", "/Absolute", absolute_paths)
+        try:
+            root = ET.parse(template_path).getroot()
+        finally:
+            shutil.rmtree(os.path.dirname(template_path), ignore_errors=True)
+        # Writing the temporary copy marks the project as saved, which it is not
+        project.setDirty(was_dirty)
+        return cls(root, project_state(project), not absolute_paths)
+
+    def is_current(self, project: QgsProject) -> bool:
+        return self.state == project_state(project)
+
+    def render(
+        self, project_path: str, gpkg_path: str, tables: Dict[str, str], subsets: Optional[Dict[str, str]] = None,
+    ) -> ET.Element:
+        """Return the XML of the project ``project_path`` with layers repointed to tables of ``gpkg_path``.
+
+        ``tables`` maps layer ids to GeoPackage table names and ``subsets``
+        optionally gives the subset string of a repointed layer; the others
+        get none, their table holding only the exported features.
+        """
+        root = copy.deepcopy(self.root)
+        subsets = subsets or {}
+        gpkg_source = os.path.abspath(gpkg_path)
+        if self.relative_paths:
+            resolver = QgsPathResolver(os.path.abspath(project_path))
+            gpkg_source = resolver.writePath(gpkg_source)
+            paths = root.find("properties/Paths/Absolute")
+            if paths is not None:
+                paths.text = "false"
+
+        sources = {}
+        for layer_id, table in tables.items():
+            source = f"{gpkg_source}|layername={table}"
+            if subsets.get(layer_id):
+                source += f"|subset={subsets[layer_id]}"
+            sources[layer_id] = source
+
+        # Sources of the layers that stay as they are, made relative to the written project
+        kept_sources = {}
+        for maplayer in root.iter("maplayer"):
+            layer_id = maplayer.findtext("id", "")
+            source = sources.get(layer_id)
+            datasource = maplayer.find("datasource")
+            if source is None:
+                if self.relative_paths and datasource is not None and datasource.text:
+                    datasource.text = _relative_source(maplayer.findtext("provider", ""), datasource.text, resolver)
+                    kept_sources[layer_id] = datasource.text
+                continue
+            datasource.text = source
+            provider = maplayer.find("provider")
+            if provider is None:
+                provider = ET.SubElement(maplayer, "provider", encoding="UTF-8")
+            provider.text = "ogr"
+
+        for tree_layer in root.iter("layer-tree-layer"):
+            source = sources.get(tree_layer.get("id"))
+            if source is not None:
+                tree_layer.set("source", source)
+                tree_layer.set("providerKey", "ogr")
+            elif tree_layer.get("id") in kept_sources:
+                tree_layer.set("source", kept_sources[tree_layer.get("id")])
+        return root
+
+    def write_qgz(self, project_path: str, gpkg_path: str, tables: Dict[str, str], subsets: Optional[Dict[str, str]] = None):
+        """Write a ``.qgz`` project whose exported layers read from ``gpkg_path``."""
+        root = self.render(project_path, gpkg_path, tables, subsets)
+        xml_bytes = (DOCTYPE + "\n").encode("utf-8") + ET.tostring(root, encoding="utf-8", xml_declaration=False)
+        member = os.path.splitext(os.path.basename(project_path))[0] + ".qgs"
+
+        temp_path = project_path + ".tmp"
+        with zipfile.ZipFile(temp_path, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr(member, xml_bytes)
+        os.replace(temp_path, project_path)
@@ -0,0 +1,186 @@
+"""
+    Cached, validated access to ``qml/qml_config.json``.
+
+    The dialogs used to reopen and parse the config on every click and
+    check each referenced QML with ``os.path.exists`` per layer. The config
+    is now loaded once, checked against the expected layout, and every QML
+    it references is resolved and stat'ed up front, so missing files are
+    reported once when the config is loaded rather than while styling. The
+    file is only read again when its modification time or size changes.
+"""
+
+import json
+import os
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+QML_FOLDER = os.path.join(os.path.dirname(os.path.dirname(__file__)), "qml")
+QML_CONFIG_PATH = os.path.join(QML_FOLDER, "qml_config.json")
+# Value of a 'keep_fields' entry copying every field of the layer into packages
+KEEP_ALL_FIELDS = "*"
+
+
+class LoadedConfig(NamedTuple):
+    signature: Optional[Tuple[int, int]]
+    data: dict
+    roles: List[str]
+    # Role to absolute QML path, for the files that exist
+    qml_paths: Dict[str, str]
+    # Role to absolute QML path, for the files that are missing
+    missing: Dict[str, str]
+    form8_paths: List[str]
+    layer_order: List[str]
+    errors: List[str]
+
+
+def _is_string_list(value) -> bool:
+    return isinstance(value, list) and all(isinstance(item, str) for item in value)
+
+
+def validate_config(data) -> List[str]:
+    """Return the problems found in the config layout, empty when it is valid."""
+    if not isinstance(data, dict):
+        return ["The config must be a JSON object."]
+
+    errors = []
+    qml_files = data.get("qml_files")
+    if not isinstance(qml_files, dict) or not all(
+        isinstance(role, str) and isinstance(file, str) for role, file in qml_files.items()
+    ):
+        errors.append("'qml_files' must map layer roles to QML file names.")
+        qml_files = {}
+
+    if not _is_string_list(data.get("CBMS_Form_8", [])):
+        errors.append("'CBMS_Form_8' must be a list of QML file names.")
+
+    keep_fields = data.get("keep_fields", {})
+    if not isinstance(keep_fields, dict) or not all(
+        isinstance(role, str) and (fields == KEEP_ALL_FIELDS or _is_string_list(fields))
+        for role, fields in keep_fields.items()
+    ):
+        errors.append(f"'keep_fields' must map layer roles to lists of field names or \"{KEEP_ALL_FIELDS}\".")
+
+    layer_order = data.get("layer_order", [])
+    if not _is_string_list(layer_order):
+        errors.append("'layer_order' must be a list of layer roles.")
+    else:
+        errors.extend(
+            f"'layer_order' refers to '{role}', which has no entry in 'qml_files'."
+            for role in layer_order if role not in qml_files
+        )
+    return errors
+
+
+def _config_signature(config_path: str) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(config_path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def load_config(config_path: str) -> LoadedConfig:
+    """Read, validate and resolve a config file."""
+    qml_folder = os.path.dirname(os.path.abspath(config_path))
+    signature = _config_signature(config_path)
+    if signature is None:
+        return LoadedConfig(None, {}, [], {}, {}, [], [], [f"JSON file not found at {config_path}"])
+
+    try:
+        with open(config_path, "r") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        return LoadedConfig(signature, {}, [], {}, {}, [], [], [f"Could not read {config_path}: {e}"])
+
+    errors = validate_config(data)
+    if errors and not isinstance(data, dict):
+        return LoadedConfig(signature, {}, [], {}, {}, [], [], errors)
+
+    roles, qml_paths, missing = [], {}, {}
+    qml_files = data.get("qml_files")
+    for role, qml_file in (qml_files.items() if isinstance(qml_files, dict) else ()):
+        if not isinstance(qml_file, str):
+            continue
+        roles.append(role)
+        qml_path = os.path.join(qml_folder, qml_file)
+        if os.path.isfile(qml_path):
+            qml_paths[role] = qml_path
+        else:
+            missing[role] = qml_path
+
+    form8_files = data.get("CBMS_Form_8", [])
+    form8_paths = [os.path.join(qml_folder, file) for file in form8_files] if _is_string_list(form8_files) else []
+    layer_order = data.get("layer_order", [])
+    layer_order = [role for role in layer_order if role in roles] if _is_string_list(layer_order) else []
+
+    return LoadedConfig(signature, data, roles, qml_paths, missing, form8_paths, layer_order, errors)
+
+
+class QmlConfig:
+    """The QML style configuration, reloaded only when the file changes."""
+
+    def __init__(self, config_path: str = QML_CONFIG_PATH):
+        self.config_path = config_path
+        self._loaded: Optional[LoadedConfig] = None
+
+    def _current(self) -> LoadedConfig:
+        if self._loaded is None or self._loaded.signature != _config_signature(self.config_path):
+            self._loaded = load_config(self.config_path)
+            self._report(self._loaded)
+        return self._loaded
+
+    @staticmethod
+    def _report(loaded: LoadedConfig):
+        for error in loaded.errors:
+            print(f"Error: {error}")
+        for role, qml_path in loaded.missing.items():
+            print(f"Warning: QML file for layer '{role}' not found at {qml_path}")
+
+    def reload(self):
+        self._loaded = None
+
+    @property
+    def data(self) -> dict:
+        return self._current().data
+
+    @property
+    def errors(self) -> List[str]:
+        return self._current().errors
+
+    def roles(self) -> List[str]:
+        """Return every layer role with a QML entry, including roles whose file is missing."""
+        return list(self._current().roles)
+
+    def layer_order(self) -> List[str]:
+        return list(self._current().layer_order)
+
+    def qml_path(self, role: str) -> Optional[str]:
+        """Return the absolute path of the QML for a layer role, None when not configured or missing."""
+        return self._current().qml_paths.get(role)
+
+    def missing_files(self) -> Dict[str, str]:
+        return dict(self._current().missing)
+
+    def form8_paths(self) -> List[str]:
+        return list(self._current().form8_paths)
+
+    def keep_fields(self, role: Optional[str]) -> Union[List[str], str]:
+        """Return the fields always packaged for a layer role, besides those its form uses.
+
+        ``KEEP_ALL_FIELDS`` means every field is packaged.
+        """
+        keep_fields = self.data.get("keep_fields", {}) if isinstance(self.data.get("keep_fields"), dict) else {}
+        fields = keep_fields.get(role, [])
+        if fields == KEEP_ALL_FIELDS:
+            return KEEP_ALL_FIELDS
+        return list(fields) if _is_string_list(fields) else []
+
+
+_config: Optional[QmlConfig] = None
+
+
+def qml_config() -> QmlConfig:
+    """Return the plugin's QML configuration."""
+    global _config
+    if _config is None:
+        _config = QmlConfig()
+    return _config
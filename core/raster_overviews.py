@@ -0,0 +1,155 @@
+"""
+    Background overview (pyramid) generation for loaded raster layers.
+
+    Orthophoto GeoPackages delivered with the CBMS exports usually come
+    without overviews, so every zoomed-out render reads full resolution
+    tiles. The task below builds the missing overviews with GDAL off the
+    GUI thread, as external ``.ovr`` files, and refreshes the affected
+    layers once it is done.
+
+    GeoPackages cannot have external overviews, theirs are extra tile
+    matrices written into the database. The task builds them through a
+    GDAL data provider of its own, which drops QGIS's cached handles on the
+    file before reopening it for update, and the layer's provider is
+    reloaded once the overviews are in.
+"""
+
+from typing import Callable, Dict, List, Optional
+
+from osgeo import gdal
+from qgis.core import (
+    Qgis,
+    QgsDataProvider,
+    QgsMessageLog,
+    QgsProject,
+    QgsProviderRegistry,
+    QgsRaster,
+    QgsRasterBlockFeedback,
+    QgsRasterLayer,
+    QgsTask,
+)
+
+OVERVIEW_RESAMPLING = "AVERAGE"
+# Stop adding levels once the coarsest overview fits in a single tile
+MIN_OVERVIEW_SIZE = 256
+
+LOG_TAG = "AuQCBMS"
+
+
+def overview_levels(width: int, height: int) -> List[int]:
+    """Return the decimation factors needed for a raster of the given size."""
+    levels = []
+    factor = 2
+    while max(width, height) / factor >= MIN_OVERVIEW_SIZE:
+        levels.append(factor)
+        factor *= 2
+    return levels
+
+
+def needs_overviews(layer: QgsRasterLayer) -> bool:
+    """Check whether a raster layer is large enough and has no pyramids yet."""
+    if not layer.isValid() or layer.providerType() != "gdal":
+        return False
+
+    # Datasets read through GDAL's virtual filesystems (e.g. /vsizip/) are read-only
+    if layer.source().startswith("/vsi"):
+        return False
+
+    if not overview_levels(layer.width(), layer.height()):
+        return False
+
+    return not layer.dataProvider().hasPyramids()
+
+
+def is_geopackage(source: str) -> bool:
+    """Check whether a raster source is a GeoPackage, whose overviews go inside the database."""
+    return source.lower().startswith("gpkg:") or source.lower().endswith(".gpkg")
+
+
+def _build_geopackage_overviews(source: str, progress: Callable[[float], None], is_canceled: Callable[[], bool]) -> Optional[str]:
+    """Build the overviews of a GeoPackage raster through a GDAL provider of its own, returning the error if any."""
+    provider = QgsProviderRegistry.instance().createProvider("gdal", source, QgsDataProvider.ProviderOptions())
+    if provider is None or not provider.isValid():
+        return f"Could not open {source}"
+
+    feedback = QgsRasterBlockFeedback()
+
+    def on_progress(percent):
+        progress(percent / 100)
+        if is_canceled():
+            feedback.cancel()
+    feedback.progressChanged.connect(on_progress)
+
+    pyramids = provider.buildPyramidList(overview_levels(provider.xSize(), provider.ySize()))
+    for pyramid in pyramids:
+        pyramid.setBuild(True)
+    error = provider.buildPyramids(pyramids, OVERVIEW_RESAMPLING, QgsRaster.PyramidsInternal, {}, feedback)
+    return f"Failed to build overviews for {source}: {error}" if error else None
+
+
+class OverviewBuilderTask(QgsTask):
+    """Builds GDAL overviews for raster layers and repaints them when done."""
+
+    def __init__(self, layers: List[QgsRasterLayer]):
+        super().__init__("Building raster overviews", QgsTask.CanCancel)
+        # Only plain values cross into `run`, layers are looked up again in `finished`
+        self.sources: Dict[str, str] = {layer.id(): layer.source() for layer in layers}
+        self.built: List[str] = []
+        self.errors: List[str] = []
+
+    def run(self):
+        total = len(self.sources)
+        for index, (layer_id, source) in enumerate(self.sources.items()):
+            if self.isCanceled():
+                return False
+
+            def set_progress(complete, index=index):
+                self.setProgress((index + complete) / total * 100)
+
+            if is_geopackage(source):
+                error = _build_geopackage_overviews(source, set_progress, self.isCanceled)
+                if error:
+                    self.errors.append(error)
+                    continue
+                self.built.append(layer_id)
+                continue
+
+            def progress(complete, _message, _data):
+                set_progress(complete)
+                return 0 if self.isCanceled() else 1
+
+            # Opened read-only, the overviews go to an external .ovr next to the file
+            dataset = gdal.Open(source, gdal.GA_ReadOnly)
+            if dataset is None:
+                self.errors.append(f"Could not open {source}")
+                continue
+
+            levels = overview_levels(dataset.RasterXSize, dataset.RasterYSize)
+            result = dataset.BuildOverviews(OVERVIEW_RESAMPLING, levels, callback=progress)
+            dataset = None  # close and flush
+
+            if result != 0:
+                self.errors.append(f"Failed to build overviews for {source}")
+                continue
+
+            self.built.append(layer_id)
+
+        return True
+
+    def finished(self, result):
+        project = QgsProject.instance()
+        for layer_id in self.built:
+            layer = project.mapLayer(layer_id)
+            if layer is None:
+                continue
+            layer.dataProvider().reloadData()
+            layer.triggerRepaint()
+            QgsMessageLog.logMessage(
+                f"Built overviews for raster layer: {layer.name()}", LOG_TAG, Qgis.Info
+            )
+
+        for error in self.errors:
+            QgsMessageLog.logMessage(error, LOG_TAG, Qgis.Warning)
+
+        if not result:
+            QgsMessageLog.logMessage("Overview generation was cancelled.", LOG_TAG, Qgis.Warning)
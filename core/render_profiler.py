@@ -0,0 +1,184 @@
+"""
+    Per-layer render profiling of the CBMS styles.
+
+    Renders the current map extent at several scales and records for every
+    layer how long it took to render, how many features fell in the extent
+    and how many labels were placed. The per-layer times of a render job
+    are not available from Python, so each layer is timed with a
+    sequential job of its own, labels included; labels are counted on one
+    ``QgsMapRendererParallelJob`` of all layers, as the canvas places them. Layers are ranked by their total render time,
+    so the QML files in ``qml/`` worth tuning first can be picked on
+    evidence rather than impressions.
+"""
+
+import csv
+import statistics
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from qgis.core import (
+    QgsFeatureRequest,
+    QgsMapLayer,
+    QgsMapRendererParallelJob,
+    QgsMapRendererSequentialJob,
+    QgsMapSettings,
+    QgsRectangle,
+    QgsVectorLayer,
+)
+
+from .layer_roles import layer_roles
+from .qml_config import qml_config
+
+DEFAULT_SCALES = (2500, 5000, 10000, 25000, 50000)
+# Renders per scale, the median time is kept to smooth out disk cache and thread noise
+DEFAULT_RUNS = 3
+
+REPORT_COLUMNS = ["rank", "layer", "role", "qml", "scale", "render_ms", "features", "labels", "visible"]
+
+
+class LayerProfile(NamedTuple):
+    layer_id: str
+    layer_name: str
+    scale: float
+    render_ms: float
+    features: int
+    labels: int
+    # False when the layer's scale-dependent visibility hides it at this scale
+    visible: bool
+
+
+def extent_at_scale(settings: QgsMapSettings, extent: QgsRectangle, scale: float) -> QgsRectangle:
+    """Return ``extent`` zoomed around its center so that it renders at ``scale``."""
+    settings.setExtent(extent)
+    return extent.scaled(scale / settings.scale())
+
+
+def _feature_count(layer: QgsMapLayer, settings: QgsMapSettings) -> int:
+    if not isinstance(layer, QgsVectorLayer):
+        return 0
+    rect = settings.mapToLayerCoordinates(layer, settings.visibleExtent())
+    request = QgsFeatureRequest(rect).setNoAttributes().setFlags(QgsFeatureRequest.NoGeometry)
+    return sum(1 for _feature in layer.getFeatures(request))
+
+
+def _label_counts(job: QgsMapRendererParallelJob, settings: QgsMapSettings) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    results = job.takeLabelingResults()
+    if results is None:
+        return counts
+    for position in results.labelsWithinRect(settings.visibleExtent()):
+        if not position.isUnplaced:
+            counts[position.layerID] = counts.get(position.layerID, 0) + 1
+    return counts
+
+
+def _render_labels(settings: QgsMapSettings) -> Dict[str, int]:
+    """Render all layers together and return the labels placed per layer."""
+    job = QgsMapRendererParallelJob(settings)
+    job.start()
+    job.waitForFinished()
+    return _label_counts(job, settings)
+
+
+def _render_ms(settings: QgsMapSettings, layer: QgsMapLayer) -> int:
+    """Render ``layer`` alone and return how long it took."""
+    layer_settings = QgsMapSettings(settings)
+    layer_settings.setLayers([layer])
+    job = QgsMapRendererSequentialJob(layer_settings)
+    job.start()
+    job.waitForFinished()
+    return job.renderingTime()
+
+
+def profile_layers(
+    base_settings: QgsMapSettings,
+    layers: Iterable[QgsMapLayer],
+    scales: Iterable[float] = DEFAULT_SCALES,
+    runs: int = DEFAULT_RUNS,
+) -> List[LayerProfile]:
+    """Render the extent of ``base_settings`` at each scale and profile every layer."""
+    layers = [layer for layer in layers if layer is not None and layer.isValid()]
+    profiles = []
+    for scale in scales:
+        settings = QgsMapSettings(base_settings)
+        settings.setLayers(layers)
+        settings.setFlag(QgsMapSettings.DrawLabeling, True)
+        settings.setExtent(extent_at_scale(QgsMapSettings(base_settings), base_settings.extent(), scale))
+
+        labels = _render_labels(settings)
+        for layer in layers:
+            visible = layer.isInScaleRange(settings.scale())
+            times = [_render_ms(settings, layer) for _run in range(max(runs, 1))] if visible else [0]
+            profiles.append(LayerProfile(
+                layer_id=layer.id(),
+                layer_name=layer.name(),
+                scale=scale,
+                render_ms=statistics.median(times),
+                features=_feature_count(layer, settings) if visible else 0,
+                labels=labels.get(layer.id(), 0),
+                visible=visible,
+            ))
+    return profiles
+
+
+def profile_canvas(canvas, layers: Optional[Iterable[QgsMapLayer]] = None, scales: Iterable[float] = DEFAULT_SCALES, runs: int = DEFAULT_RUNS) -> List[LayerProfile]:
+    """Profile the canvas layers (or the given ones) around the current canvas extent."""
+    settings = canvas.mapSettings()
+    return profile_layers(settings, settings.layers() if layers is None else layers, scales, runs)
+
+
+def rank_layers(profiles: Iterable[LayerProfile]) -> List[Tuple[str, float]]:
+    """Return the layer ids with their total render time over all scales, slowest first."""
+    totals: Dict[str, float] = {}
+    for profile in profiles:
+        totals[profile.layer_id] = totals.get(profile.layer_id, 0.0) + profile.render_ms
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)
+
+
+def _style_file(layer_id: str) -> Tuple[str, str]:
+    # The role and QML of a layer, when it is one of the configured CBMS layers
+    registry = layer_roles()
+    role = registry.role(registry.project.mapLayer(layer_id)) or ""
+    qml_path = qml_config().qml_path(role) if role else None
+    return role, qml_path or ""
+
+
+def report_rows(profiles: List[LayerProfile]) -> List[dict]:
+    """Return the report rows, grouped by layer from the slowest to the fastest."""
+    rows = []
+    for rank, (layer_id, _total) in enumerate(rank_layers(profiles), start=1):
+        role, qml_path = _style_file(layer_id)
+        for profile in sorted((p for p in profiles if p.layer_id == layer_id), key=lambda p: p.scale):
+            rows.append({
+                "rank": rank,
+                "layer": profile.layer_name,
+                "role": role,
+                "qml": qml_path,
+                "scale": int(profile.scale),
+                "render_ms": round(profile.render_ms, 1),
+                "features": profile.features,
+                "labels": profile.labels,
+                "visible": int(profile.visible),
+            })
+    return rows
+
+
+def write_report(profiles: List[LayerProfile], csv_path: str):
+    """Save the ranked report as CSV."""
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_COLUMNS)
+        writer.writeheader()
+        writer.writerows(report_rows(profiles))
+
+
+def format_report(profiles: List[LayerProfile]) -> str:
+    """Return a one line per layer summary, slowest first."""
+    names = {profile.layer_id: profile.layer_name for profile in profiles}
+    lines = []
+    for rank, (layer_id, total) in enumerate(rank_layers(profiles), start=1):
+        layer_profiles = [p for p in profiles if p.layer_id == layer_id]
+        per_scale = ", ".join(
+            "1:{:,}: {:.0f} ms/{} features/{} labels".format(int(p.scale), p.render_ms, p.features, p.labels)
+            for p in sorted(layer_profiles, key=lambda p: p.scale)
+        )
+        lines.append("{}. {}: {:.0f} ms total ({})".format(rank, names[layer_id], total, per_scale))
+    return "\n".join(lines)
@@ -0,0 +1,244 @@
+"""
+    Process-wide cache of parsed QML styles.
+
+    ``QgsMapLayer.loadNamedStyle`` reads and parses the QML from disk on
+    every call, and several of the CBMS styles are 230-350 KB. Each QML is
+    parsed once into a ``QDomDocument`` kept in a small LRU cache, keyed by
+    path, modification time and size, so applying it again only costs the
+    import into the layer.
+
+    Each applied style is fingerprinted with a hash of the QML content that
+    is stored as a layer custom property, so applying the same style to a
+    layer that already carries it is skipped entirely. Every layer of the
+    project is watched from the moment it is added, so editing its style by
+    other means drops the fingerprint, even in a reopened project.
+
+    Parsing is pure CPU work, so all QMLs needed for a restyle can be
+    preloaded concurrently in worker threads; the GUI thread then only
+    imports the prepared documents, with canvas rendering frozen.
+"""
+
+import hashlib
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+from qgis.core import QgsMapLayer
+from qgis.PyQt.QtXml import QDomDocument
+
+# Enough for every QML in the plugin's qml folder
+DEFAULT_MAX_ENTRIES = 16
+
+STYLE_FINGERPRINT_PROPERTY = "auqcbms/styleFingerprint"
+# Dynamic Qt property marking layer objects whose `styleChanged` signal drops a stale fingerprint.
+# It lives and dies with the layer object, unlike the layer id which a reopened project reuses.
+WATCHED_PROPERTY = "auqcbmsStyleWatched"
+
+
+class CachedStyle(NamedTuple):
+    signature: Tuple[int, int]
+    document: QDomDocument
+    fingerprint: str
+
+
+class StyleCache:
+    """LRU cache of parsed QML documents."""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, CachedStyle]" = OrderedDict()
+        self._applying = False
+        self._project = None
+
+    def style(self, qml_path: str) -> Optional[CachedStyle]:
+        """Return the parsed QML, reading it from disk only when not cached or changed."""
+        path = os.path.abspath(qml_path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self._entries.pop(path, None)
+            return None
+
+        signature = (stat.st_mtime_ns, stat.st_size)
+        entry = self._entries.get(path)
+        if entry is not None and entry.signature == signature:
+            self._entries.move_to_end(path)
+            return entry
+
+        entry = _parse_style(path, signature)
+        if entry is None:
+            self._entries.pop(path, None)
+            return None
+
+        self._store(path, entry)
+        return entry
+
+    def _store(self, path: str, entry: CachedStyle):
+        self._entries[path] = entry
+        self._entries.move_to_end(path)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def preload(self, qml_paths: Iterable[str], max_workers: Optional[int] = None) -> List[str]:
+        """Parse and validate every QML that is not cached yet in worker threads.
+
+        Returns the paths that could not be read or are not QGIS styles.
+        """
+        pending = {}
+        invalid = []
+        for qml_path in qml_paths:
+            path = os.path.abspath(qml_path)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                invalid.append(qml_path)
+                continue
+
+            signature = (stat.st_mtime_ns, stat.st_size)
+            entry = self._entries.get(path)
+            if entry is None or entry.signature != signature:
+                pending[path] = (qml_path, signature)
+
+        if pending:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = executor.map(
+                    lambda item: (item[0], item[1][0], _parse_style(item[0], item[1][1])),
+                    pending.items(),
+                )
+                # Only the calling thread touches the cache itself
+                for path, qml_path, entry in results:
+                    if entry is None:
+                        invalid.append(qml_path)
+                    else:
+                        self._store(path, entry)
+
+        return invalid
+
+    def document(self, qml_path: str) -> Optional[QDomDocument]:
+        entry = self.style(qml_path)
+        return entry.document if entry else None
+
+    def is_applied(self, layer: QgsMapLayer, qml_path: str) -> bool:
+        """Check whether the layer already carries exactly this QML style."""
+        entry = self.style(qml_path)
+        if entry is None or layer.customProperty(STYLE_FINGERPRINT_PROPERTY) != entry.fingerprint:
+            return False
+
+        self._watch(layer)
+        return True
+
+    def apply(self, layer: QgsMapLayer, qml_path: str) -> bool:
+        """Apply a cached QML style to a layer, like ``layer.loadNamedStyle(qml_path)``."""
+        entry = self.style(qml_path)
+        if entry is None:
+            return False
+
+        self._applying = True
+        try:
+            success, _error_message = layer.importNamedStyle(entry.document)
+        finally:
+            self._applying = False
+
+        if success:
+            layer.setCustomProperty(STYLE_FINGERPRINT_PROPERTY, entry.fingerprint)
+            self._watch(layer)
+        else:
+            layer.removeCustomProperty(STYLE_FINGERPRINT_PROPERTY)
+        return success
+
+    def _watch(self, layer: QgsMapLayer):
+        """Forget the fingerprint once the style is edited by other means."""
+        if layer.property(WATCHED_PROPERTY):
+            return
+        layer.setProperty(WATCHED_PROPERTY, True)
+
+        def on_style_changed():
+            if not self._applying:
+                layer.removeCustomProperty(STYLE_FINGERPRINT_PROPERTY)
+
+        layer.styleChanged.connect(on_style_changed)
+
+    def watch_project(self, project):
+        """Watch the styles of the project's layers as soon as they are added.
+
+        Fingerprints are saved with the project, so a reopened layer must be
+        watched before its style can be edited, not only once it is validated.
+        """
+        self.unwatch_project()
+        self._project = project
+        for layer in project.mapLayers().values():
+            self._watch(layer)
+        project.layersAdded.connect(self._on_layers_added)
+
+    def unwatch_project(self):
+        if self._project is not None:
+            self._project.layersAdded.disconnect(self._on_layers_added)
+            self._project = None
+
+    def _on_layers_added(self, layers: List[QgsMapLayer]):
+        for layer in layers:
+            self._watch(layer)
+
+    def clear(self):
+        self._entries.clear()
+
+
+def _parse_style(path: str, signature: Tuple[int, int]) -> Optional[CachedStyle]:
+    """Read, parse and validate a QML file. Safe to call from worker threads."""
+    try:
+        with open(path, "rb") as f:
+            content = f.read()
+    except OSError:
+        return None
+
+    document = QDomDocument("qgis")
+    if not document.setContent(content) or document.documentElement().tagName() != "qgis":
+        return None
+
+    return CachedStyle(signature, document, hashlib.sha1(content).hexdigest())
+
+
+style_cache = StyleCache()
+
+
+def apply_cached_style(layer: QgsMapLayer, qml_path: str) -> bool:
+    """Apply a QML style to a layer through the process-wide style cache."""
+    return style_cache.apply(layer, qml_path)
+
+
+def is_style_applied(layer: QgsMapLayer, qml_path: str) -> bool:
+    """Check the layer's style fingerprint against the QML through the process-wide cache."""
+    return style_cache.is_applied(layer, qml_path)
+
+
+def watch_project_styles(project):
+    """Watch the style edits of every layer of the project through the process-wide cache."""
+    style_cache.watch_project(project)
+
+
+def unwatch_project_styles():
+    style_cache.unwatch_project()
+
+
+def preload_styles(qml_paths: Iterable[str]) -> List[str]:
+    """Parse the given QMLs concurrently into the process-wide cache, returning the invalid ones."""
+    return style_cache.preload(qml_paths)
+
+
+@contextmanager
+def frozen_canvas(canvas):
+    """Suspend canvas rendering while a batch of styles is applied, then refresh once."""
+    if canvas is None:
+        yield
+        return
+
+    was_frozen = canvas.isFrozen()
+    canvas.freeze(True)
+    try:
+        yield
+    finally:
+        canvas.freeze(was_frozen)
+        if not was_frozen:
+            canvas.refresh()
@@ -0,0 +1,373 @@
+"""
+    Offline compiler for the plugin's QML styles.
+
+    The shipped QMLs are written by several QGIS versions and carry a lot of
+    configuration that is either a default or never read: pretty-printing,
+    legacy ``<prop>`` copies of every symbol layer property, empty
+    data-defined property collections, per-field entries that only restate
+    the defaults (empty aliases and default expressions, zero constraints,
+    editable/label-on-top/reuse-last-value flags) and default text widget
+    options. Every style load and every packaged project pays for them.
+
+    ``compile_style`` removes exactly those, leaving everything else as it
+    is. ``verify_style`` checks a compiled file: without QGIS it re-parses it
+    and checks the compiler is idempotent on it; with QGIS available both
+    files are applied to a layer with the style's fields and the exported
+    layer styles must match.
+
+    Usage, from the plugin folder:
+
+        python -m core.style_compiler qml build/qml
+"""
+
+import argparse
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+DOCTYPE = "<!DOCTYPE qgis PUBLIC 'http://mrcc.com/qgis.dtd' 'SYSTEM'>"
+
+# Per-field entries equal to what QGIS assumes for fields that are not listed
+DEFAULT_FIELD_FLAGS = {
+    "editable": ("editable", "1"),
+    "labelOnTop": ("labelOnTop", "0"),
+    "reuseLastValue": ("reuseLastValue", "0"),
+}
+
+# Widget options that are read with a false default when missing
+DEFAULT_WIDGET_OPTIONS = {
+    "TextEdit": {"IsMultiline": "false", "UseHtml": "false"},
+}
+
+PARSE_REPEATS = 5
+
+
+class CompileReport(NamedTuple):
+    name: str
+    original_size: int
+    compiled_size: int
+    original_parse_ms: float
+    compiled_parse_ms: float
+    removed: Dict[str, int]
+    verified: Optional[bool]
+    message: str
+
+
+def _is_empty_property_collection(element: ET.Element) -> bool:
+    """Check a ``data_defined_properties`` element for an empty collection."""
+    children = list(element)
+    if len(children) != 1 or children[0].tag != "Option":
+        return False
+
+    options = {option.get("name"): option for option in children[0]}
+    if set(options) != {"name", "properties", "type"}:
+        return False
+
+    return (
+        options["name"].get("value", "") == ""
+        and options["type"].get("value") == "collection"
+        and len(options["properties"]) == 0
+    )
+
+
+def _option_map(element: ET.Element) -> Optional[Dict[str, str]]:
+    """Read a flat ``<Option type="Map">`` of string values, None if it is not one."""
+    if element.get("type") != "Map":
+        return None
+
+    values = {}
+    for option in element:
+        if option.tag != "Option" or len(option):
+            return None
+        values[option.get("name")] = option.get("value", "")
+    return values
+
+
+def _remove_legacy_props(root: ET.Element) -> int:
+    # Symbol layers saved before QGIS 3.26 repeat their properties as <prop>
+    # elements. They are only a fallback for styles without the Option map,
+    # so they go when the Option map holds the same values.
+    removed = 0
+    for layer in root.iter("layer"):
+        props = [child for child in layer if child.tag == "prop"]
+        option_map = layer.find("Option")
+        if not props or option_map is None:
+            continue
+
+        if _option_map(option_map) != {prop.get("k"): prop.get("v", "") for prop in props}:
+            continue
+
+        for prop in props:
+            layer.remove(prop)
+        removed += len(props)
+    return removed
+
+
+def _remove_empty_property_collections(root: ET.Element) -> int:
+    # Symbols and symbol layers keep their default, empty collection when the element is missing
+    removed = 0
+    for parent in root.iter():
+        if parent.tag not in ("symbol", "layer"):
+            continue
+        for child in list(parent):
+            if child.tag == "data_defined_properties" and _is_empty_property_collection(child):
+                parent.remove(child)
+                removed += 1
+    return removed
+
+
+def _remove_children(root: ET.Element, parent_tag: str, predicate: Callable[[ET.Element], bool]) -> int:
+    removed = 0
+    for parent in root.iter(parent_tag):
+        for child in list(parent):
+            if predicate(child):
+                parent.remove(child)
+                removed += 1
+    return removed
+
+
+def _remove_default_field_entries(root: ET.Element) -> Dict[str, int]:
+    removed = {
+        "aliases": _remove_children(root, "aliases", lambda e: e.tag == "alias" and not e.get("name")),
+        "defaults": _remove_children(
+            root,
+            "defaults",
+            lambda e: e.tag == "default" and not e.get("expression") and e.get("applyOnUpdate", "0") == "0",
+        ),
+        "constraints": _remove_children(
+            root,
+            "constraints",
+            lambda e: e.tag == "constraint"
+            and all(e.get(name, "0") == "0" for name in ("constraints", "notnull_strength", "unique_strength", "exp_strength")),
+        ),
+        "constraintExpressions": _remove_children(
+            root,
+            "constraintExpressions",
+            lambda e: e.tag == "constraint" and not e.get("exp") and not e.get("desc"),
+        ),
+    }
+
+    for parent_tag, (attribute, default) in DEFAULT_FIELD_FLAGS.items():
+        removed[parent_tag] = _remove_children(
+            root, parent_tag, lambda e: e.tag == "field" and e.get(attribute) == default
+        )
+    return removed
+
+
+def _remove_default_widget_options(root: ET.Element) -> int:
+    removed = 0
+    for edit_widget in root.iter("editWidget"):
+        defaults = DEFAULT_WIDGET_OPTIONS.get(edit_widget.get("type"))
+        config = edit_widget.find("config/Option")
+        if not defaults or config is None:
+            continue
+
+        for option in list(config):
+            if option.tag == "Option" and defaults.get(option.get("name")) == option.get("value"):
+                config.remove(option)
+                removed += 1
+    return removed
+
+
+def _remove_unused_init_code(root: ET.Element) -> int:
+    # The init code template is only run when a code source is selected
+    source = root.find("editforminitcodesource")
+    code = root.find("editforminitcode")
+    if source is None or code is None or (source.text or "").strip() != "0" or not code.text:
+        return 0
+
+    code.text = None
+    return 1
+
+
+def _strip_whitespace(root: ET.Element):
+    # QDomDocument drops whitespace-only text nodes when parsing, so the indentation is never read
+    for element in root.iter():
+        if element.text is not None and not element.text.strip():
+            element.text = None
+        if element.tail is not None and not element.tail.strip():
+            element.tail = None
+
+
+def compile_style(xml_text: str) -> Tuple[str, Dict[str, int]]:
+    """Compile QML text, returning the compiled text and the removal counts per rule."""
+    root = ET.fromstring(xml_text)
+    if root.tag != "qgis":
+        raise ValueError("Not a QGIS style: root element is <{}>".format(root.tag))
+
+    removed = {
+        "prop": _remove_legacy_props(root),
+        "data_defined_properties": _remove_empty_property_collections(root),
+    }
+    removed.update(_remove_default_field_entries(root))
+    removed["widget options"] = _remove_default_widget_options(root)
+    removed["editforminitcode"] = _remove_unused_init_code(root)
+    _strip_whitespace(root)
+
+    return DOCTYPE + "\n" + ET.tostring(root, encoding="unicode"), removed
+
+
+def parse_time_ms(xml_text: str) -> float:
+    """Return the best of several parse times of a QML, in milliseconds.
+
+    Uses ``QDomDocument`` like QGIS when available, ElementTree otherwise.
+    """
+    try:
+        from qgis.PyQt.QtXml import QDomDocument
+    except ImportError:
+        QDomDocument = None
+
+    content = xml_text.encode("utf-8")
+    best = None
+    for _ in range(PARSE_REPEATS):
+        start = time.perf_counter()
+        if QDomDocument is not None:
+            QDomDocument("qgis").setContent(content)
+        else:
+            ET.fromstring(content)
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _style_fields(root: ET.Element) -> List[str]:
+    return [field.get("name") for field in root.iter("field") if field.get("name") and field.find("editWidget") is not None]
+
+
+def _exported_style(xml_text: str) -> Optional[str]:
+    """Apply a QML to a memory layer with the style's fields and export the layer's style."""
+    from qgis.core import QgsVectorLayer
+    from qgis.PyQt.QtXml import QDomDocument
+
+    root = ET.fromstring(xml_text)
+    geometry = {"0": "Point", "1": "LineString", "2": "Polygon"}.get(root.findtext("layerGeometryType", "").strip(), "None")
+    fields = "&".join("field={}:string".format(name) for name in _style_fields(root))
+    layer = QgsVectorLayer("{}?{}".format(geometry, fields), "style_check", "memory")
+
+    document = QDomDocument("qgis")
+    if not document.setContent(xml_text.encode("utf-8")):
+        return None
+    success, _error_message = layer.importNamedStyle(document)
+    if not success:
+        return None
+
+    exported = QDomDocument("qgis")
+    layer.exportNamedStyle(exported)
+    return exported.toString()
+
+
+def verify_style(original_text: str, compiled_text: str) -> Tuple[Optional[bool], str]:
+    """Check a compiled QML against its original.
+
+    Returns ``(result, message)``. The result is None when the structural
+    checks passed but QGIS is not available to compare the loaded styles.
+    """
+    try:
+        compiled_root = ET.fromstring(compiled_text)
+        original_root = ET.fromstring(original_text)
+    except ET.ParseError as e:
+        return False, "compiled style does not parse: {}".format(e)
+
+    if compiled_root.attrib != original_root.attrib:
+        return False, "layer level settings differ"
+    if compile_style(compiled_text)[0] != compiled_text:
+        return False, "compiler is not idempotent on the compiled style"
+
+    try:
+        import qgis.core  # noqa: F401
+    except ImportError:
+        return None, "structure checked, QGIS not available to compare the loaded styles"
+
+    # Both exports are compiled, so only entries the compiler treats as dead may differ
+    original_export = _exported_style(original_text)
+    compiled_export = _exported_style(compiled_text)
+    if original_export is None or compiled_export is None:
+        return False, "style could not be applied to a layer"
+    if compile_style(original_export)[0] != compile_style(compiled_export)[0]:
+        return False, "loaded layer styles differ"
+    return True, "loaded layer styles match"
+
+
+def compile_file(qml_path: str, output_path: str, verify: bool = True) -> CompileReport:
+    """Compile a QML file to ``output_path`` and measure the savings."""
+    with open(qml_path, encoding="utf-8") as f:
+        original_text = f.read()
+
+    compiled_text, removed = compile_style(original_text)
+    verified, message = verify_style(original_text, compiled_text) if verify else (None, "not verified")
+
+    # Never ship a style that failed verification
+    if verified is not False:
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.write(compiled_text)
+
+    return CompileReport(
+        name=os.path.basename(qml_path),
+        original_size=len(original_text.encode("utf-8")),
+        compiled_size=len(compiled_text.encode("utf-8")),
+        original_parse_ms=parse_time_ms(original_text),
+        compiled_parse_ms=parse_time_ms(compiled_text),
+        removed=removed,
+        verified=verified,
+        message=message,
+    )
+
+
+def compile_folder(qml_folder: str, output_folder: str, verify: bool = True) -> List[CompileReport]:
+    reports = []
+    for file in sorted(os.listdir(qml_folder)):
+        if file.lower().endswith(".qml"):
+            reports.append(compile_file(os.path.join(qml_folder, file), os.path.join(output_folder, file), verify))
+    return reports
+
+
+def format_report(reports: List[CompileReport]) -> str:
+    lines = []
+    for report in reports:
+        saved = report.original_size - report.compiled_size
+        lines.append(
+            "{}: {:,} -> {:,} bytes (-{:.1%}), parse {:.1f} -> {:.1f} ms, {} elements removed. {}".format(
+                report.name,
+                report.original_size,
+                report.compiled_size,
+                saved / report.original_size if report.original_size else 0,
+                report.original_parse_ms,
+                report.compiled_parse_ms,
+                sum(report.removed.values()),
+                report.message,
+            )
+        )
+
+    original_total = sum(report.original_size for report in reports)
+    compiled_total = sum(report.compiled_size for report in reports)
+    lines.append(
+        "Total: {:,} -> {:,} bytes, parse {:.1f} -> {:.1f} ms".format(
+            original_total,
+            compiled_total,
+            sum(report.original_parse_ms for report in reports),
+            sum(report.compiled_parse_ms for report in reports),
+        )
+    )
+    return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Strip default and unused configuration from QML styles.")
+    parser.add_argument("qml_folder", help="folder with the source QML files")
+    parser.add_argument("output_folder", help="folder receiving the compiled QML files")
+    parser.add_argument("--no-verify", action="store_true", help="skip the equivalence checks")
+    args = parser.parse_args(argv)
+
+    if os.path.abspath(args.qml_folder) == os.path.abspath(args.output_folder):
+        parser.error("the output folder must differ from the source folder")
+
+    reports = compile_folder(args.qml_folder, args.output_folder, verify=not args.no_verify)
+    print(format_report(reports))
+    return 1 if any(report.verified is False for report in reports) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,28 +5,30 @@ from qgis.PyQt.QtWidgets import (
     QProgressBar, QLabel, QMessageBox
 )
 from qgis.PyQt.uic import loadUiType
+from ..core.layer_roles import layer_roles
 
 DialogUi, _ = loadUiType(
     os.path.join(os.path.dirname(__file__), "../ui/filter_qp.ui")  # Path to UI file
 )
 
+# Layers filtered to the selected barangay
+FILTERED_ROLES = ('bgy', 'ea2024', 'bldg_point', 'river', 'landmark')
+
 # Function to filter layers based on selected geocode and suffix criteria
 def filter_layers(layers, selected_geocode):
     first_8_digits = selected_geocode[:8]
+    registry = layer_roles()
 
     # Loop through each layer in the dictionary and apply relevant filters
     for layer_key, layer in layers.items():
         if layer is not None and layer.isValid():
-            # Apply filters based on suffixes
-            if layer.name().endswith('_bgy'):
+            # Apply filters based on roles
+            role = registry.role(layer)
+            if role == 'bgy':
                 layer.setSubsetString(f"geocode = '{selected_geocode}'")
-            elif layer.name().endswith('_ea2024'):
-                layer.setSubsetString(f"geocode LIKE '{first_8_digits}%'")
-            elif layer.name().endswith('_bldg_point'):
-                layer.setSubsetString(f"geocode LIKE '{first_8_digits}%'")
-            elif layer.name().endswith('_river'):
+            elif role in ('ea2024', 'bldg_point', 'river'):
                 layer.setSubsetString(f"geocode LIKE '{first_8_digits}%'")
-            elif layer.name().endswith('_landmark'):
+            elif role == 'landmark':
                 layer.setSubsetString(f"geocode = '{first_8_digits}'")
             else:
                 QMessageBox.warning(None, "Unsupported Layer", f"Layer '{layer.name()}' does not match any known suffixes.")
@@ -97,7 +99,7 @@ class QGISLayerDialog(QDialog, DialogUi):
         selected_layer = self.layer_dropdown.currentData()
         self.geocode_dropdown.clear()
 
-        if selected_layer and selected_layer.name().endswith('_bgy'):
+        if selected_layer and layer_roles().role(selected_layer) == 'bgy':
             # Populate geocode dropdown with all unique geocodes from the layer, without filtering
             geocode_index = selected_layer.fields().indexOf('geocode')
             if geocode_index != -1:
@@ -115,10 +117,9 @@ class QGISLayerDialog(QDialog, DialogUi):
             print("No layer or geocode selected.")
             return
 
-        # Load predefined layer mapping based on known suffix patterns
+        # Load predefined layer mapping from the layer role registry
         self.layers = {
-            layer.name(): layer for layer in QgsProject.instance().mapLayers().values()
-            if layer.name().endswith(('_bgy', '_ea2024', '_bldg_point', '_river','_landmark'))
+            layer.name(): layer for role in FILTERED_ROLES for layer in layer_roles().layers(role)
         }
 
         # Filter based on geocode for other layers while keeping the geocode dropdown intact
@@ -126,10 +127,9 @@ class QGISLayerDialog(QDialog, DialogUi):
         self.progress_bar.setValue(100)  # Complete
 
     def reset_filter(self):
-        # Load predefined layer mapping based on known suffix patterns
+        # Load predefined layer mapping from the layer role registry
         self.layers = {
-            layer.name(): layer for layer in QgsProject.instance().mapLayers().values()
-            if layer.name().endswith(('_bgy', '_ea2024', '_bldg_point', '_river','_landmark'))
+            layer.name(): layer for role in FILTERED_ROLES for layer in layer_roles().layers(role)
         }
 
         # Reset filters for all layers
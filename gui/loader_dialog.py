@@ -1,4 +1,4 @@
-from qgis.core import QgsProject, QgsVectorLayer, QgsRasterLayer
+from qgis.core import QgsApplication, QgsProject, QgsVectorLayer, QgsRasterLayer
 from PyQt5.QtWidgets import (
     QDialog,
     QVBoxLayout,
@@ -14,6 +14,21 @@ from osgeo import ogr
 import shutil  # Ensure this import is at the top of your file
 from PyQt5.uic import loadUiType
 from qgis.gui import QgsFileWidget
+from ..core.export_source import ExportSource
+from ..core.lookup_tables import (
+    LOOKUP_GPKG_NAME,
+    import_lookup_table,
+    repoint_value_relations,
+    value_relation_columns,
+)
+from ..core.layer_roles import layer_roles
+from ..core.layout_template import LayoutTemplateCache, template_key
+from ..core.raster_overviews import OverviewBuilderTask, needs_overviews
+from ..core.style_cache import apply_cached_style, preload_styles
+from ..utils.file_utils import normalize_layer_source
+# Groups the loader creates in the layer tree
+LOADER_GROUPS = ("CBMS Form 8", "Base Layers", "Value Relation")
+
 DialogUi, _ = loadUiType(
     os.path.join(os.path.dirname(__file__), "../ui/loader.ui")
 )
@@ -31,9 +46,11 @@ class LayerLoaderDialog(QDialog,DialogUi):
         # Set up the layout (removed since it's handled in the UI file)
         self.setWindowTitle("Loader")
 
-        # Set up QgsFileWidget for base layer selection
-        self.select_baselayer.setStorageMode(QgsFileWidget.StorageMode.GetDirectory)
-        self.select_baselayer.setDialogTitle("Select Export Directory")
+        # Set up QgsFileWidget for base layer selection. Picking the maplayers GeoPackage
+        # loads its export folder, picking a zip loads the export without extracting it.
+        self.select_baselayer.setStorageMode(QgsFileWidget.StorageMode.GetFile)
+        self.select_baselayer.setFilter("CBMS export (*.gpkg *.zip)")
+        self.select_baselayer.setDialogTitle("Select Export GeoPackage or Zip Archive")
         # self.select_baselayer.fileChanged.connect(self.select_folder)  
 
         # Set up QgsFileWidget for QML folder selection
@@ -47,9 +64,14 @@ class LayerLoaderDialog(QDialog,DialogUi):
         self.progress_bar.setRange(0, 100)  # Set range for progress bar
 
         self.selected_folder = ""
+        self.export_source = None  # The export folder or zip archive being loaded
         self.qml_folder = ""  # Store the path of the selected QML folder
         self.sf_qml_file = ""  # Store the path for SF QML
         self.gp_qml_file = ""  # Store the path for GP QML
+        self.overview_task = None  # Keep a reference so the running task is not garbage collected
+        self.existing_layers = {}  # Layers already in the project, keyed by normalized source
+        self.skipped_layers = []  # Names of layers skipped because they were already loaded
+        self.layout_cache = LayoutTemplateCache()  # Cached QLR templates of previously loaded layouts
 
     # def select_folder(self):
     #     """Handle the selection of the export directory."""
@@ -70,43 +92,58 @@ class LayerLoaderDialog(QDialog,DialogUi):
  
     def run_loading_process(self):
         """Load layers from the selected folder and apply QML styles if layers are loaded."""
-        self.selected_folder = self.select_baselayer.filePath()  # Get the selected folder from QgsFileWidget
-        if not self.selected_folder:
+        selected_path = self.select_baselayer.filePath()  # Get the selected export from QgsFileWidget
+        if not selected_path:
             QMessageBox.warning(self, "Warning", "Please select a folder first.")
             return
         
-        # Validate the selected folder
-        if not os.path.exists(self.selected_folder):
+        # Validate the selected export
+        if not os.path.exists(selected_path):
             QMessageBox.critical(self, "Error", "Selected folder does not exist.")
             return
 
-        sf_layer, gp_layer, csv_layers, raster_layers = self.load_layers_from_folder(self.selected_folder)
-        self.sf_layer = sf_layer  # Store reference to SF layer
-        self.gp_layer = gp_layer  # Store reference to GP layer
+        # Zip archives are read in place, only the writable layers and the project go to disk
+        self.export_source = ExportSource(selected_path)
+        self.selected_folder = self.export_source.output_folder
+        os.makedirs(self.selected_folder, exist_ok=True)
+
+        # Index the layers already in the project so re-running on the same folder only adds what's new
+        self.index_existing_layers()
+
+        # A fresh load of an export laid out like a previous one reuses its cached template
+        prefix = self.export_prefix(self.export_source)
+        layout_key = template_key(self.export_source.list_files(), prefix, [self.sf_qml_file, self.gp_qml_file])
+        is_fresh_load = not any(
+            QgsProject.instance().layerTreeRoot().findGroup(name) for name in LOADER_GROUPS
+        )
+        if is_fresh_load and self.load_from_template(layout_key, prefix):
+            return
+
+        sf_layer, gp_layer, csv_layers, raster_layers = self.load_layers_from_folder(self.export_source)
 
         # Get the current project instance
         project = QgsProject.instance()
 
-        # Create a new group called "CBMS Form 8"
+        # Find or create the "CBMS Form 8" group
         root = project.layerTreeRoot()
-        cbms_group = root.addGroup("CBMS Form 8")
+        cbms_group = root.findGroup("CBMS Form 8") or root.addGroup("CBMS Form 8")
 
         # Update progress bar
         self.progress_bar.setValue(10)  # Update progress
 
         # Add the SF and GP layers to the "CBMS Form 8" group if they are valid
         if sf_layer and sf_layer.isValid():
-            project.addMapLayer(sf_layer, False)
-            cbms_group.addLayer(sf_layer)
+            self.sf_layer = self.add_layer_once(sf_layer, cbms_group)
         else:
+            self.sf_layer = None
             QMessageBox.critical(self, "Error", "SF layer failed to load!")
 
         self.progress_bar.setValue(30)  # Update progress
 
         if gp_layer and gp_layer.isValid():
-            project.addMapLayer(gp_layer, False)
-            cbms_group.addLayer(gp_layer)
+            self.gp_layer = self.add_layer_once(gp_layer, cbms_group)
         else:
+            self.gp_layer = None
             QMessageBox.critical(self, "Error", "GP layer failed to load!")
 
         self.progress_bar.setValue(50)  # Update progress
@@ -114,41 +151,43 @@ class LayerLoaderDialog(QDialog,DialogUi):
         # Optionally, expand the group
         cbms_group.setExpanded(True)
 
-        # Create a new group called "Base Layers"
-        base_layers_group = root.addGroup("Base Layers")
+        # Find or create the "Base Layers" group
+        base_layers_group = root.findGroup("Base Layers") or root.addGroup("Base Layers")
         base_layers_group.setExpanded(True)
 
         # Load layers from the specified GeoPackage
         # self.load_layers_from_geopackage(base_layers_group, os.path.join(self.selected_folder, "01001_maplayers.gpkg"))
           # Dynamically find GeoPackage files with _maplayers or _2024maplayers in their names
-        gpkg_files = [f for f in os.listdir(self.selected_folder) if f.endswith('.gpkg') and ('_maplayers' in f or '_2024maplayers' in f)]
+        gpkg_files = [f for f in self.export_source.list_files() if f.endswith('.gpkg') and ('_maplayers' in f or '_2024maplayers' in f)]
         if gpkg_files:
-            self.load_layers_from_geopackage(base_layers_group, os.path.join(self.selected_folder, gpkg_files[0]))  # Load the first matching file
+            self.load_layers_from_geopackage(base_layers_group, self.export_source.dataset_path(gpkg_files[0]))  # Load the first matching file
         else:
             QMessageBox.warning(self, "Warning", "No GeoPackage files found with the specified patterns.")
 
         self.progress_bar.setValue(90)  # Update progress
 
         # Load raster layers with 8-digit identifiers
+        added_rasters = []
         for raster_layer in raster_layers:
             if raster_layer.isValid():
-                # Add to the Base Layers group first
-                base_layers_group.addLayer(raster_layer)  
-                project.addMapLayer(raster_layer, False)  # Add to the project (root)
-
+                if self.add_layer_once(raster_layer, base_layers_group):
+                    added_rasters.append(raster_layer)
             else:
                 print(f"Raster layer {raster_layer.name()} is not valid.")  # Log invalid layers
 
+        # Build missing overviews in the background so zoomed-out rendering stays fast
+        self.build_missing_overviews(added_rasters)
+
         self.progress_bar.setValue(70)  # Update progress
 
-        # Create a new group called "Value Relation"
-        value_relation_group = root.addGroup("Value Relation")
+        # Find or create the "Value Relation" group
+        value_relation_group = root.findGroup("Value Relation") or root.addGroup("Value Relation")
 
         # Add the CSV layers to the "Value Relation" group
+        added_csvs = []
         for csv_layer in csv_layers:
-            if csv_layer.isValid():
-                project.addMapLayer(csv_layer, False)
-                value_relation_group.addLayer(csv_layer)
+            if csv_layer.isValid() and self.add_layer_once(csv_layer, value_relation_group):
+                added_csvs.append(csv_layer)
 
         # Optionally, expand the group
         value_relation_group.setExpanded(True)
@@ -158,29 +197,164 @@ class LayerLoaderDialog(QDialog,DialogUi):
 
         # Final print to confirm structure
         self.progress_bar.setValue(100)  # Update progress
-        QMessageBox.information(self, "Success", "Layers imported and organized successfully!")
+        message = "Layers imported and organized successfully!"
+        if self.skipped_layers:
+            message += "\n\nSkipped {} layer(s) already in the project:\n{}".format(
+                len(self.skipped_layers), "\n".join(f"- {name}" for name in self.skipped_layers)
+            )
+        QMessageBox.information(self, "Success", message)
+
+        # Parse both Form 8 styles concurrently before applying them
+        preload_styles([path for path in (self.sf_qml_file, self.gp_qml_file) if path])
 
         # After loading layers, apply QML styles if the layers are valid
         if self.sf_layer and self.sf_layer.isValid() and os.path.exists(self.sf_qml_file):
-            self.sf_layer.loadNamedStyle(self.sf_qml_file)
+            apply_cached_style(self.sf_layer, self.sf_qml_file)
             self.sf_layer.triggerRepaint()  # Refresh the layer to apply the style
             print(f"Applied QML style to SF layer: {self.sf_layer.name()}")  # {{ edit_1 }}
 
         if self.gp_layer and self.gp_layer.isValid() and os.path.exists(self.gp_qml_file):
-            self.gp_layer.loadNamedStyle(self.gp_qml_file)
+            apply_cached_style(self.gp_layer, self.gp_qml_file)
             self.gp_layer.triggerRepaint()  # Refresh the layer to apply the style
             print(f"Applied QML style to GP layer: {self.gp_layer.name()}")  # {{ edit_2 }}
 
-        # Change data source for the loaded layers
-        for layer in [self.sf_layer, self.gp_layer] + csv_layers + raster_layers:
+        # Point the value relation widgets at the indexed lookup tables
+        lookup_layers = {node.layer().name(): node.layer() for node in value_relation_group.findLayers() if node.layer()}
+        for layer in [self.sf_layer, self.gp_layer]:
+            if layer and layer.isValid():
+                updated = repoint_value_relations(layer, lookup_layers)
+                print(f"Pointed {updated} value relation widget(s) of {layer.name()} to the lookup tables")
+
+        # Change data source for the newly added layers
+        for layer in [self.sf_layer, self.gp_layer] + added_csvs + added_rasters:
             if layer and layer.isValid():
                 # Update the data source to the new path
                 new_source = layer.source()  # Get the current source
-                layer.setDataSource(new_source, layer.name(), "ogr")
+                layer.setDataSource(new_source, layer.name(), layer.providerType())
                 layer.updateExtents()  # Update extents after changing the data source
 
+        # Cache the finished layout so the next export with the same structure loads instantly
+        if is_fresh_load and not self.skipped_layers:
+            self.layout_cache.save(
+                layout_key,
+                [cbms_group, base_layers_group, value_relation_group],
+                self.export_source.path,
+                self.selected_folder,
+                prefix,
+            )
+
+        # Auto-save the QGIS project to the selected folder
+        project.write(os.path.join(self.selected_folder, "autosave_project.qgz"))  # Save the project
+
+    def load_from_template(self, layout_key, prefix):
+        """Instantiate a cached layout template for the selected export.
+
+        Returns False when there is no usable template, so the caller falls
+        back to building the layout layer by layer.
+        """
+        if not self.layout_cache.has_template(layout_key):
+            return False
+
+        self.copy_writable_files(prefix)
+        self.progress_bar.setValue(30)  # Update progress
+
+        project = QgsProject.instance()
+        if not self.layout_cache.instantiate(
+            layout_key, project, self.export_source.path, self.selected_folder, prefix
+        ):
+            return False
+
+        raster_layers = [layer for layer in project.mapLayers().values() if isinstance(layer, QgsRasterLayer)]
+        self.build_missing_overviews(raster_layers)
+
+        self.progress_bar.setValue(100)  # Update progress
+        QMessageBox.information(self, "Success", "Layers imported from the cached layout successfully!")
+
         # Auto-save the QGIS project to the selected folder
         project.write(os.path.join(self.selected_folder, "autosave_project.qgz"))  # Save the project
+        return True
+
+    def load_lookup_table(self, csv_path, index_columns):
+        """Import a lookup CSV into the export's indexed GeoPackage and load that table."""
+        gpkg_path = os.path.join(self.selected_folder, LOOKUP_GPKG_NAME)
+        layer_name = os.path.splitext(os.path.basename(csv_path))[0]
+        try:
+            table_name = import_lookup_table(csv_path, gpkg_path, index_columns)
+        except RuntimeError as e:
+            print(str(e))
+            return None
+
+        lookup_layer = QgsVectorLayer(f"{gpkg_path}|layername={table_name}", layer_name, "ogr")
+        if not lookup_layer.isValid():
+            print(f"Lookup table {layer_name} failed to load!")
+            return None
+
+        print(f"Loaded lookup table {layer_name} from {gpkg_path}")
+        return lookup_layer
+
+    def export_prefix(self, export_source):
+        """Return the 5-digit prefix of the export's maplayers GeoPackage."""
+        gpkg_files = [f for f in export_source.list_files() if f.endswith('.gpkg') and ('_maplayers' in f or '_2024maplayers' in f)]
+        return os.path.splitext(gpkg_files[0])[0][:5] if gpkg_files else ''
+
+    def copy_writable_files(self, prefix):
+        """Copy the _SF/_GP templates and import the lookup tables a template load expects on disk."""
+        files_folder_path = os.path.join(os.path.dirname(__file__), "files")
+        lookup_columns = value_relation_columns([self.sf_qml_file, self.gp_qml_file])
+        for file in os.listdir(files_folder_path):
+            name, ext = os.path.splitext(file)
+            if "_SF" in name or "_GP" in name:
+                new_file_name = f"{prefix}_{'SF' if '_SF' in name else 'GP'}{ext}"
+            elif ext == ".csv":
+                csv_path = self.export_source.dataset_path(file) if self.export_source.has_file(file) else os.path.join(files_folder_path, file)
+                import_lookup_table(csv_path, os.path.join(self.selected_folder, LOOKUP_GPKG_NAME), lookup_columns.get(name, ()))
+                continue
+            else:
+                continue
+
+            new_file_path = os.path.join(self.selected_folder, new_file_name)
+            if not os.path.exists(new_file_path):  # Never overwrite data collected in an earlier load
+                shutil.copy(os.path.join(files_folder_path, file), new_file_path)
+
+    def index_existing_layers(self):
+        """Index the project's layers by normalized source URI."""
+        self.existing_layers = {
+            normalize_layer_source(layer.source()): layer
+            for layer in QgsProject.instance().mapLayers().values()
+        }
+        self.skipped_layers = []
+
+    def add_layer_once(self, layer, group):
+        """Add a layer to the project and group unless its source is already loaded.
+
+        An existing layer with the same source that became invalid is replaced.
+        Returns the added layer, or None when the layer was skipped.
+        """
+        project = QgsProject.instance()
+        key = normalize_layer_source(layer.source())
+        existing_layer = self.existing_layers.get(key)
+
+        if existing_layer is not None:
+            if existing_layer.isValid():
+                self.skipped_layers.append(existing_layer.name())
+                print(f"Skipped layer already in the project: {existing_layer.name()}")
+                return None
+            project.removeMapLayer(existing_layer.id())
+
+        project.addMapLayer(layer, False)
+        group.addLayer(layer)
+        self.existing_layers[key] = layer
+        return layer
+
+    def build_missing_overviews(self, raster_layers):
+        """Queue a background task that builds overviews for rasters that lack them."""
+        layers = [layer for layer in raster_layers if needs_overviews(layer)]
+        if not layers:
+            return
+
+        self.overview_task = OverviewBuilderTask(layers)
+        QgsApplication.taskManager().addTask(self.overview_task)
+        print(f"Building overviews in the background for {len(layers)} raster layer(s).")
 
     def load_layers_from_geopackage(self, base_layers_group, gpkg_path):
         """Load all layers from a GeoPackage into the specified group."""
@@ -195,12 +369,11 @@ class LayerLoaderDialog(QDialog,DialogUi):
             layer_name = layer.GetName()
             qgis_layer = QgsVectorLayer(gpkg_path + f"|layername={layer_name}", layer_name, 'ogr')
             if qgis_layer.isValid():
-                QgsProject.instance().addMapLayer(qgis_layer, False)  # Add to project without adding to the map
-                base_layers_group.addLayer(qgis_layer)  # Add to the group
+                self.add_layer_once(qgis_layer, base_layers_group)  # Add to project and group unless already loaded
             else:
                 print(f"Layer {layer_name} failed to load!")
 
-    def load_layers_from_folder(self, folder_path):
+    def load_layers_from_folder(self, export_source):
         sf_layer = None
         gp_layer = None
         csv_layers = []
@@ -218,6 +391,9 @@ class LayerLoaderDialog(QDialog,DialogUi):
             QMessageBox.critical(self, "Error", f"The 'files' directory does not exist: {files_folder_path}")
             return  # Exit the function if the directory does not exist
 
+        # Columns the Form 8 value relation widgets look values up by, indexed in the lookup tables
+        lookup_columns = value_relation_columns([self.sf_qml_file, self.gp_qml_file])
+
         # Iterate through all files in the 'files' subfolder
         for file in os.listdir(files_folder_path):
             file_path = os.path.join(files_folder_path, file)
@@ -230,10 +406,12 @@ class LayerLoaderDialog(QDialog,DialogUi):
                     for ext in ['shp', 'cpg', 'dbf', 'shx', 'qmd', 'prj']:
                         original_file = os.path.splitext(file)[0] + '.' + ext
                         if os.path.exists(os.path.join(files_folder_path, original_file)):
-                            gpkg_files = [f for f in os.listdir(folder_path) if f.endswith('.gpkg') and ('_maplayers' in f or '_2024maplayers' in f)]
+                            gpkg_files = [f for f in export_source.list_files() if f.endswith('.gpkg') and ('_maplayers' in f or '_2024maplayers' in f)]
                             gpkg_prefix = os.path.splitext(gpkg_files[0])[0][:5] if gpkg_files else ''
                             new_file_name = f"{gpkg_prefix}_SF.{ext}"  # New name for the copied file
                             new_file_path = os.path.join(self.selected_folder, new_file_name)
+                            if os.path.exists(new_file_path):
+                                continue  # Never overwrite a template that may already hold collected data
                             shutil.copy(os.path.join(files_folder_path, original_file), new_file_path)  # Copy the file
                             print(f"Copied and renamed {original_file} to {new_file_path}")  # Log the action
                     # Change data source to the new path (specifically the .shp file)
@@ -250,10 +428,12 @@ class LayerLoaderDialog(QDialog,DialogUi):
                         original_file = os.path.splitext(file)[0] + '.' + ext
                         if os.path.exists(os.path.join(files_folder_path, original_file)):
                             # Extract the 5-digit prefix from the corresponding gpkg file
-                            gpkg_files = [f for f in os.listdir(folder_path) if f.endswith('.gpkg') and ('_maplayers' in f or '_2024maplayers' in f)]
+                            gpkg_files = [f for f in export_source.list_files() if f.endswith('.gpkg') and ('_maplayers' in f or '_2024maplayers' in f)]
                             gpkg_prefix = os.path.splitext(gpkg_files[0])[0][:5] if gpkg_files else ''  # Get the first 5 digits of the first gpkg file
                             new_file_name = f"{gpkg_prefix}_GP.{ext}"  # New name for the copied file
                             new_file_path = os.path.join(self.selected_folder, new_file_name)
+                            if os.path.exists(new_file_path):
+                                continue  # Never overwrite a template that may already hold collected data
                             shutil.copy(os.path.join(files_folder_path, original_file), new_file_path)
                             print(f"Copied and renamed {original_file} to {new_file_path}")  # Log the action
                     # Change data source to the new path (specifically the .shp file)
@@ -262,20 +442,17 @@ class LayerLoaderDialog(QDialog,DialogUi):
                     if not gp_layer.isValid():  # {{ edit_4 }}
                         print(f"Failed to set data source for GP layer: {gp_shp_path}")  # Log the error
             elif file.endswith(".csv"):
-                # Load CSV layer with proper URI and UTF-8 encoding
-                csv_layer = QgsVectorLayer(f"file:///{file_path}?delimiter=,&encoding=UTF-8", os.path.splitext(file)[0], "delimitedtext")  # {{ edit_1 }}
-                if csv_layer.isValid():
+                # Prefer the lookup table shipped with the export, read in place
+                csv_path = export_source.dataset_path(file) if export_source.has_file(file) else file_path
+                csv_layer = self.load_lookup_table(csv_path, lookup_columns.get(os.path.splitext(file)[0], ()))
+                if csv_layer is not None:
                     csv_layers.append(csv_layer)
-                    # Copy the CSV file to the selected folder
-                    new_csv_path = os.path.join(self.selected_folder, file)  # Define the new path
-                    shutil.copy(file_path, new_csv_path)  # Copy the file
-
-                    # Set the data source without encoding since it's already specified in the URI
-                    csv_layer.setDataSource(new_csv_path, os.path.splitext(file)[0], "ogr")  # {{ edit_2 }}
-                    print(f"Copied CSV file to: {new_csv_path}")  # Log the action
-            elif eight_digit_pattern.match(file):
+
+        # Orthophoto GeoPackages with 8-digit identifiers ship with the export itself
+        for file in export_source.list_files():
+            if eight_digit_pattern.match(file):
                 # Load GeoPackage raster layers
-                raster_layer = QgsRasterLayer(file_path, os.path.splitext(file)[0])
+                raster_layer = QgsRasterLayer(export_source.dataset_path(file), os.path.splitext(file)[0])
                 if raster_layer.isValid():
                     raster_layers.append(raster_layer)
                 else:
@@ -295,26 +472,21 @@ def rename_layers():
         'block':'block',
     }
 
-    # Get all layers in the project
-    layers = QgsProject.instance().mapLayers().values()
-    
-    for layer in layers:
-        layer_name = layer.name()
-        renamed = False  # Flag to track if a renaming has occurred
-        
-        for suffix, new_suffix in suffixes_to_rename.items():
-            if suffix in layer_name and not layer_name.endswith(new_suffix):
-                # Rename the layer to the new suffix
-                new_name = layer_name.split(suffix)[0] + new_suffix
-                layer.setName(new_name)
-                output = f"Layer renamed to: {new_name}"
-                renamed = True
-                break  # Break after renaming for this layer
-        
-        if not renamed:
-            output = f"No renaming needed for layer: {layer_name}"
-        
-        print(output)
+    # Layers whose name contains a suffix, from the layer role registry
+    registry = layer_roles()
+    renamed_layer_ids = set()
+
+    for suffix, new_suffix in suffixes_to_rename.items():
+        for layer in registry.layers(suffix, exact=False):
+            layer_name = layer.name()
+            if layer.id() in renamed_layer_ids or layer_name.endswith(new_suffix):
+                continue
+
+            # Rename the layer to the new suffix
+            new_name = layer_name.split(suffix)[0] + new_suffix
+            layer.setName(new_name)
+            renamed_layer_ids.add(layer.id())
+            print(f"Layer renamed to: {new_name}")
 
 # Call the function to execute the renaming
 rename_layers()
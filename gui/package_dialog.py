@@ -14,10 +14,11 @@
 
 import os
 
-from libqfieldsync.layer import LayerSource
+from libqfieldsync.layer import LayerSource, SyncAction
 from libqfieldsync.offline_converter import ExportType, OfflineConverter
 import sys
 from qgis import utils
+from qgis.utils import pluginMetadata
 # TODO this try/catch was added due to module structure changes in QFS 4.8.0. Remove this as enough time has passed since March 2024.
 try:
     from libqfieldsync.offliners import QgisCoreOffliner
@@ -36,22 +37,44 @@ from libqfieldsync.project import ProjectConfiguration
 from libqfieldsync.project_checker import ProjectChecker
 from libqfieldsync.utils.file_utils import fileparts
 from libqfieldsync.utils.qgis import get_project_title
-from qgis.core import Qgis, QgsApplication, QgsProject, QgsLayerTreeGroup, QgsLayerTreeLayer, QgsVectorLayer, QgsRasterLayer
+from qgis.core import Qgis, QgsApplication, QgsFileUtils, QgsProject, QgsLayerTreeGroup, QgsLayerTreeLayer, QgsVectorLayer, QgsRasterLayer
 from qgis.PyQt.QtCore import QDir, Qt, QUrl
 from qgis.PyQt.QtGui import QIcon
 from qgis.PyQt.QtWidgets import QApplication, QDialog, QDialogButtonBox, QMessageBox
 from qgis.PyQt.uic import loadUiType
 from .checker_feedback_table import CheckerFeedbackTable
+from ..core.cbms_offliner import OFFLINER_LABELS, OFFLINER_TYPES, CbmsOffliner, create_offliner
+from ..core.device_profile import apply_device_profile, device_profile
+from ..core.gpkg_compaction import compact_package, format_compaction
+from ..core.layer_roles import layer_roles
+from ..core.offliner_benchmark import benchmark_offliners, fastest_offliner, format_results
+from ..core.package_archive import PackageArchive, format_archive
+from ..core.package_fingerprints import (
+    database_fingerprint,
+    file_state,
+    fingerprint,
+    read_fingerprints,
+    write_fingerprints,
+)
+from ..core.package_manifest import MANIFEST_NAME, PhaseTimer, build_manifest, package_files, write_manifest
+from ..core.package_store import PackageStore
 from ..core.preferences import Preferences
 from .dirs_to_copy_widget import DirsToCopyWidget
 from .project_configuration_dialog import ProjectConfigurationDialog
 import processing
+from ..utils.qgis_utils import layer_source_paths
 from ..utils.qt_utils import make_folder_selector
 
 DialogUi, _ = loadUiType(
     os.path.join(os.path.dirname(__file__), "../ui/package_dialog.ui")
 )
 
+# Package files rewritten after the conversion, by compaction and the device profile
+FINALIZED_LATER = (".gpkg", ".qgs", ".qgz")
+
+# Layers filtered to the selected barangay before packaging
+FILTERED_ROLES = ('bgy', 'ea2024', 'bldg_point', 'block', 'ea')
+
 
 class PackageDialog(QDialog, DialogUi):
     def __init__(self, iface, project, offline_editing, parent=None):
@@ -60,9 +83,11 @@ class PackageDialog(QDialog, DialogUi):
         self.setupUi(self)
 
         self.iface = iface
-        self.offliner = QgisCoreOffliner(offline_editing=offline_editing)
-        self.project = project
         self.qfield_preferences = Preferences()
+        # Engine copying the offline layers, selected in offliner_dropdown, see select_offliner
+        self.offline_editing = offline_editing
+        self.offliner = None
+        self.project = project
         self.dirsToCopyWidget = DirsToCopyWidget()
         self.__project_configuration = ProjectConfiguration(self.project)
         self.run_button.clicked.connect(self.run)
@@ -76,6 +101,8 @@ class PackageDialog(QDialog, DialogUi):
         self.button_box.button(QDialogButtonBox.Reset).clicked.connect(
             self.reset_filter
         )
+        self.benchmark_button = self.button_box.addButton(self.tr("Benchmark"), QDialogButtonBox.ActionRole)
+        self.benchmark_button.clicked.connect(self.benchmark_offliners)
 
         self.devices = None
         self.project_checker = ProjectChecker(QgsProject.instance())
@@ -88,8 +115,6 @@ class PackageDialog(QDialog, DialogUi):
         # Load groups on dialog initialization
         self.load_layer_groups()
 
-        self.offliner.warning.connect(self.show_warning)
-
         
 
 
@@ -108,6 +133,13 @@ class PackageDialog(QDialog, DialogUi):
 
         self.manualDir.setText(QDir.toNativeSeparators(str(export_dirname)))
         self.manualDir_btn.clicked.connect(make_folder_selector(self.manualDir))
+        self.archive_checkbox.setChecked(self.qfield_preferences.value("packageArchive"))
+        for offliner_type in OFFLINER_TYPES:
+            self.offliner_dropdown.addItem(OFFLINER_LABELS[offliner_type], offliner_type)
+        index = self.offliner_dropdown.findData(self.qfield_preferences.value("offliner"))
+        self.offliner_dropdown.setCurrentIndex(max(index, 0))
+        self.select_offliner()
+        self.offliner_dropdown.currentIndexChanged.connect(self.select_offliner)
         self.update_info_visibility()
 
         self.nextButton.clicked.connect(lambda: self.show_package_page())
@@ -144,10 +176,8 @@ class PackageDialog(QDialog, DialogUi):
         self.button_box.setVisible(True)
         self.stackedWidget.setCurrentWidget(self.packagePage)
 
-    def package_project(self):
-        self.button_box.button(QDialogButtonBox.Save).setEnabled(False)
-
-        export_folder = self.get_export_folder_from_dialog()
+    def create_converter(self, offliner, export_folder):
+        """Create the offline converter packaging the project into ``export_folder``."""
         area_of_interest = (
             self.__project_configuration.area_of_interest
             if self.__project_configuration.area_of_interest
@@ -159,27 +189,13 @@ class PackageDialog(QDialog, DialogUi):
             else QgsProject.instance().crs().authid()
         )
 
-        selected_geocode = self.geocode_dropdown.currentText()
-
-        # Validation check for selected geocode
-        if not selected_geocode:
-            QMessageBox.warning(self, "Missing Geocode", "Please select a valid geocode before exporting.")
-            return
-
-        self.qfield_preferences.set_value("exportDirectoryProject", export_folder)
-        self.dirsToCopyWidget.save_settings()
-
-        # Create a directory based on the selected geocode
-        geocode_folder = os.path.join(export_folder, selected_geocode)
-        os.makedirs(geocode_folder, exist_ok=True)
-
         offline_convertor = OfflineConverter(
             self.project,
-            geocode_folder,
+            export_folder,
             area_of_interest,
             area_of_interest_crs,
             self.qfield_preferences.value("attachmentDirs"),
-            self.offliner,
+            offliner,
             ExportType.Cable,
             dirs_to_copy=self.dirsToCopyWidget.dirs_to_copy(),
         )
@@ -190,10 +206,87 @@ class PackageDialog(QDialog, DialogUi):
         offline_convertor.warning.connect(
             lambda title, body: QMessageBox.warning(None, title, body)
         )
+        return offline_convertor
+
+    def select_offliner(self):
+        """Create the offliner chosen in the dropdown."""
+        self.offliner = create_offliner(self.offliner_dropdown.currentData(), self.offline_editing)
+        self.offliner.warning.connect(self.show_warning)
+        # Column projection (see core/column_projection.py) is done by the CBMS offliner only
+        if isinstance(self.offliner, CbmsOffliner):
+            self.offliner_dropdown.setToolTip(self.tr(
+                "Only the fields the forms and styles use are packaged, more can be kept with keep_fields in qml_config.json."
+            ))
+        else:
+            self.offliner_dropdown.setToolTip(self.tr(
+                "Packages carry every field of the source layers, select the CBMS offliner to package only the fields the forms and styles use."
+            ))
+
+    def package_project(self):
+        self.button_box.button(QDialogButtonBox.Save).setEnabled(False)
+
+        export_folder = self.get_export_folder_from_dialog()
+        selected_geocode = self.geocode_dropdown.currentText()
+
+        # Validation check for selected geocode
+        if not selected_geocode:
+            QMessageBox.warning(self, "Missing Geocode", "Please select a valid geocode before exporting.")
+            return
+
+        self.qfield_preferences.set_value("exportDirectoryProject", export_folder)
+        self.qfield_preferences.set_value("packageArchive", self.archive_checkbox.isChecked())
+        self.qfield_preferences.set_value("offliner", self.offliner_dropdown.currentData())
+        self.dirsToCopyWidget.save_settings()
+
+        # Create a directory based on the selected geocode
+        geocode_folder = os.path.join(export_folder, selected_geocode)
+        os.makedirs(geocode_folder, exist_ok=True)
+
+        offline_convertor = self.create_converter(self.offliner, geocode_folder)
+        # The project is reloaded by the conversion, its sources are read beforehand
+        sources = layer_source_paths(self.project.mapLayers().values())
+        timer = PhaseTimer()
 
         try:
             QApplication.setOverrideCursor(Qt.WaitCursor)
-            offline_convertor.convert()
+            # Filled as the layers are switched, so a failure half way still restores them
+            original_actions = {}
+            try:
+                with timer.phase("reuse"):
+                    store = PackageStore(export_folder)
+                    file_fingerprints = self.reuse_copied_files(geocode_folder, store, original_actions)
+                    store.save()
+                with timer.phase("offline"):
+                    offline_convertor.convert()
+            finally:
+                self.restore_layer_actions(original_actions)
+
+            # Files are archived as soon as nothing rewrites them anymore, while the packaging goes on
+            archive = self.start_archive(geocode_folder) if self.archive_checkbox.isChecked() else None
+            try:
+                if archive:
+                    archive.add_files(path for path in package_files(geocode_folder) if not path.lower().endswith(FINALIZED_LATER))
+                with timer.phase("compact"):
+                    self.compact_package(geocode_folder)
+                if archive:
+                    archive.add_files(path for path in package_files(geocode_folder) if path.lower().endswith(".gpkg"))
+                # After compaction, which rewrites data.gpkg
+                self.record_fingerprints(geocode_folder, file_fingerprints)
+                with timer.phase("device_profile"):
+                    self.apply_device_profile(geocode_folder, offline_convertor.original_filename.stem)
+                if archive:
+                    archive.add_files(package_files(geocode_folder))
+                self.write_manifest(
+                    geocode_folder, selected_geocode, offline_convertor, sources, timer, archive.checksums if archive else None,
+                )
+                if archive:
+                    archive.add(MANIFEST_NAME)
+                    with timer.phase("archive"):
+                        print(format_archive(archive.archive_path, archive.close()))
+            except Exception:
+                if archive:
+                    archive.abort()
+                raise
             self.do_post_offline_convert_action(True)
         except Exception as err:
             self.do_post_offline_convert_action(False)
@@ -206,6 +299,44 @@ class PackageDialog(QDialog, DialogUi):
         self.accept()
         
 
+    def benchmark_offliners(self):
+        """Package the selected geocode with every offliner and compare them."""
+        selected_geocode = self.geocode_dropdown.currentText()
+        if not selected_geocode:
+            QMessageBox.warning(self, "Missing Geocode", "Please select a valid geocode before benchmarking.")
+            return
+
+        benchmark_folder = os.path.join(self.get_export_folder_from_dialog(), "benchmark", selected_geocode)
+
+        def make_converter(offliner, export_folder):
+            offliner.warning.connect(self.show_warning)
+            return self.create_converter(offliner, export_folder)
+
+        try:
+            QApplication.setOverrideCursor(Qt.WaitCursor)
+            results = benchmark_offliners(make_converter, benchmark_folder)
+        finally:
+            QApplication.restoreOverrideCursor()
+
+        report = format_results(results)
+        print(report)
+        fastest = fastest_offliner(results)
+        if fastest is None:
+            QMessageBox.information(self, "Offliner Benchmark", f"{report}\n\nPackages written to {benchmark_folder}")
+        else:
+            answer = QMessageBox.question(
+                self,
+                "Offliner Benchmark",
+                f"{report}\n\nPackages written to {benchmark_folder}\n\n"
+                f"Use the fastest offliner, {OFFLINER_LABELS[fastest]}, for exports?",
+            )
+            if answer == QMessageBox.Yes:
+                self.qfield_preferences.set_value("offliner", fastest)
+
+        # Each export reloads the project, the dialog's layers are gone
+        self.reload_plugin("auqcbms")
+        self.accept()
+
     # def reset_after_export(self):
     #     """Reset the dialog state to allow for a new export."""
     #     self.button_box.button(QDialogButtonBox.Save).setEnabled(True)  # Re-enable the save button
@@ -222,6 +353,112 @@ class PackageDialog(QDialog, DialogUi):
     #     self.populate_layers_dropdown()  # Ensure this method exists
     #     self.populate_geocode_dropdown()  # Ensure this method exists
 
+    def reuse_copied_files(self, geocode_folder, store, original_actions):
+        """Put the copied files into the package through the shared store.
+
+        Files of the previous export whose sources did not change are kept,
+        the others are linked from ``store``. The layers are then switched
+        to keep the existing file, so the converter does not copy them
+        again, and their original actions are added to ``original_actions``.
+        Returns the fingerprints of all the copied sources.
+        """
+        previous_files = read_fingerprints(geocode_folder).get("files", {})
+        file_fingerprints = {}
+        for layer in self.project.mapLayers().values():
+            layer_source = LayerSource(layer)
+            if layer_source.action not in (SyncAction.COPY, SyncAction.NO_ACTION) or not layer_source.is_file:
+                continue
+
+            source_files = set(QgsFileUtils.sidecarFilesForPath(layer_source.filename)) | {layer_source.filename}
+            source_fingerprint = fingerprint(file_state(source_files))
+            file_fingerprints[layer_source.filename] = source_fingerprint
+            destinations = {
+                path: os.path.join(geocode_folder, os.path.basename(path))
+                for path in source_files if os.path.isfile(path)
+            }
+
+            if previous_files.get(layer_source.filename) != source_fingerprint or not all(map(os.path.isfile, destinations.values())):
+                # Editable copies must not share their data with the other packages
+                editable = layer_source.action == SyncAction.COPY and not isinstance(layer, QgsRasterLayer)
+                for path, destination in destinations.items():
+                    store.place(path, destination, editable)
+
+            original_actions[layer.id()] = layer_source.action
+            layer_source.action = SyncAction.KEEP_EXISTENT
+            layer_source.apply()
+
+        print(f"Reusing the files of {len(original_actions)} layers")
+        return file_fingerprints
+
+    def restore_layer_actions(self, original_actions):
+        """Give back the layers switched by reuse_copied_files their action, in the reloaded project."""
+        project = QgsProject.instance()
+        was_dirty = project.isDirty()
+        for layer_id, action in original_actions.items():
+            layer = project.mapLayer(layer_id)
+            if layer is None:
+                continue
+            layer_source = LayerSource(layer)
+            layer_source.action = action
+            layer_source.apply()
+        project.setDirty(was_dirty)
+
+    def record_fingerprints(self, geocode_folder, file_fingerprints):
+        """Record what the package was made from, for the next export of the geocode."""
+        fingerprints = read_fingerprints(geocode_folder)
+        fingerprints["files"] = file_fingerprints
+        offline_db_filename = os.path.join(geocode_folder, "data.gpkg")
+        if isinstance(self.offliner, CbmsOffliner) and os.path.exists(offline_db_filename):
+            # Loading the exported project may have touched the database after the offliner recorded it
+            fingerprints["database"] = database_fingerprint(offline_db_filename)
+        else:
+            # Other offliners rewrite the database without recording its tables
+            fingerprints.pop("database", None)
+            fingerprints.pop("tables", None)
+        write_fingerprints(geocode_folder, fingerprints)
+
+    def write_manifest(self, geocode_folder, geocode, offline_convertor, sources, timer, checksums=None):
+        """Describe the package contents in its manifest.json, reusing the ``checksums`` of archived files."""
+        manifest = build_manifest(
+            geocode_folder,
+            geocode,
+            area_of_interest={
+                "wkt": offline_convertor.area_of_interest.asWkt(),
+                "crs": offline_convertor.area_of_interest_crs.authid(),
+            },
+            sources=sources,
+            timings=timer.timings,
+            versions={
+                "qgis": Qgis.QGIS_VERSION,
+                "plugin": pluginMetadata("auqcbms", "version"),
+                "offliner": type(self.offliner).__name__,
+            },
+            checksums=checksums,
+        )
+        print(f"Manifest written to {write_manifest(geocode_folder, manifest)}")
+
+    def compact_package(self, geocode_folder):
+        """Vacuum, tune and check the GeoPackages of the package."""
+        results = compact_package(geocode_folder)
+        print(format_compaction(results))
+        failed = [result.path for result in results if result.check != "ok"]
+        if failed:
+            QMessageBox.warning(self, "GeoPackage Check Failed", "PRAGMA quick_check reported problems in:\n" + "\n".join(failed))
+
+    def start_archive(self, geocode_folder):
+        """Open the zip next to the package folder, ready to be copied to devices, that the package is streamed into."""
+        return PackageArchive(geocode_folder, os.path.normpath(geocode_folder) + ".zip", progress=self.update_task)
+
+    def apply_device_profile(self, geocode_folder, project_stem):
+        """Write the preferred device's rendering limits into the exported project."""
+        profile = device_profile(self.qfield_preferences.value("deviceProfile"))
+        export_project_filename = os.path.join(geocode_folder, f"{project_stem}_qfield.qgs")
+        if not profile.layers or not os.path.exists(export_project_filename):
+            return
+
+        patched = apply_device_profile(export_project_filename, profile)
+        print(f"Applied the '{profile.name}' device profile to {len(patched)} layers: {', '.join(patched)}")
+
     def do_post_offline_convert_action(self, is_success):
         """
         Show an information label that the project has been copied
@@ -324,30 +561,28 @@ class PackageDialog(QDialog, DialogUi):
             # Debugging: Print the name of the selected layer
             print(f"Selected layer: {selected_layer.name()}")
 
-            if not selected_layer.name().endswith('_bgy'):
+            registry = layer_roles()
+            if registry.role(selected_layer) != 'bgy':
                 QMessageBox.warning(self, "Layer Error", "The selected layer must have the suffix '_bgy'.")
                 return
 
-            # Load predefined layer mapping based on known suffix patterns
+            # Load predefined layer mapping from the layer role registry
             self.layers = {
-                layer.name(): layer for layer in QgsProject.instance().mapLayers().values()
-                if layer.name().endswith(('_bgy', '_ea2024', '_bldg_point', '_block','_ea'))
+                layer.name(): layer
+                for role in FILTERED_ROLES
+                for layer in registry.layers(role)
             }
 
-            # New code to rename layers with suffix 'pppmmbbb' in groups containing 'Form 8'
+            # Rename the SF and GP layers of groups containing 'Form 8' to the selected 'pppmmbbb'
             root = QgsProject.instance().layerTreeRoot()
-            groups = [child for child in root.children() if isinstance(child, QgsLayerTreeGroup)]
-            for group in groups:
-                if 'Form 8' in group.name():
-                    for layer in group.findLayers():
-                        if layer.layer().name().endswith('_SF'):
-                            new_name = f"{selected_geocode[:8]}_SF"
-                            layer.layer().setName(new_name)
-                            print(f"Renamed layer '{layer.layer().name()}' to '{new_name}'")
-                        elif layer.layer().name().endswith('_GP'):
-                            new_name = f"{selected_geocode[:8]}_GP"
-                            layer.layer().setName(new_name)
-                            print(f"Renamed layer '{layer.layer().name()}' to '{new_name}'")
+            for role in ('SF', 'GP'):
+                for layer in registry.layers(role):
+                    node = root.findLayer(layer.id())
+                    group = node.parent() if node else None
+                    if isinstance(group, QgsLayerTreeGroup) and 'Form 8' in group.name():
+                        new_name = f"{selected_geocode[:8]}_{role}"
+                        layer.setName(new_name)
+                        print(f"Renamed layer '{layer.name()}' to '{new_name}'")
 
             # Call the instance method to filter layers
             self.filter_layers(self.layers, selected_geocode)
@@ -367,10 +602,11 @@ class PackageDialog(QDialog, DialogUi):
         self.infoGroupBox.setVisible(False)
 
         # Reset filters on specific layers
+        registry = layer_roles()
         for layer_key, layer in self.layers.items():
             if layer and layer.isValid():  # Check if the layer is valid
-                # Check if the layer name ends with the specified suffixes
-                if layer.name().endswith(('_bgy', '_bldg_point', '_ea2024','_block','_ea')):
+                # Check if the layer is one of the filtered roles
+                if registry.role(layer) in FILTERED_ROLES:
                     layer.setSubsetString("")  # Clear the subset string to reset the filter
 
         # Optionally, repopulate the dropdowns if needed
@@ -380,18 +616,16 @@ class PackageDialog(QDialog, DialogUi):
 
     def filter_layers(self, layers, selected_geocode):
         first_8_digits = selected_geocode[:8]
+        registry = layer_roles()
 
         # Loop through each layer in the dictionary and apply relevant filters
         for layer_key, layer in layers.items():
             if layer is not None and layer.isValid():
-                # Apply filters based on suffixes
-                if layer.name().endswith('_bgy'):
+                # Apply filters based on roles
+                role = registry.role(layer)
+                if role == 'bgy':
                     layer.setSubsetString(f"geocode = '{selected_geocode}'")
-                elif layer.name().endswith(('_ea2024', '_ea')):
-                    layer.setSubsetString(f"geocode LIKE '{first_8_digits}%'")
-                elif layer.name().endswith('_bldg_point'):
-                    layer.setSubsetString(f"geocode LIKE '{first_8_digits}%'")
-                elif layer.name().endswith('_block'):
+                elif role in ('ea2024', 'ea', 'bldg_point', 'block'):
                     layer.setSubsetString(f"geocode LIKE '{first_8_digits}%'")
                 else:
                     QMessageBox.warning(None, "Unsupported Layer", f"Layer '{layer.name()}' does not match any known suffixes.")
@@ -433,7 +667,7 @@ class PackageDialog(QDialog, DialogUi):
         selected_layer = self.layer_dropdown.currentData()
         self.geocode_dropdown.clear()
 
-        if selected_layer and selected_layer.name().endswith('_bgy'):
+        if selected_layer and layer_roles().role(selected_layer) == 'bgy':
             # Populate geocode dropdown with all unique geocodes from the layer
             geocode_index = selected_layer.fields().indexOf('geocode')
             if geocode_index != -1:
@@ -445,17 +679,12 @@ class PackageDialog(QDialog, DialogUi):
 
 
     def select_by_location(self):
-        # Get the layer named with the suffix '_road', '_block', '_river'
-        input_layers = [
-            layer for layer in QgsProject.instance().mapLayers().values()
-            if layer.name().endswith(('_road', '_block', '_river'))
-        ]
+        # Get the layers with the suffix '_road', '_block', '_river'
+        registry = layer_roles()
+        input_layers = [layer for role in ('road', 'block', 'river') for layer in registry.layers(role)]
         
         # Get all layers that end with '_bgy'
-        overlay_layers = [
-            layer for layer in QgsProject.instance().mapLayers().values()
-            if layer.name().endswith('_bgy')
-        ]
+        overlay_layers = registry.layers('bgy')
         
         # Check if input_layers and overlay_layers are found
         if not input_layers:
@@ -1,27 +1,36 @@
 import os
-import json
 from qgis.PyQt.QtWidgets import (
     QDialog, QVBoxLayout, QComboBox, QPushButton,
     QProgressBar, QLabel, QMessageBox,QLineEdit
 )
 from qgis.PyQt.QtCore import Qt
 from qgis.PyQt import uic
-from qgis.core import QgsProject, QgsProcessingFeedback, QgsLayerTreeGroup, QgsLayerTreeLayer, QgsSpatialIndex, QgsFeatureRequest, QgsVectorLayer
+from qgis.core import Qgis, QgsProject, QgsLayerTreeGroup, QgsLayerTreeLayer, QgsSpatialIndex, QgsFeatureRequest, QgsVectorLayer
 from qgis.gui import QgsFileWidget
+from qgis.utils import iface, pluginMetadata
 import processing
 import shutil
+from ..core.gpkg_compaction import compact_package, format_compaction
+from ..core.gpkg_export import export_layers, format_exports
+from ..core.layer_roles import layer_roles
+from ..core.package_manifest import PhaseTimer, build_manifest, write_manifest
+from ..core.project_restyle import LAYER_KEYWORDS
+from ..core.project_template import ProjectTemplate
+from ..core.qml_config import qml_config
+from ..core.style_cache import apply_cached_style, frozen_canvas, is_style_applied, preload_styles
+from ..utils.qgis_utils import layer_source_paths
 
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 
-# Function to load the JSON file containing QML paths from the built-in qml folder
-def load_json_file():
-    json_file_path = os.path.join(os.path.dirname(__file__), '../qml', 'qml_config.json')
-    with open(json_file_path, 'r') as f:
-        return json.load(f)
-
 # Function to load and apply QML styles to layers
 def apply_style(layer, qml_path):
-    success = layer.loadNamedStyle(qml_path)
+    # Skip the restyle and repaint when the layer already carries this exact style
+    if is_style_applied(layer, qml_path):
+        print(f"Style from {qml_path} already applied to layer: {layer.name()}")
+        return
+
+    # Parsed QML documents are cached process-wide, keyed by path and mtime
+    success = apply_cached_style(layer, qml_path)
     if success:
         print(f"Applied style from {qml_path} to layer: {layer.name()}")
     else:
@@ -44,21 +53,11 @@ def export_selected_features(layers, layer_group_name, output_gpkg):
         print("No layers found for the selected group.")
         return
 
-    alg_params = {
-        'LAYERS': selected_layers,
-        'EXPORT_RELATED_LAYERS': False,
-        'OVERWRITE': True,
-        'SAVE_METADATA': True,
-        'SAVE_STYLES': True,
-        'SELECTED_FEATURES_ONLY': True,
-        'OUTPUT': output_gpkg
-    }
-
     try:
-        feedback = QgsProcessingFeedback()
-        results = processing.run("native:package", alg_params, feedback)
-        if results:
-            print(f"Export completed: {results['OUTPUT']}")
+        exports = export_layers(selected_layers, output_gpkg)
+        print(f"Export completed: {output_gpkg}")
+        print(format_exports(exports))
+        return exports
     except Exception as e:
         print(f"Error: {str(e)}")
 
@@ -159,6 +158,8 @@ class AuQCBMSDialog(QDialog):
         # Initialize variables
         self.export_folder_path = ""
         self.layers = {}
+        # Built on the first export, per-geocode projects are written from it
+        self.project_template = None
 
         # Load JSON and layers
         self.load_json_and_layers()
@@ -185,11 +186,12 @@ class AuQCBMSDialog(QDialog):
             print(f"Layer group {selected_group_name} not found.")
             return
 
+        registry = layer_roles()
         bgy_layer = None
         for layer_item in layer_group.children():
             if isinstance(layer_item, QgsLayerTreeLayer):
                 layer = layer_item.layer()
-                if layer and layer.name().endswith('_bgy'):
+                if registry.role(layer) == 'bgy':
                     bgy_layer = layer
                     break
 
@@ -207,15 +209,8 @@ class AuQCBMSDialog(QDialog):
             print("No valid geocodes found in the '_bgy' layer.")
 
     def load_json_and_layers(self):
-        qml_data = load_json_file()
-
-        layer_keywords = ['ea2024', 'bgy', 'bldg_point', 'block', 'landmark', 'road', 'river']
-        self.layers = {key: None for key in layer_keywords}
-
-        for layer in QgsProject.instance().mapLayers().values():
-            for keyword in layer_keywords:
-                if keyword in layer.name():
-                    self.layers[keyword] = layer
+        registry = layer_roles()
+        self.layers = {key: registry.layer(key, exact=False) for key in LAYER_KEYWORDS}
 
         self.layer_group_dropdown.clear()
         layer_groups = [layer.name() for layer in QgsProject.instance().layerTreeRoot().children() if isinstance(layer, QgsLayerTreeGroup)]
@@ -240,26 +235,33 @@ class AuQCBMSDialog(QDialog):
 
     def run(self):
 
-        qml_data = load_json_file()
-        if not qml_data:
+        config = qml_config()
+        if not config.data:
             print("Error: QML data is empty. Check the JSON file.")
             return
 
         # Layer order as specified in the JSON file
-        layer_order = qml_data.get('layer_order', [])
-        for index, layer_name in enumerate(layer_order):
+        styles = []
+        for layer_name in config.layer_order():
             layer = self.layers.get(layer_name)
             if layer is not None:
-                qml_file = qml_data.get('qml_files', {}).get(layer_name)
-                if qml_file:
-                    qml_path = os.path.join(BASE_DIR, 'qml', qml_file)
-                    apply_style(layer, qml_path)
-                    self.progress_bar.setValue((index + 1) * (100 // len(layer_order)))
+                qml_path = config.qml_path(layer_name)
+                if qml_path:
+                    styles.append((layer, qml_path))
                 else:
-                    print(f"Warning: No QML file defined for layer '{layer_name}' in JSON configuration.")
+                    print(f"Warning: No QML file available for layer '{layer_name}'.")
             else:
                 print(f"Warning: No matching layer found for '{layer_name}'.")
 
+        # Parse all required QML files concurrently, then apply them in one batch
+        for qml_path in preload_styles(qml_path for _layer, qml_path in styles):
+            print(f"Error: Invalid or unreadable QML file at {qml_path}")
+
+        with frozen_canvas(iface.mapCanvas() if iface else None):
+            for index, (layer, qml_path) in enumerate(styles):
+                apply_style(layer, qml_path)
+                self.progress_bar.setValue((index + 1) * (100 // len(styles)))
+
         selected_geocode = self.geocode_dropdown.currentText()
         self.filter_layers(selected_geocode)
         self.progress_bar.setValue(100)
@@ -290,47 +292,67 @@ class AuQCBMSDialog(QDialog):
             if overwrite == QMessageBox.No:
                 return  # Exit if the user chooses not to overwrite
 
+        timer = PhaseTimer()
+
         # Perform select by location for river, block, and road layers
-        self.select_by_location()
+        with timer.phase("select_by_location"):
+            self.select_by_location()
 
         # Proceed with exporting selected features
         layer_group_name = self.layer_group_dropdown.currentText()
-        export_selected_features(self.layers, layer_group_name, output_gpkg)
+        with timer.phase("export"):
+            exports = export_selected_features(self.layers, layer_group_name, output_gpkg)
+        if not exports:
+            QMessageBox.warning(self, "Export Failed", f"No features were exported to {output_gpkg}.")
+            return
 
-        # Update the data source of each layer to the exported GeoPackage
-        for layer_name, layer in self.layers.items():
-            if layer is not None:
-                # Construct the new data source path
-                new_data_source = f"{output_gpkg}|layername={layer.name()}"
-                # Change the layer's data source
-                layer.setDataSource(new_data_source, layer.name(), "ogr")
-                print(f"Updated data source for {layer.name()} to {new_data_source}")
+        # Point the exported layers at their tables in the project copy, the live project is left as it is
+        exported_names = {export.layer_name for export in exports}
+        tables = {
+            layer.id(): layer.name()
+            for layer in self.layers.values()
+            if layer is not None and layer.name() in exported_names
+        }
 
-        # Save the current QGIS project
-        project_path = os.path.join(geocode_folder, f"{selected_geocode}.qgz")
+        project = QgsProject.instance()
+        if self.project_template is None or not self.project_template.is_current(project):
+            self.project_template = ProjectTemplate.build(project)
 
-        # To avoid opening the project, just save it silently
-        success = QgsProject.instance().write(project_path)
-        if success:
-            print(f"Project saved successfully at {project_path}")
-            QMessageBox.information(self, "Export Successful", f"Features exported successfully to {output_gpkg} and project saved at {project_path}.")
-        else:
-            print(f"Failed to save the project at {project_path}")
+        # Save the project of the selected geocode
+        project_path = os.path.join(geocode_folder, f"{selected_geocode}.qgz")
+        try:
+            with timer.phase("project"):
+                self.project_template.write_qgz(project_path, output_gpkg, tables)
+        except OSError as e:
+            print(f"Failed to save the project at {project_path}: {e}")
             QMessageBox.warning(self, "Export Failed", f"Failed to save the project at {project_path}.")
+            return
+
+        print(f"Project saved successfully at {project_path}")
+
+        with timer.phase("compact"):
+            print(format_compaction(compact_package(geocode_folder)))
+
+        # Describe the package contents in its manifest.json
+        manifest = build_manifest(
+            geocode_folder,
+            selected_geocode,
+            layer_counts={export.layer_name: export.features for export in exports},
+            sources=layer_source_paths(self.layers.values()),
+            timings=timer.timings,
+            versions={"qgis": Qgis.QGIS_VERSION, "plugin": pluginMetadata("auqcbms", "version")},
+        )
+        print(f"Manifest written to {write_manifest(geocode_folder, manifest)}")
+        QMessageBox.information(self, "Export Successful", f"Features exported successfully to {output_gpkg} and project saved at {project_path}.")
 
 
     def select_by_location(self):
-        # Get the layer named with the suffix '_road', '_block', '_river'
-        input_layers = [
-            layer for layer in QgsProject.instance().mapLayers().values()
-            if layer.name().endswith(('_road', '_block', '_river'))
-        ]
+        # Get the layers with the suffix '_road', '_block', '_river'
+        registry = layer_roles()
+        input_layers = [layer for role in ('road', 'block', 'river') for layer in registry.layers(role)]
         
         # Get all layers that end with '_bgy'
-        overlay_layers = [
-            layer for layer in QgsProject.instance().mapLayers().values()
-            if layer.name().endswith('_bgy')
-        ]
+        overlay_layers = registry.layers('bgy')
         
         # Check if input_layers and overlay_layers are found
         if not input_layers:
@@ -1,28 +1,24 @@
 import os
-import json
-from qgis.PyQt.QtWidgets import QDialog, QVBoxLayout, QPushButton, QProgressBar
-from qgis.core import QgsProject
+from qgis.PyQt.QtWidgets import QDialog, QFileDialog, QVBoxLayout, QPushButton, QProgressBar
+from qgis.utils import iface
+from ..core.layer_roles import layer_roles
+from ..core.project_restyle import LAYER_KEYWORDS
+from ..core.qml_config import qml_config
+from ..core.render_profiler import format_report, profile_canvas, write_report
+from ..core.style_cache import apply_cached_style, frozen_canvas, is_style_applied, preload_styles
 
 # Define the base directory as the root of the plugin
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 
-# Function to load the JSON file containing QML paths from the qml folder
-def load_json_file():
-    json_file_path = os.path.join(BASE_DIR, 'qml', 'qml_config.json')
-    if not os.path.exists(json_file_path):
-        print(f"Error: JSON file not found at {json_file_path}")
-        return {}
-    
-    with open(json_file_path, 'r') as f:
-        return json.load(f)
-
 # Function to load and apply QML styles to layers
 def apply_style(layer, qml_path):
-    if not os.path.exists(qml_path):
-        print(f"Error: QML file not found at {qml_path}")
+    # Skip the restyle and repaint when the layer already carries this exact style
+    if is_style_applied(layer, qml_path):
+        print(f"Style from {qml_path} already applied to layer: {layer.name()}")
         return
-    
-    success = layer.loadNamedStyle(qml_path)
+
+    # Parsed QML documents are cached process-wide, keyed by path and mtime
+    success = apply_cached_style(layer, qml_path)
     if success:
         print(f"Applied style from {qml_path} to layer: {layer.name()}")
     else:
@@ -47,6 +43,11 @@ class ValidatorDialog(QDialog):
         self.run_button.clicked.connect(self.run)
         self.layout.addWidget(self.run_button)
 
+        # Button to time the styled layers at several scales
+        self.profile_button = QPushButton("Profile Rendering")
+        self.profile_button.clicked.connect(self.profile_rendering)
+        self.layout.addWidget(self.profile_button)
+
         # Initialize variables
         self.layers = {}
 
@@ -54,37 +55,53 @@ class ValidatorDialog(QDialog):
         self.load_json_and_layers()
 
     def load_json_and_layers(self):
-        # Define layer keywords
-        layer_keywords = ['ea2024', 'bgy', 'bldg_point', 'block', 'landmark', 'road', 'river']
-        self.layers = {key: None for key in layer_keywords}
-
-        # Iterate through layers in the QGIS project and assign them based on their name
-        for layer in QgsProject.instance().mapLayers().values():
-            for keyword in layer_keywords:
-                if keyword in layer.name():
-                    self.layers[keyword] = layer
+        # Layer keywords, shared with the batch project restyler, matched anywhere in the layer name
+        registry = layer_roles()
+        self.layers = {key: registry.layer(key, exact=False) for key in LAYER_KEYWORDS}
 
     def run(self):
         # Load the QML style configuration
-        qml_data = load_json_file()
-        if not qml_data:
+        # Cached and validated, missing QML files are reported once when it is (re)loaded
+        config = qml_config()
+        if not config.data:
             print("Error: QML data is empty. Check the JSON file.")
             return
 
         # Layer order as specified in the JSON file
-        layer_order = qml_data.get('layer_order', [])
-        for index, layer_name in enumerate(layer_order):
+        styles = []
+        for layer_name in config.layer_order():
             layer = self.layers.get(layer_name)
             if layer is not None:
-                qml_file = qml_data.get('qml_files', {}).get(layer_name)
-                if qml_file:
-                    qml_path = os.path.join(BASE_DIR, 'qml', qml_file)
-                    apply_style(layer, qml_path)
-                    self.progress_bar.setValue((index + 1) * (100 // len(layer_order)))
+                qml_path = config.qml_path(layer_name)
+                if qml_path:
+                    styles.append((layer, qml_path))
                 else:
-                    print(f"Warning: No QML file defined for layer '{layer_name}' in JSON configuration.")
+                    print(f"Warning: No QML file available for layer '{layer_name}'.")
             else:
                 print(f"Warning: No matching layer found for '{layer_name}'.")
 
+        # Parse all required QML files concurrently, then apply them in one batch
+        for qml_path in preload_styles(qml_path for _layer, qml_path in styles):
+            print(f"Error: Invalid or unreadable QML file at {qml_path}")
+
+        with frozen_canvas(iface.mapCanvas() if iface else None):
+            for index, (layer, qml_path) in enumerate(styles):
+                apply_style(layer, qml_path)
+                self.progress_bar.setValue((index + 1) * (100 // len(styles)))
+
         self.progress_bar.setValue(100)
         print("Finished applying QML styles to layers.")
+
+    def profile_rendering(self):
+        if not iface:
+            return
+
+        report_path, _ = QFileDialog.getSaveFileName(self, "Save Render Profile", "render_profile.csv", "CSV files (*.csv)")
+        if not report_path:
+            return
+
+        # Renders the current extent of the canvas layers at each profiling scale
+        profiles = profile_canvas(iface.mapCanvas())
+        write_report(profiles, report_path)
+        print(format_report(profiles))
+        print(f"Render profile saved to {report_path}")
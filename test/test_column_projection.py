@@ -0,0 +1,75 @@
+# coding=utf-8
+"""Column projection test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'test@gmail.com'
+__date__ = '2024-10-09'
+__copyright__ = 'Copyright 2024, PSA'
+
+import unittest
+import xml.etree.ElementTree as ET
+
+from core.column_projection import expression_fields, referenced_fields
+
+FIELDS = ["BSN", "HOUSE_NO", "GEOCODE", "REG_NAME", "STATUS", "WORK_COL", "Full Name"]
+
+STYLE = """<qgis>
+  <renderer-v2 attr="STATUS" type="categorizedSymbol" />
+  <labeling type="simple"><settings><text-style fieldName="Full Name" isExpression="0" /></settings></labeling>
+  <fieldConfiguration>
+    <field name="BSN"><editWidget type="TextEdit"><config><Option /></config></editWidget></field>
+    <field name="WORK_COL"><editWidget type="TextEdit"><config><Option /></config></editWidget></field>
+  </fieldConfiguration>
+  <aliases><alias field="WORK_COL" name="Working column" /></aliases>
+  <defaults><default field="REG_NAME" expression="left(&quot;GEOCODE&quot;, 2)" /><default field="WORK_COL" expression="" /></defaults>
+  <constraintExpressions><constraint field="HOUSE_NO" exp="&quot;BSN&quot; = '60000' or &quot;HOUSE_NO&quot; is not null" /></constraintExpressions>
+  <editorlayout>tablayout</editorlayout>
+  <attributeEditorForm>
+    <attributeEditorContainer name="ADDRESS" visibilityExpression="&quot;BSN&quot; &gt; '00000'">
+      <attributeEditorField name="HOUSE_NO" index="1" />
+    </attributeEditorContainer>
+  </attributeEditorForm>
+</qgis>"""
+
+
+class ColumnProjectionTest(unittest.TestCase):
+    """Test finding the fields a layer style uses."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.style = ET.fromstring(STYLE)
+
+    def test_referenced_fields(self):
+        """Fields of the form, defaults, constraints and rendering are kept, working columns are not."""
+        self.assertEqual(
+            referenced_fields(self.style, FIELDS),
+            {"BSN", "HOUSE_NO", "GEOCODE", "REG_NAME", "STATUS", "Full Name"},
+        )
+
+    def test_all_fields(self):
+        """Generated forms and attributes() keep every field."""
+        self.style.find("editorlayout").text = "generatedlayout"
+        self.assertIsNone(referenced_fields(self.style, FIELDS))
+
+        self.style.find("editorlayout").text = "tablayout"
+        self.style.find("renderer-v2").set("attr", "map_get(attributes(), 'STATUS')")
+        self.assertIsNone(referenced_fields(self.style, FIELDS))
+
+    def test_expression_fields(self):
+        """Quoted names, string literals and bare names are matched case-insensitively."""
+        self.assertEqual(
+            expression_fields("current_value('bsn') || \"Full Name\" || geocode", FIELDS),
+            {"BSN", "Full Name", "GEOCODE"},
+        )
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(ColumnProjectionTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
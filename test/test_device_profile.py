@@ -0,0 +1,77 @@
+# coding=utf-8
+"""Device profile test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'test@gmail.com'
+__date__ = '2024-10-09'
+__copyright__ = 'Copyright 2024, PSA'
+
+import unittest
+import xml.etree.ElementTree as ET
+
+from core.device_profile import DEVICE_PROFILES, apply_profile_xml
+
+PROJECT = """<qgis><projectlayers>
+<maplayer type="vector" geometry="Point" hasScaleBasedVisibilityFlag="0" minScale="100000000" maxScale="100000" autoRefreshEnabled="1">
+<layername>0123_bldg_point</layername>
+<labeling type="simple"><settings><rendering scaleVisibility="0" scaleMin="20" scaleMax="700" limitNumLabels="0" maxNumLabels="2000" obstacle="1"/></settings></labeling>
+</maplayer>
+<maplayer type="vector" geometry="Line" hasScaleBasedVisibilityFlag="1" minScale="10000" maxScale="0" simplifyDrawingHints="0">
+<layername>0123_road</layername>
+</maplayer>
+<maplayer type="vector" geometry="Polygon"><layername>0123_unrelated</layername></maplayer>
+</projectlayers></qgis>"""
+
+
+class DeviceProfileTest(unittest.TestCase):
+    """Test applying device profiles to project XML."""
+
+    def setUp(self):
+        """Runs before each test."""
+        xml_bytes, self.patched = apply_profile_xml(PROJECT.encode(), DEVICE_PROFILES["low_end"])
+        self.layers = {
+            maplayer.findtext("layername"): maplayer
+            for maplayer in ET.fromstring(xml_bytes.split(b"\n", 1)[1]).iter("maplayer")
+        }
+
+    def test_patched_layers(self):
+        """Only layers with a configured role are patched."""
+        self.assertEqual(self.patched, ["0123_bldg_point", "0123_road"])
+        self.assertNotIn("simplifyDrawingHints", self.layers["0123_unrelated"].attrib)
+
+    def test_scale_ranges(self):
+        """Scale visibility is enabled or tightened, never loosened."""
+        point = self.layers["0123_bldg_point"]
+        self.assertEqual((point.get("hasScaleBasedVisibilityFlag"), point.get("minScale"), point.get("maxScale")), ("1", "5000", "0"))
+        self.assertEqual(self.layers["0123_road"].get("minScale"), "10000")
+
+    def test_labels(self):
+        """Labels get scale and count limits."""
+        rendering = self.layers["0123_bldg_point"].find("labeling/settings/rendering")
+        self.assertEqual(rendering.get("scaleVisibility"), "1")
+        self.assertEqual(rendering.get("scaleMax"), "1500")
+        self.assertEqual((rendering.get("limitNumLabels"), rendering.get("maxNumLabels")), ("1", "300"))
+        self.assertEqual(rendering.get("obstacle"), "0")
+
+    def test_simplification_and_refresh(self):
+        """Lines are simplified, points are not, and auto refresh is turned off."""
+        self.assertEqual(self.layers["0123_road"].get("simplifyDrawingHints"), "1")
+        self.assertEqual(self.layers["0123_road"].get("simplifyDrawingTol"), "2")
+        self.assertNotEqual(self.layers["0123_bldg_point"].get("simplifyDrawingHints"), "1")
+        self.assertEqual(self.layers["0123_bldg_point"].get("autoRefreshEnabled"), "0")
+
+    def test_full_profile(self):
+        """The full profile leaves projects untouched."""
+        self.assertEqual(apply_profile_xml(PROJECT.encode(), DEVICE_PROFILES["full"]), (None, []))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(DeviceProfileTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,81 @@
+# coding=utf-8
+"""GeoPackage compaction test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'test@gmail.com'
+__date__ = '2024-10-09'
+__copyright__ = 'Copyright 2024, PSA'
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from core.gpkg_compaction import PAGE_SIZE, compact_package, remove_database
+
+
+class GpkgCompactionTest(unittest.TestCase):
+    """Test compacting the GeoPackages of a package."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.folder = tempfile.mkdtemp()
+        self.gpkg_path = os.path.join(self.folder, "data.gpkg")
+        connection = sqlite3.connect(self.gpkg_path)
+        connection.execute("CREATE TABLE gpkg_geometry_columns (table_name TEXT, column_name TEXT)")
+        connection.execute("CREATE TABLE bldg (fid INTEGER PRIMARY KEY, geom BLOB)")
+        connection.execute("INSERT INTO gpkg_geometry_columns VALUES ('bldg', 'geom')")
+        connection.execute("CREATE VIRTUAL TABLE rtree_bldg_geom USING rtree(id, minx, maxx, miny, maxy)")
+        connection.execute("CREATE VIRTUAL TABLE rtree_dropped_geom USING rtree(id, minx, maxx, miny, maxy)")
+        connection.execute("CREATE TABLE dropped (data BLOB)")
+        connection.executemany("INSERT INTO dropped VALUES (?)", [(os.urandom(1000),) for _ in range(500)])
+        connection.commit()
+        connection.execute("DROP TABLE dropped")
+        connection.commit()
+        connection.close()
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.folder)
+
+    def test_compaction(self):
+        """Free pages and orphan R-trees are removed, the page size is tuned."""
+        (result,) = compact_package(self.folder)
+        self.assertEqual(result.check, "ok")
+        self.assertTrue(result.vacuumed)
+        self.assertGreater(result.bytes_saved, 0)
+
+        connection = sqlite3.connect(self.gpkg_path)
+        tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        self.assertEqual(connection.execute("PRAGMA page_size").fetchone()[0], PAGE_SIZE)
+        connection.close()
+        self.assertIn("rtree_bldg_geom", tables)
+        self.assertNotIn("rtree_dropped_geom", tables)
+        self.assertIn("sqlite_stat1", tables)
+
+        (result,) = compact_package(self.folder)
+        self.assertFalse(result.vacuumed)
+
+    def test_shared_files_skipped(self):
+        """GeoPackages hard-linked from the shared store are left alone."""
+        os.link(self.gpkg_path, os.path.join(self.folder, "shared.gpkg"))
+        self.assertEqual(compact_package(self.folder), [])
+
+    def test_remove_database(self):
+        """A database is removed with its sidecar files."""
+        open(self.gpkg_path + "-wal", "wb").close()
+        remove_database(self.gpkg_path)
+        self.assertEqual(os.listdir(self.folder), [])
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(GpkgCompactionTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,70 @@
+# coding=utf-8
+"""Layout template test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'test@gmail.com'
+__date__ = '2024-10-09'
+__copyright__ = 'Copyright 2024, PSA'
+
+import unittest
+
+from core.layout_template import PREFIX_TOKEN, instantiate_template, tokenize_template
+
+LAYER_DEFINITION = """<qlr>
+  <maplayers>
+    <maplayer>
+      <id>04012_bldg_point_3f2a</id>
+      <datasource>C:/exports/04012/04012_maplayers.gpkg|layername=04012_bldg_point</datasource>
+      <layername>04012_bldg_point</layername>
+      <extent><xmin>104012.5</xmin></extent>
+      <fieldConfiguration>
+        <field name="bldg_type">
+          <editWidget type="ValueRelation">
+            <config>
+              <Option type="Map">
+                <Option value="04012_bldg_types_9c1d" name="Layer" type="QString"/>
+                <Option value="04012_bldg_types" name="LayerName" type="QString"/>
+                <Option value="&quot;geocode&quot; LIKE '04012%'" name="FilterExpression" type="QString"/>
+                <Option value="04012" name="Key" type="QString"/>
+              </Option>
+            </config>
+          </editWidget>
+        </field>
+      </fieldConfiguration>
+    </maplayer>
+  </maplayers>
+</qlr>"""
+
+
+class LayoutTemplateTest(unittest.TestCase):
+    """Test tokenizing and instantiating layer definition templates."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.template = tokenize_template(LAYER_DEFINITION, "C:/exports/04012", "C:/output", "04012")
+
+    def test_value_relation_options(self):
+        """Layer references in widget options follow the geocode prefix."""
+        self.assertIn(f'value="{PREFIX_TOKEN}_bldg_types_9c1d"', self.template)
+        self.assertIn(f'value="{PREFIX_TOKEN}_bldg_types"', self.template)
+        self.assertIn(f"LIKE '{PREFIX_TOKEN}%'", self.template)
+        # Options that do not refer to layers are left alone
+        self.assertIn('value="04012" name="Key"', self.template)
+        self.assertIn("<xmin>104012.5</xmin>", self.template)
+
+        xml_text = instantiate_template(self.template, "C:/exports/05021", "C:/output", "05021")
+        self.assertIn('value="05021_bldg_types_9c1d"', xml_text)
+        self.assertIn('value="05021_bldg_types"', xml_text)
+        self.assertIn("<id>05021_bldg_point_3f2a</id>", xml_text)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(LayoutTemplateTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
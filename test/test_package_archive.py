@@ -0,0 +1,107 @@
+# coding=utf-8
+"""Package archive test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'test@gmail.com'
+__date__ = '2024-10-09'
+__copyright__ = 'Copyright 2024, PSA'
+
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+from core import package_archive
+from core.package_archive import PackageArchive, write_archive
+
+
+class PackageArchiveTest(unittest.TestCase):
+    """Test writing packages into zip archives."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.folder = tempfile.mkdtemp()
+        self.package = os.path.join(self.folder, "012345678")
+        os.makedirs(os.path.join(self.package, "DCIM"))
+        self.contents = {
+            "project_qfield.qgs": b"<qgis>" + b"<maplayer/>" * 10000 + b"</qgis>",
+            "DCIM/photo.jpg": b"jpeg" * 1000,
+            "basemap.tif": os.urandom(200000),
+            "manifest.json": b'{"version": 1}',
+        }
+        for relative_path, data in dict(self.contents, **{"fingerprints.json": b"{}"}).items():
+            with open(os.path.join(self.package, relative_path), "wb") as f:
+                f.write(data)
+        self.archive_path = os.path.join(self.folder, "012345678.zip")
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.folder)
+
+    def check_archive(self):
+        with zipfile.ZipFile(self.archive_path) as archive:
+            self.assertIsNone(archive.testzip())
+            for relative_path, data in self.contents.items():
+                self.assertEqual(archive.read(f"012345678/{relative_path}"), data)
+            self.assertNotIn("012345678/fingerprints.json", archive.namelist())
+            return {info.filename: info.compress_type for info in archive.infolist()}
+
+    def test_archive(self):
+        """Compressible files are deflated, the others stored, checksums match the contents."""
+        entries = write_archive(self.package, self.archive_path, workers=2)
+        compress_types = self.check_archive()
+
+        self.assertEqual(compress_types["012345678/project_qfield.qgs"], zipfile.ZIP_DEFLATED)
+        self.assertEqual(compress_types["012345678/DCIM/photo.jpg"], zipfile.ZIP_STORED)
+        self.assertEqual(compress_types["012345678/basemap.tif"], zipfile.ZIP_STORED)
+        for entry in entries:
+            self.assertEqual(entry.sha256, hashlib.sha256(self.contents[entry.path.split("/", 1)[1]]).hexdigest())
+
+    def test_streamed_files(self):
+        """Files added while the package is finalized end up in the archive with their checksums."""
+        archive = PackageArchive(self.package, self.archive_path, workers=1)
+        archive.add("basemap.tif")
+        archive.add_files(["project_qfield.qgs", "DCIM/photo.jpg", "basemap.tif"])
+        archive.add("manifest.json")
+        entries = archive.close()
+
+        self.assertEqual([entry.path for entry in entries], [
+            "012345678/basemap.tif", "012345678/project_qfield.qgs", "012345678/DCIM/photo.jpg", "012345678/manifest.json",
+        ])
+        for relative_path, data in self.contents.items():
+            self.assertEqual(archive.checksums[relative_path], hashlib.sha256(data).hexdigest())
+        self.check_archive()
+
+    def test_tile_geopackage_stored(self):
+        """GeoPackages holding only tiles are stored without deflating them."""
+        tiles_path = os.path.join(self.package, "basemap.gpkg")
+        connection = sqlite3.connect(tiles_path)
+        connection.execute("CREATE TABLE gpkg_contents (table_name TEXT, data_type TEXT)")
+        connection.execute("INSERT INTO gpkg_contents VALUES ('basemap', 'tiles')")
+        connection.commit()
+        connection.close()
+
+        write_archive(self.package, self.archive_path, workers=1)
+        self.assertEqual(self.check_archive()["012345678/basemap.gpkg"], zipfile.ZIP_STORED)
+
+    def test_zip64(self):
+        """ZIP64 records are readable."""
+        with mock.patch.object(package_archive, "ZIP64_LIMIT", 1000):
+            write_archive(self.package, self.archive_path)
+        self.check_archive()
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(PackageArchiveTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
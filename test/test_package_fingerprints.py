@@ -0,0 +1,75 @@
+# coding=utf-8
+"""Package fingerprints test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'test@gmail.com'
+__date__ = '2024-10-09'
+__copyright__ = 'Copyright 2024, PSA'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from core.package_fingerprints import (
+    FINGERPRINTS_NAME,
+    changed_keys,
+    database_fingerprint,
+    read_fingerprints,
+    write_fingerprints,
+)
+
+
+class PackageFingerprintsTest(unittest.TestCase):
+    """Test recording and comparing package fingerprints."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.folder = tempfile.mkdtemp()
+        self.source = os.path.join(self.folder, "source.gpkg")
+        with open(self.source, "wb") as f:
+            f.write(b"data")
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.folder)
+
+    def test_database_fingerprint(self):
+        """The fingerprint changes with the file and its WAL."""
+        first = database_fingerprint(self.source)
+        self.assertEqual(first, database_fingerprint(self.source))
+
+        with open(self.source + "-wal", "wb") as f:
+            f.write(b"wal")
+        second = database_fingerprint(self.source)
+        self.assertNotEqual(first, second)
+
+        with open(self.source, "ab") as f:
+            f.write(b"more")
+        self.assertNotEqual(second, database_fingerprint(self.source))
+
+    def test_read_write(self):
+        """Recorded fingerprints are read back, invalid records are ignored."""
+        self.assertEqual(read_fingerprints(self.folder), {})
+        write_fingerprints(self.folder, {"tables": {"a": "1"}})
+        self.assertEqual(read_fingerprints(self.folder)["tables"], {"a": "1"})
+
+        with open(os.path.join(self.folder, FINGERPRINTS_NAME), "w") as f:
+            f.write("{")
+        self.assertEqual(read_fingerprints(self.folder), {})
+
+    def test_changed_keys(self):
+        """New and changed keys are reported."""
+        self.assertEqual(changed_keys({"a": "1", "b": "2", "c": "3"}, {"a": "1", "b": "x", "d": "4"}), ["b", "d"])
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(PackageFingerprintsTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,77 @@
+# coding=utf-8
+"""Package manifest test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'test@gmail.com'
+__date__ = '2024-10-09'
+__copyright__ = 'Copyright 2024, PSA'
+
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from core.package_manifest import MANIFEST_NAME, PhaseTimer, build_manifest, verify_manifest, write_manifest
+
+
+class PackageManifestTest(unittest.TestCase):
+    """Test writing and verifying package manifests."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.folder = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.folder, "DCIM"))
+        with open(os.path.join(self.folder, "DCIM", "photo.jpg"), "wb") as f:
+            f.write(b"jpeg")
+
+        connection = sqlite3.connect(os.path.join(self.folder, "data.gpkg"))
+        connection.execute("CREATE TABLE gpkg_contents (table_name TEXT, data_type TEXT)")
+        connection.execute("CREATE TABLE bldg (id INTEGER)")
+        connection.executemany("INSERT INTO bldg VALUES (?)", [(1,), (2,), (3,)])
+        connection.execute("INSERT INTO gpkg_contents VALUES ('bldg', 'features')")
+        connection.commit()
+        connection.close()
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.folder)
+
+    def test_manifest_contents(self):
+        """Files are listed with their checksums and GeoPackage tables are counted."""
+        timer = PhaseTimer()
+        with timer.phase("export"):
+            pass
+        manifest = build_manifest(self.folder, "012345678", sources=["/missing.gpkg"], timings=timer.timings)
+
+        files = {entry["path"]: entry for entry in manifest["files"]}
+        self.assertEqual(sorted(files), ["DCIM/photo.jpg", "data.gpkg"])
+        self.assertEqual(files["DCIM/photo.jpg"]["sha256"], hashlib.sha256(b"jpeg").hexdigest())
+        self.assertEqual(manifest["layers"], {"data.gpkg/bldg": 3})
+        self.assertEqual(manifest["sources"], [{"path": "/missing.gpkg", "missing": True}])
+        self.assertIn("export", manifest["timings"])
+
+    def test_verify(self):
+        """Changed, missing and unlisted files are reported."""
+        write_manifest(self.folder, build_manifest(self.folder, "012345678"))
+        self.assertEqual(verify_manifest(self.folder), [])
+
+        with open(os.path.join(self.folder, "DCIM", "photo.jpg"), "wb") as f:
+            f.write(b"JPEG")
+        with open(os.path.join(self.folder, "extra.txt"), "w") as f:
+            f.write("extra")
+        self.assertEqual(verify_manifest(self.folder), ["DCIM/photo.jpg: checksum differs", "extra.txt: not in the manifest"])
+        self.assertTrue(os.path.exists(os.path.join(self.folder, MANIFEST_NAME)))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(PackageManifestTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
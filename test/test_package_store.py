@@ -0,0 +1,71 @@
+# coding=utf-8
+"""Package store test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'test@gmail.com'
+__date__ = '2024-10-09'
+__copyright__ = 'Copyright 2024, PSA'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from core.package_store import PackageStore
+
+
+class PackageStoreTest(unittest.TestCase):
+    """Test sharing package files through the store."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.folder = tempfile.mkdtemp()
+        self.source = os.path.join(self.folder, "basemap.tif")
+        with open(self.source, "wb") as f:
+            f.write(b"tiff")
+        for geocode in ("01", "02"):
+            os.makedirs(os.path.join(self.folder, geocode))
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.folder)
+
+    def test_shared_file(self):
+        """A read-only file is stored once and linked into each package."""
+        store = PackageStore(self.folder)
+        first = store.place(self.source, os.path.join(self.folder, "01", "basemap.tif"))
+        second = store.place(self.source, os.path.join(self.folder, "02", "basemap.tif"))
+        self.assertEqual(first, second)
+        self.assertTrue(first.endswith(".tif"))
+        for geocode in ("01", "02"):
+            with open(os.path.join(self.folder, geocode, "basemap.tif"), "rb") as f:
+                self.assertEqual(f.read(), b"tiff")
+
+        self.assertEqual(os.stat(first).st_mode & 0o777, 0o444)
+
+        store.save()
+        self.assertIn(os.path.abspath(self.source), PackageStore(self.folder).index)
+
+    def test_editable_file(self):
+        """Editing the copy of an editable file leaves the store and the other packages alone."""
+        store = PackageStore(self.folder)
+        destination = os.path.join(self.folder, "01", "basemap.tif")
+        stored_path = store.place(self.source, destination, editable=True)
+        # Placed again, over the previous copy
+        stored_path = store.place(self.source, destination, editable=True)
+        with open(destination, "wb") as f:
+            f.write(b"edited")
+        with open(stored_path, "rb") as f:
+            self.assertEqual(f.read(), b"tiff")
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(PackageStoreTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,75 @@
+# coding=utf-8
+"""Project restyle test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'test@gmail.com'
+__date__ = '2024-10-09'
+__copyright__ = 'Copyright 2024, PSA'
+
+import unittest
+import xml.etree.ElementTree as ET
+
+from core.project_restyle import STYLE_FINGERPRINT_PROPERTY, ProjectStyle, restyle_project_xml
+
+PROJECT = b"""<qgis version="3.28"><projectlayers>
+<maplayer type="vector" maxScale="0"><id>bgy_1</id><layername>0101_bgy</layername>
+<renderer-v2 type="singleSymbol"/>
+<customproperties><Option type="Map">
+<Option name="remoteLayerId" type="QString" value="layer"/>
+</Option></customproperties></maplayer>
+<maplayer type="vector"><id>other</id><layername>other</layername><renderer-v2 type="old"/></maplayer>
+</projectlayers></qgis>"""
+
+STYLE = ProjectStyle(
+    attributes={"maxScale": "500"},
+    sections=[
+        ET.fromstring('<renderer-v2 type="RuleRenderer"/>'),
+        ET.fromstring('<labeling type="simple"/>'),
+        ET.fromstring(
+            '<customproperties><Option type="Map">'
+            '<Option name="remoteLayerId" type="QString" value="stale"/>'
+            '<Option name="embeddedWidgets/count" type="QString" value="0"/>'
+            '</Option></customproperties>'
+        ),
+    ],
+    fingerprint="abc",
+)
+
+
+class ProjectRestyleTest(unittest.TestCase):
+    """Test patching styles into project XML."""
+
+    def test_restyle_matching_layers(self):
+        """Matching layers get the style, others are left alone."""
+        xml_bytes, restyled, unchanged = restyle_project_xml(PROJECT, {"bgy": STYLE})
+        self.assertEqual((restyled, unchanged), (["0101_bgy"], []))
+
+        layers = ET.fromstring(xml_bytes).findall(".//maplayer")
+        self.assertEqual(layers[0].get("maxScale"), "500")
+        self.assertEqual(layers[0].find("renderer-v2").get("type"), "RuleRenderer")
+        self.assertIsNotNone(layers[0].find("labeling"))
+        self.assertEqual(layers[1].find("renderer-v2").get("type"), "old")
+
+        properties = {o.get("name"): o.get("value") for o in layers[0].find("customproperties/Option")}
+        self.assertEqual(properties["remoteLayerId"], "layer")
+        self.assertEqual(properties["embeddedWidgets/count"], "0")
+        self.assertEqual(properties[STYLE_FINGERPRINT_PROPERTY], "abc")
+
+    def test_skip_up_to_date_layers(self):
+        """Layers already carrying the style are not rewritten."""
+        xml_bytes, _restyled, _unchanged = restyle_project_xml(PROJECT, {"bgy": STYLE})
+        xml_bytes, restyled, unchanged = restyle_project_xml(xml_bytes, {"bgy": STYLE})
+        self.assertIsNone(xml_bytes)
+        self.assertEqual((restyled, unchanged), ([], ["0101_bgy"]))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(ProjectRestyleTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
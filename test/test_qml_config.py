@@ -0,0 +1,76 @@
+# coding=utf-8
+"""QML config cache test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'test@gmail.com'
+__date__ = '2024-10-09'
+__copyright__ = 'Copyright 2024, PSA'
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from core.qml_config import KEEP_ALL_FIELDS, QmlConfig, validate_config
+
+
+class QmlConfigTest(unittest.TestCase):
+    """Test the cached QML configuration."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.folder = tempfile.mkdtemp()
+        self.config_path = os.path.join(self.folder, "qml_config.json")
+        open(os.path.join(self.folder, "bgy.qml"), "w").close()
+        self.write({"qml_files": {"bgy": "bgy.qml", "landmark": "landmark.qml"}, "layer_order": ["landmark", "bgy"]})
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.folder)
+
+    def write(self, data):
+        with open(self.config_path, "w") as f:
+            json.dump(data, f)
+
+    def test_missing_files(self):
+        """Missing QML files are resolved up front and left out of the paths."""
+        config = QmlConfig(self.config_path)
+        self.assertEqual(config.qml_path("bgy"), os.path.join(self.folder, "bgy.qml"))
+        self.assertIsNone(config.qml_path("landmark"))
+        self.assertEqual(list(config.missing_files()), ["landmark"])
+        self.assertEqual(config.layer_order(), ["landmark", "bgy"])
+
+    def test_reload_on_change(self):
+        """The file is read again once it changes."""
+        config = QmlConfig(self.config_path)
+        self.assertEqual(config.roles(), ["bgy", "landmark"])
+        self.write({"qml_files": {"bgy": "bgy.qml"}, "layer_order": ["bgy"], "CBMS_Form_8": []})
+        self.assertEqual(config.roles(), ["bgy"])
+
+    def test_keep_fields(self):
+        """Fields kept in packages are read per role."""
+        self.write({"qml_files": {"bgy": "bgy.qml"}, "keep_fields": {"bgy": ["REMARKS"], "road": "*"}})
+        config = QmlConfig(self.config_path)
+        self.assertEqual(config.keep_fields("bgy"), ["REMARKS"])
+        self.assertEqual(config.keep_fields("road"), KEEP_ALL_FIELDS)
+        self.assertEqual(config.keep_fields(None), [])
+        self.assertEqual(len(validate_config({"qml_files": {}, "keep_fields": {"bgy": "REMARKS"}})), 1)
+
+    def test_validation(self):
+        """Layout problems are reported."""
+        self.assertEqual(validate_config({"qml_files": {"bgy": "bgy.qml"}, "layer_order": ["bgy"]}), [])
+        self.assertEqual(len(validate_config({"qml_files": {"bgy": 1}, "layer_order": ["road"]})), 2)
+        self.assertTrue(validate_config([]))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(QmlConfigTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,59 @@
+# coding=utf-8
+"""Render profiler smoke test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'test@gmail.com'
+__date__ = '2024-10-09'
+__copyright__ = 'Copyright 2024, PSA'
+
+import unittest
+
+from qgis.core import QgsFeature, QgsGeometry, QgsMapSettings, QgsPointXY, QgsRectangle, QgsVectorLayer
+from qgis.PyQt.QtCore import QSize
+
+from core.render_profiler import format_report, profile_layers
+
+from .utilities import get_qgis_app
+QGIS_APP = get_qgis_app()
+
+
+class RenderProfilerTest(unittest.TestCase):
+    """Test profiling layers with real render jobs."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.layer = QgsVectorLayer("Point?crs=EPSG:3857&field=name:string", "bldg_point", "memory")
+        features = []
+        for i in range(10):
+            feature = QgsFeature(self.layer.fields())
+            feature.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(i * 10, i * 10)))
+            feature.setAttributes([str(i)])
+            features.append(feature)
+        self.layer.dataProvider().addFeatures(features)
+
+        self.settings = QgsMapSettings()
+        self.settings.setOutputSize(QSize(400, 400))
+        self.settings.setDestinationCrs(self.layer.crs())
+        self.settings.setExtent(QgsRectangle(-10, -10, 100, 100))
+
+    def test_profile_layers(self):
+        """Every layer gets a time, a feature count and a label count at every scale."""
+        profiles = profile_layers(self.settings, [self.layer], scales=(500, 1000), runs=1)
+        self.assertEqual([profile.scale for profile in profiles], [500, 1000])
+        for profile in profiles:
+            self.assertEqual(profile.layer_id, self.layer.id())
+            self.assertGreaterEqual(profile.render_ms, 0)
+            self.assertTrue(profile.visible)
+        self.assertIn("bldg_point", format_report(profiles))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(RenderProfilerTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
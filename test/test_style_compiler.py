@@ -0,0 +1,124 @@
+# coding=utf-8
+"""Style compiler test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'test@gmail.com'
+__date__ = '2024-10-09'
+__copyright__ = 'Copyright 2024, PSA'
+
+import unittest
+import xml.etree.ElementTree as ET
+
+from core.style_compiler import compile_style, verify_style
+
+STYLE = """<!DOCTYPE qgis PUBLIC 'http://mrcc.com/qgis.dtd' 'SYSTEM'>
+<qgis version="3.22.9" maxScale="0" minScale="100000">
+  <renderer-v2 type="singleSymbol">
+    <symbols>
+      <symbol type="marker" name="0">
+        <data_defined_properties>
+          <Option type="Map">
+            <Option value="" type="QString" name="name"/>
+            <Option name="properties"/>
+            <Option value="collection" type="QString" name="type"/>
+          </Option>
+        </data_defined_properties>
+        <layer class="SimpleMarker" enabled="1">
+          <Option type="Map">
+            <Option value="0" type="QString" name="angle"/>
+            <Option value="circle" type="QString" name="name"/>
+          </Option>
+          <prop k="angle" v="0"/>
+          <prop k="name" v="circle"/>
+        </layer>
+      </symbol>
+    </symbols>
+  </renderer-v2>
+  <fieldConfiguration>
+    <field name="remarks">
+      <editWidget type="TextEdit">
+        <config>
+          <Option type="Map">
+            <Option value="false" type="bool" name="IsMultiline"/>
+            <Option value="true" type="bool" name="UseHtml"/>
+          </Option>
+        </config>
+      </editWidget>
+    </field>
+  </fieldConfiguration>
+  <aliases>
+    <alias field="remarks" index="0" name=""/>
+    <alias field="geocode" index="1" name="Geocode"/>
+  </aliases>
+  <defaults>
+    <default field="remarks" expression="" applyOnUpdate="0"/>
+    <default field="geocode" expression="'0101'" applyOnUpdate="0"/>
+  </defaults>
+  <constraints>
+    <constraint field="remarks" constraints="0" notnull_strength="0" unique_strength="0" exp_strength="0"/>
+    <constraint field="geocode" constraints="1" notnull_strength="1" unique_strength="0" exp_strength="0"/>
+  </constraints>
+  <editable>
+    <field name="remarks" editable="1"/>
+    <field name="geocode" editable="0"/>
+  </editable>
+  <editforminitcodesource>0</editforminitcodesource>
+  <editforminitcode># unused template</editforminitcode>
+</qgis>
+"""
+
+
+class StyleCompilerTest(unittest.TestCase):
+    """Test the QML style compiler."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.compiled, self.removed = compile_style(STYLE)
+        self.root = ET.fromstring(self.compiled)
+
+    def test_removes_defaults(self):
+        """Default and unused entries are removed."""
+        self.assertEqual(self.removed["prop"], 2)
+        self.assertEqual(self.removed["data_defined_properties"], 1)
+        self.assertIsNone(self.root.find(".//symbol/data_defined_properties"))
+        self.assertEqual([e.get("field") for e in self.root.find("aliases")], ["geocode"])
+        self.assertEqual([e.get("field") for e in self.root.find("defaults")], ["geocode"])
+        self.assertEqual([e.get("field") for e in self.root.find("constraints")], ["geocode"])
+        self.assertEqual([e.get("name") for e in self.root.find("editable")], ["geocode"])
+        self.assertIsNone(self.root.find("editforminitcode").text)
+
+    def test_keeps_non_default_values(self):
+        """Values differing from the defaults are kept."""
+        options = self.root.find(".//editWidget/config/Option")
+        self.assertEqual([e.get("name") for e in options], ["UseHtml"])
+        self.assertEqual(len(self.root.find(".//layer/Option")), 2)
+
+    def test_keeps_mismatched_props(self):
+        """Legacy props are kept when they differ from the Option map."""
+        style = STYLE.replace('<prop k="angle" v="0"/>', '<prop k="angle" v="45"/>')
+        compiled, removed = compile_style(style)
+        self.assertEqual(removed["prop"], 0)
+        self.assertEqual(len(ET.fromstring(compiled).findall(".//layer/prop")), 2)
+
+    def test_verify(self):
+        """The compiled style passes verification and is stable."""
+        verified, _message = verify_style(STYLE, self.compiled)
+        self.assertNotEqual(verified, False)
+        self.assertEqual(compile_style(self.compiled)[0], self.compiled)
+
+    def test_rejects_other_documents(self):
+        """Only QGIS styles are compiled."""
+        with self.assertRaises(ValueError):
+            compile_style("<qlr/>")
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(StyleCompilerTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -18,9 +18,11 @@
  *                                                                         *
  ***************************************************************************/
 """
+import os
 from enum import Enum
 from pathlib import Path
 from typing import List, TypedDict, Union
+from urllib.parse import unquote
 
 PathLike = Union[Path, str]
 
@@ -61,3 +63,28 @@ def path_to_dict(path: PathLike, dirs_only: bool = False) -> DirectoryTreeDict:
     node["content"].sort(key=lambda node: node["path"].name)
 
     return node
+
+
+def normalize_layer_source(source: str) -> str:
+    """Normalize a layer source URI so the same dataset always yields the same key.
+
+    Handles plain paths, OGR style ``path|layername=...`` URIs and
+    ``file:///path?options`` URIs of the delimited text provider.
+    """
+    path, _sep, params = source.partition("|")
+    if path.startswith("file://"):
+        path = path[len("file://") :]
+        path, _sep, _query = path.partition("?")
+        if len(path) > 2 and path[0] == "/" and path[2] == ":":
+            # file:///C:/... on Windows
+            path = path[1:]
+        path = unquote(path)
+
+    if path.startswith("/vsi"):
+        # GDAL virtual filesystem paths are not local paths, keep them as they are
+        path = path.replace("\\", "/")
+    else:
+        path = os.path.normcase(os.path.normpath(os.path.abspath(path)))
+    options = sorted(option.strip().lower() for option in params.split("|") if option.strip())
+
+    return "|".join([path] + options)
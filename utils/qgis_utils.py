@@ -19,12 +19,12 @@
  ***************************************************************************/
 """
 
-from typing import List
+from typing import Iterable, List
 
 from libqfieldsync.project import ProjectConfiguration
 from libqfieldsync.utils.file_utils import get_project_in_folder
 from libqfieldsync.utils.qgis import open_project
-from qgis.core import QgsProject
+from qgis.core import QgsMapLayer, QgsProject, QgsProviderRegistry
 
 
 def import_checksums_of_project(dirname: str) -> List[str]:
@@ -34,3 +34,15 @@ def import_checksums_of_project(dirname: str) -> List[str]:
     original_project_path = ProjectConfiguration(project).original_project_path
     open_project(original_project_path)
     return ProjectConfiguration(project).imported_files_checksums
+
+
+def layer_source_paths(layers: Iterable[QgsMapLayer]) -> List[str]:
+    """Return the files the given layers read from, for file based providers."""
+    paths = set()
+    for layer in layers:
+        if layer is None or not layer.isValid():
+            continue
+        path = QgsProviderRegistry.instance().decodeUri(layer.providerType(), layer.source()).get("path")
+        if path:
+            paths.add(path)
+    return sorted(paths)